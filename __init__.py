@@ -11,133 +11,59 @@ bl_info = {
 
 if "bpy" in locals():
     import imp
-    imp.reload(mirror_tools)
-    imp.reload(common)
+    for module in (lazy, profiling, mirror_utils, rig_utils, state_utils, mirror_tools, common):
+        imp.reload(module)
 else:
+    from . import lazy, profiling
+    # Algorithm modules only run on first use, operator and handler modules are needed by register
+    mirror_utils = lazy.lazy_import('.mirror_utils', __name__)
+    rig_utils = lazy.lazy_import('.rig_utils', __name__)
+    state_utils = lazy.lazy_import('.state_utils', __name__)
     from . import mirror_tools, common
 
-import bpy, time, math
-from bpy.props import FloatProperty, BoolProperty, IntProperty, EnumProperty, StringProperty, PointerProperty
-from mathutils import Matrix
+import bpy, os, time
+np = lazy.lazy_import('numpy')
+from .profiling import profiler
+from bpy.props import BoolProperty, IntProperty, EnumProperty, StringProperty, PointerProperty
+from bpy_extras.io_utils import ExportHelper
 
 # BUGS:
 # - Apply metarig mirror pivot / object origin error
 
-extra_exception = [
-    'DEF-upper_arm.02.L',
-    'DEF-upper_arm.02.R',
-    
-    'DEF-forearm.02.L',
-    'DEF-forearm.02.R',
-    
-    'DEF-thumb.01.L.02',
-    'DEF-thumb.01.R.02',
-    
-    'DEF-f_index.01.L.02',
-    'DEF-f_index.01.R.02',
-    
-    'DEF-f_middle.01.L.02',
-    'DEF-f_middle.01.R.02',
-    
-    'DEF-f_ring.01.L.02',
-    'DEF-f_ring.01.R.02',
-    
-    'DEF-f_pinky.01.L.02',
-    'DEF-f_pinky.01.R.02',
-    
-    'DEF-thigh.02.L',
-    'DEF-thigh.02.R',
-    
-    'DEF-shin.02.L',
-    'DEF-shin.02.R',
-
-    'heel.L',
-    'heel.R',
-
-    'heel.02.L',
-    'heel.02.R'
-]
-
-def_names = { 'hips' : 'DEF-hips',
-         'spine' : 'DEF-spine',
-         'chest' : 'DEF-chest',
-         'neck' : 'DEF-neck',
-         'head' : 'DEF-head',
-         
-         'shoulder.L' : 'DEF-shoulder.L',
-         'shoulder.R' : 'DEF-shoulder.R',
-         
-         'upper_arm.L' : 'DEF-upper_arm.01.L',
-         'upper_arm.R' : 'DEF-upper_arm.01.R',
-         
-         'forearm.L' : 'DEF-forearm.01.L',
-         'forearm.R' : 'DEF-forearm.01.R',
-         
-         'hand.L' : 'DEF-hand.L',
-         'hand.R' : 'DEF-hand.R',
-         
-         'palm.01.L' : 'DEF-palm.01.L',
-         'palm.02.L' : 'DEF-palm.02.L',
-         'palm.03.L' : 'DEF-palm.03.L',
-         'palm.04.L' : 'DEF-palm.04.L',
-         
-         'palm.01.R' : 'DEF-palm.01.R',
-         'palm.02.R' : 'DEF-palm.02.R',
-         'palm.03.R' : 'DEF-palm.03.R',
-         'palm.04.R' : 'DEF-palm.04.R',
-         
-         'thumb.01.L' : 'DEF-thumb.01.L.01',
-         'thumb.02.L' : 'DEF-thumb.02.L',
-         'thumb.03.L' : 'DEF-thumb.03.L',
-         
-         'thumb.01.R' : 'DEF-thumb.01.R.01',
-         'thumb.02.R' : 'DEF-thumb.02.R',
-         'thumb.03.R' : 'DEF-thumb.03.R',
-         
-         'f_index.01.L' : 'DEF-f_index.01.L.01',
-         'f_index.02.L' : 'DEF-f_index.02.L',
-         'f_index.03.L' : 'DEF-f_index.03.L',
-         
-         'f_index.01.R' : 'DEF-f_index.01.R.01',
-         'f_index.02.R' : 'DEF-f_index.02.R',
-         'f_index.03.R' : 'DEF-f_index.03.R',
-         
-         'f_middle.01.L' : 'DEF-f_middle.01.L.01',
-         'f_middle.02.L' : 'DEF-f_middle.02.L',
-         'f_middle.03.L' : 'DEF-f_middle.03.L',
-         
-         'f_middle.01.R' : 'DEF-f_middle.01.R.01',
-         'f_middle.02.R' : 'DEF-f_middle.02.R',
-         'f_middle.03.R' : 'DEF-f_middle.03.R',
-         
-         'f_ring.01.L' : 'DEF-f_ring.01.L.01',
-         'f_ring.02.L' : 'DEF-f_ring.02.L',
-         'f_ring.03.L' : 'DEF-f_ring.03.L',
-         
-         'f_ring.01.R' : 'DEF-f_ring.01.R.01',
-         'f_ring.02.R' : 'DEF-f_ring.02.R',
-         'f_ring.03.R' : 'DEF-f_ring.03.R',
-         
-         'f_pinky.01.L' : 'DEF-f_pinky.01.L.01',
-         'f_pinky.02.L' : 'DEF-f_pinky.02.L',
-         'f_pinky.03.L' : 'DEF-f_pinky.03.L',
-         
-         'f_pinky.01.R' : 'DEF-f_pinky.01.R.01',
-         'f_pinky.02.R' : 'DEF-f_pinky.02.R',
-         'f_pinky.03.R' : 'DEF-f_pinky.03.R',
-         
-         'thigh.L' : 'DEF-thigh.01.L',
-         'thigh.R' : 'DEF-thigh.01.R',
-         
-         'shin.L' : 'DEF-shin.01.L',
-         'shin.R' : 'DEF-shin.01.R',
-         
-         'foot.L' : 'DEF-foot.L',
-         'foot.R' : 'DEF-foot.R',
-         
-         'toe.L' : 'DEF-toe.L',
-         'toe.R' : 'DEF-toe.R'
-       }
+# Rigify bone map is only built the first time it's needed
+rigify_bone_map = None
+
+def get_rigify_bone_map():
+    global rigify_bone_map
+    if not rigify_bone_map:
+        from . import rigify_names
+        rigify_bone_map = rig_utils.BoneNameMap(rigify_names.def_names, rigify_names.extra_exception,
+                split_bones=('upper_arm', 'forearm', 'thigh', 'shin'))
+    return rigify_bone_map
+
+# User bone map files, keyed by path with file modification time
+custom_bone_maps = {}
+
+# Get bone name mapping, custom mapping file can be used for non rigify rigs.
+# Invalid file is reported as warning on operator and built-in map is used instead.
+def get_bone_name_map(scene, operator=None):
+    props = scene.basemesh_tools_props
+    if not props.bone_map_file:
+        return get_rigify_bone_map()
+
+    path = bpy.path.abspath(props.bone_map_file)
+    try:
+        mtime = os.path.getmtime(path)
+        cached = custom_bone_maps.get(path)
+        if not cached or cached[0] != mtime:
+            cached = (mtime, rig_utils.BoneNameMap.from_json(path))
+            custom_bone_maps[path] = cached
+        return cached[1]
+    except (OSError, ValueError) as e:
+        message = 'Cannot load bone map file ' + path + ', using Rigify bone names: ' + str(e)
+        if operator: operator.report({'WARNING'}, message)
+        else: print(message)
+        return get_rigify_bone_map()
 
 # Potentially cause DAG zero error
 def make_layers_active(obj):
@@ -167,148 +93,22 @@ def no_active_object_error_prevention():
         # Return false if any object is not found
         return False
 
-def remember(object_action = False, remember_metarig = True):
+# Only given objects are remembered if objects is not None. Selected and active
+# objects are added since operators usually deselect everything and leave their mode
+def remember(object_action = False, remember_metarig = True, objects = None):
     scene = bpy.context.scene
     props = scene.basemesh_tools_props
 
-    global ori_selects
-    global ori_active
-    global ori_scene_layers
-    global ori_object_layers
-    global ori_object_mode
-    global ori_object_hides
-    global ori_object_actions
-    global ori_rig_layers
-    global ori_rig_bone_hides
-    global ori_rig_bone_hide_selects
-    global ori_rig_bone_matrices
-    #global ori_selected_bones
-    #global ori_active_bones
-    
-    ori_selects = [o for o in bpy.context.selected_objects]
-    ori_active = scene.objects.active
-
-    ori_scene_layers = [l for l in scene.layers]
-    ori_object_layers = {}
-    for o in scene.objects:
-        ori_object_layers[o.name] = [l for l in o.layers]
-
-    ori_object_mode = {}
-    for o in scene.objects:
-        ori_object_mode[o.name] = o.mode
-
-    ori_object_hides = []
-    for o in scene.objects:
-        if o.hide:
-            ori_object_hides.append(o.name)
-
-    #ori_object_actions = {}
-    #for o in scene.objects:
-    #    if o.animation_data and o.animation_data.action:
-    #        ori_object_actions[o.name] = o.animation_data.action
-
-    ori_rig_layers = {}
-    ori_rig_bone_hides = {}
-    ori_rig_bone_hide_selects = {}
-    ori_rig_bone_matrices = {}
-
-    for o in scene.objects:
-        if o.type == 'ARMATURE':
-
-            if not remember_metarig and o == scene.objects.get(props.metarig_object):
-                continue
-
-            hides = {}
-            hide_selects = {}
-            matrices = {}
-
-            for bone in o.data.bones:
-                hides[bone.name] = bone.hide
-                hide_selects[bone.name] = bone.hide_select
-                #if not any([prefix for prefix in {'DEF-', 'MCH-', 'ORG-'} if prefix in bone.name]):
-                pose_bone = o.pose.bones.get(bone.name)
-                matrices[bone.name] = pose_bone.matrix_basis.copy()
-
-            ori_rig_bone_hides[o.name] = hides
-            ori_rig_bone_hide_selects[o.name] = hide_selects
-            ori_rig_bone_matrices[o.name] = matrices
-            ori_rig_layers[o.name] = [l for l in o.data.layers]
-
-def revert():
-    scene = bpy.context.scene
+    skip_armatures = set()
+    if not remember_metarig:
+        skip_armatures.add(props.metarig_object)
 
-    # Revert selection
-    bpy.ops.object.mode_set(mode='OBJECT')
-    bpy.ops.object.select_all(action='DESELECT')
+    if objects is not None:
+        objects = list(objects) + list(bpy.context.selected_objects)
+        if scene.objects.active: objects.append(scene.objects.active)
+        objects = {o.name : o for o in objects}.values()
 
-    for o in ori_selects:
-        o.select = True
-
-    # Revert mode
-    for name, mode in ori_object_mode.items():
-        o = scene.objects.get(name)
-        if o and common.in_active_layers(o) and o.mode != mode:
-            scene.objects.active = o
-            bpy.ops.object.mode_set(mode=mode)
-        
-    # Revert active
-    if ori_active:
-        scene.objects.active = ori_active
-        #bpy.ops.object.mode_set(mode=ori_mode)
-
-    # Revert scene layers
-    for i, l in enumerate(ori_scene_layers):
-        scene.layers[i] = l
-
-    # Revert object layers
-    for name, layers in ori_object_layers.items():
-        o = scene.objects.get(name)
-        if o:
-            for i, l in enumerate(layers):
-                if o.layers[i] != l:
-                    o.layers[i] = l
-
-    # Revert rig layers
-    #print('aaaaaaaa')
-    for name, layers in ori_rig_layers.items():
-        o = scene.objects.get(name)
-        if o:
-            #print(o.name)
-            for i, l in enumerate(layers):
-                if o.data.layers[i] != l:
-                    o.data.layers[i] = l
-
-    # Revert object hide
-    for name in ori_object_hides:
-        o = scene.objects.get(name)
-        if o:
-            o.hide = True
-
-    # Revert object anim
-    #for name, action in ori_object_actions.items():
-    #    o = scene.objects.get(name)
-    #    if o:
-    #        o.animation_data.action = action
-
-    # Revert bone hide
-    for name, hides in ori_rig_bone_hides.items():
-        o = scene.objects.get(name)
-        if o and o.type == 'ARMATURE':
-            hide_selects = ori_rig_bone_hide_selects[name]
-            for bone_name, hide in hides.items():
-                bone = o.data.bones.get(bone_name)
-                if bone:
-                    bone.hide = hide
-                    bone.hide_select = hide_selects[bone_name]
-
-    # Revert bone matrices
-    for name, matrices in ori_rig_bone_matrices.items():
-        o = scene.objects.get(name)
-        if o and o.type == 'ARMATURE':
-            for bone_name, matrix in matrices.items():
-                pbone = o.pose.bones.get(bone_name)
-                if pbone:
-                    pbone.matrix_basis = matrix
+    return state_utils.SceneState(scene, skip_armatures, objects)
 
 # This function assume only object is active, selected and on object mode
 # The return is same state
@@ -345,10 +145,7 @@ def create_shape_keys_objects(obj):
         print('Begin removing', dup_obj.name, 'shape keys')
 
         # Copy current shape key value to mesh data
-        for j, v in enumerate(dup_obj.data.vertices):
-            v.co.x = key.data[j].co.x
-            v.co.y = key.data[j].co.y
-            v.co.z = key.data[j].co.z
+        common.set_coords(dup_obj.data.vertices, common.get_coords(key.data))
 
         # Set only this key as 1.0 on delete other keys on duplicated object
         #for j, dkb in reversed(list(enumerate(dup_obj.data.shape_keys.key_blocks))):
@@ -411,13 +208,174 @@ def shape_keys_recover(obj, key_objs, first_key_name):
         splitted = kb.name.split('__')
         kb.name = splitted[0]
 
-def is_matrix_close(matrix_a, matrix_b, rel_tol=1e-02):
-    for i, vec in enumerate(matrix_a):
-        for j, val in enumerate(vec):
-            if not math.isclose(val, matrix_b[i][j], rel_tol=rel_tol):
-                return False
+# Shape key settings that are lost when shape keys are removed
+shape_key_attrs = ('slider_min', 'slider_max', 'vertex_group', 'interpolation', 'mute')
+
+def get_shape_key_settings(obj):
+    settings = []
+    for kb in obj.data.shape_keys.key_blocks:
+        setting = {attr : getattr(kb, attr) for attr in shape_key_attrs}
+        setting['name'] = kb.name
+        setting['relative_key'] = kb.relative_key.name
+        settings.append(setting)
+    return settings
+
+# Evaluate coordinates deformed by modifiers, return (k, n, 3) array with a row for every
+# shape key index in key_indices, or a single row for the mesh if key_indices is None.
+# Keys are evaluated one by one on a single scratch object which share the mesh
+# and only has the modifiers to evaluate, so only one evaluated mesh exists at a time.
+def bake_deformed_coords(obj, mods, key_indices=None):
+    scene = bpy.context.scene
+    num_verts = len(obj.data.vertices)
+
+    scratch_obj = obj.copy()
+    scene.objects.link(scratch_obj)
+
+    mod_names = {mod.name for mod in mods}
+    for mod in [m for m in scratch_obj.modifiers if m.name not in mod_names]:
+        scratch_obj.modifiers.remove(mod)
+    for mod in scratch_obj.modifiers:
+        mod.show_viewport = True
+
+    # Evaluate only active shape key at full value
+    key_blocks = []
+    if key_indices is None:
+        key_indices = [None]
+    else:
+        key_indices = list(key_indices)
+        scratch_obj.show_only_shape_key = True
+        key_blocks = obj.data.shape_keys.key_blocks
+
+    # Solo key still honors mute and vertex group, clear them on the shared key
+    # so muted keys aren't baked as basis and masked keys aren't masked twice
+    key_states = [(kb.mute, kb.vertex_group) for kb in key_blocks]
+    try:
+        for kb in key_blocks:
+            kb.mute = False
+            kb.vertex_group = ''
+
+        coords = np.empty((len(key_indices), num_verts * 3), dtype=np.float32)
+        for i, key_index in enumerate(key_indices):
+            if key_index is not None:
+                scratch_obj.active_shape_key_index = key_index
+            mesh = scratch_obj.to_mesh(scene, True, 'PREVIEW')
+            mesh.vertices.foreach_get('co', coords[i])
+            bpy.data.meshes.remove(mesh, do_unlink=True)
+    finally:
+        for kb, (mute, vertex_group) in zip(key_blocks, key_states):
+            kb.mute = mute
+            kb.vertex_group = vertex_group
+
+        scene.objects.unlink(scratch_obj)
+        bpy.data.objects.remove(scratch_obj, do_unlink=True)
+
+    return coords.reshape(len(coords), num_verts, 3)
+
+# Write coordinates deformed by modifiers to mesh and all of its shape keys
+# without applying the modifiers. Pose should be already updated.
+# Keys keep their mute and vertex group, so they are baked at full shape
+def evaluate_object(obj, mods):
+    mesh = obj.data
+    if mesh.shape_keys:
+        key_blocks = mesh.shape_keys.key_blocks
+        coords = bake_deformed_coords(obj, mods, range(len(key_blocks)))
+        common.set_shape_key_coords(key_blocks, coords)
+    else:
+        coords = bake_deformed_coords(obj, mods)
+
+    common.set_coords(mesh.vertices, coords[0])
+    mesh.update()
+
+# Add back shape keys with baked coordinates and their settings, current mesh is the basis.
+# This function assume object is active and has no shape keys
+def shape_keys_restore(obj, settings, key_coords):
+    key_blocks = [obj.shape_key_add(name=settings[0]['name'], from_mix=False)]
+    for setting, co in zip(settings[1:], key_coords):
+        kb = obj.shape_key_add(name=setting['name'], from_mix=False)
+        common.set_coords(kb.data, co)
+        key_blocks.append(kb)
+
+    key_blocks_by_name = obj.data.shape_keys.key_blocks
+    for kb, setting in zip(key_blocks, settings):
+        for attr in shape_key_attrs:
+            setattr(kb, attr, setting[attr])
+        relative_key = key_blocks_by_name.get(setting['relative_key'])
+        if relative_key: kb.relative_key = relative_key
+
+# Check if armature modifier can be evaluated by rig_utils skinning
+def is_skinnable_modifier(obj, mod):
+    if not (obj.type == 'MESH' and mod.type == 'ARMATURE' and mod.object and
+            mod.use_vertex_groups and not mod.use_bone_envelopes and
+            not mod.use_deform_preserve_volume and not mod.use_multi_modifier and
+            not mod.vertex_group):
+        return False
+
+    # Segmented B-Bones bend along their length, one matrix per bone can't do that
+    bones = mod.object.data.bones
+    for vg in obj.vertex_groups:
+        bone = bones.get(vg.name)
+        if bone and bone.use_deform and bone.bbone_segments > 1:
+            return False
+
     return True
 
+# Get rest and pose bone matrices for each vertex group of the object
+def get_group_bone_matrices(obj, arm_obj):
+    num_groups = len(obj.vertex_groups)
+    rest_matrices = np.tile(np.identity(4), (num_groups, 1, 1))
+    pose_matrices = rest_matrices.copy()
+    deform_groups = np.zeros(num_groups, dtype=bool)
+
+    for vg in obj.vertex_groups:
+        pb = arm_obj.pose.bones.get(vg.name)
+        if not pb or not pb.bone.use_deform: continue
+        rest_matrices[vg.index] = pb.bone.matrix_local
+        pose_matrices[vg.index] = pb.matrix
+        deform_groups[vg.index] = True
+
+    return rest_matrices, pose_matrices, deform_groups
+
+# Read everything needed to skin object by armature modifiers, skinning itself
+# doesn't touch blender data so it can run on other thread. Pose should be already updated
+def get_skinning_data(obj, mods):
+    mesh = obj.data
+    vert_ids, group_ids, weights = common.get_weight_matrix(obj).entries()
+
+    key_blocks = mesh.shape_keys.key_blocks if mesh.shape_keys else []
+    coords = np.stack([common.get_coords(mesh.vertices)] + [common.get_coords(kb.data) for kb in key_blocks])
+
+    armatures = []
+    for mod in mods:
+        arm_obj = mod.object
+        rest_matrices, pose_matrices, deform_groups = get_group_bone_matrices(obj, arm_obj)
+        premat = np.array(arm_obj.matrix_world.inverted() * obj.matrix_world)
+        group_matrices = rig_utils.skinning_matrices(rest_matrices, pose_matrices, premat)
+        armatures.append((group_matrices, deform_groups))
+
+    return coords, vert_ids, group_ids, weights, armatures
+
+# Write skinned mesh and shape keys coordinates
+def set_skinned_coords(obj, coords):
+    mesh = obj.data
+    common.set_coords(mesh.vertices, coords[0])
+    if mesh.shape_keys:
+        common.set_shape_key_coords(mesh.shape_keys.key_blocks, coords[1:])
+    mesh.update()
+
+# Deform mesh and all of its shape keys by armature modifiers without applying them
+# Pose should be already updated
+def skin_object(obj, mods):
+    set_skinned_coords(obj, rig_utils.skin_coords(*get_skinning_data(obj, mods)))
+
+# Return function result with its run time
+def timed_call(func, *args):
+    start_time = time.time()
+    result = func(*args)
+    return result, time.time() - start_time
+
+def is_matrix_close(matrix_a, matrix_b, rel_tol=1e-02):
+    return bool(rig_utils.matrices_close(matrix_a, matrix_b, rel_tol=rel_tol))
+
 class ApplyMetarigTransform(bpy.types.Operator):
     """Apply metarig transform"""
     bl_idname = "mesh.apply_metarig_transform"
@@ -427,6 +385,20 @@ class ApplyMetarigTransform(bpy.types.Operator):
     symmetrize = BoolProperty(name='Symmetrize Rig', default=True)
     force_default_metarig_param = BoolProperty(name='Force Default Rigify Param', default=True)
 
+    bake_mode = EnumProperty(
+        name = "Bake Mode",
+        items=(
+            ('OPERATOR', "Apply Modifier", "Apply armature modifiers on duplicated shape key objects"),
+            ('SKINNING', "Direct Skinning", "Compute armature deformation directly, falls back to applying modifier if it's not supported"),
+            ('STREAM', "Stream Shape Keys", "Bake shape keys one by one on a single scratch object, uses much less memory than duplicating objects"),
+            ('EVALUATE', "Evaluate", "Write evaluated deformation to mesh and shape keys, modifiers are never applied")
+            ), 
+        default='OPERATOR',
+        )
+
+    num_threads = IntProperty(name='Skinning Threads', default=0, min=0,
+            description='Number of threads to skin objects on direct skinning mode, 0 to use all cores, 1 to skin objects one by one')
+
     @classmethod
     def poll(cls, context):
         scene = context.scene
@@ -435,17 +407,24 @@ class ApplyMetarigTransform(bpy.types.Operator):
         return metarig_obj
         #return True
 
+    @common.profiled
     def execute(self, context):
         scene = context.scene
         props = scene.basemesh_tools_props
         metarig_obj = scene.objects.get(props.metarig_object)
         rigify_obj = scene.objects.get(props.rigify_object)
+        bone_map = get_bone_name_map(scene, self)
 
         # This script need rigify legacy mode, so activate one if doesn't already
         original_legacy_mode = context.user_preferences.addons['rigify'].preferences.legacy_mode
         context.user_preferences.addons['rigify'].preferences.legacy_mode = True
 
-        remember(remember_metarig = False)
+        profiler.begin('remember')
+        scene_state = remember(remember_metarig = False)
+        profiler.end()
+
+        # Weights might be painted since last run
+        common.clear_weight_matrix_cache()
 
         if not no_active_object_error_prevention():
             self.report({'WARNING'}, "No object found in this layer!")
@@ -459,12 +438,10 @@ class ApplyMetarigTransform(bpy.types.Operator):
             make_layers_active(metarig_obj)
 
         # Populate list of transformed bones
-        transformed_bone_names = []
-        for pose_bone in metarig_obj.pose.bones:
-            if pose_bone.matrix_basis != Matrix():
-                transformed_bone_names.append(pose_bone.name)
+        transformed_bone_names = state_utils.PoseBuffer(metarig_obj.pose.bones).transformed_names()
 
         # Symmetrize rig
+        profiler.begin('symmetrize')
         if self.symmetrize:
 
             # Make metarig active and deselect all bones
@@ -517,7 +494,10 @@ class ApplyMetarigTransform(bpy.types.Operator):
                 bpy.ops.pose.copy()
                 bpy.ops.pose.paste(flipped=True)
 
+        profiler.end()
+
         # Force metarig parameters to default
+        profiler.begin('param reset')
         if self.force_default_metarig_param:
 
             # Create new temporary metarig
@@ -541,33 +521,28 @@ class ApplyMetarigTransform(bpy.types.Operator):
             bpy.data.armatures.remove(temp_arm, do_unlink=True)
             scene.objects.active = metarig_obj
 
-        # Get matrix basis of all bones
-        basis_matrices = {}
-        for pb in metarig_obj.pose.bones:
-            basis_matrices[pb.name] = pb.matrix_basis.copy()
+        profiler.end()
+
+        # Get pose of all bones
+        profiler.begin('rest pose')
+        pose_buffer = state_utils.PoseBuffer(metarig_obj.pose.bones)
 
         # Make the rig use rest pose
-        for pb in metarig_obj.pose.bones:
-            pb.matrix_basis = Matrix()
-        scene.update()
+        pose_buffer.reset(metarig_obj.pose.bones)
+        common.update_scene(scene)
 
         # Get rest world matrix
-        rest_world_matrices = {}
-        for pb in metarig_obj.pose.bones:
-            rest_world_matrices[pb.name] = pb.matrix.copy()
+        rest_world_matrices = common.get_pose_matrices(metarig_obj.pose.bones, 'matrix')
 
         # Revert bone to real pose
-        for pb in metarig_obj.pose.bones:
-            pb.matrix_basis = basis_matrices[pb.name]
-        scene.update()
+        pose_buffer.restore(metarig_obj.pose.bones)
+        common.update_scene(scene)
 
         # Get bones that has transformed world matrix
-        transformed_world_bone_names = []
-        for pose_bone in metarig_obj.pose.bones:
-            #print(pose_bone.name)
-            #print(pose_bone.matrix == rest_world_matrices[pose_bone.name])
-            if pose_bone.matrix != rest_world_matrices[pose_bone.name]:
-                transformed_world_bone_names.append(pose_bone.name)
+        world_matrices = common.get_pose_matrices(metarig_obj.pose.bones, 'matrix')
+        unchanged = rig_utils.matrices_close(world_matrices, rest_world_matrices, rel_tol=1e-6, abs_tol=1e-6)
+        transformed_world_bone_names = [pose_buffer.names[i] for i in np.nonzero(~unchanged)[0]]
+        profiler.end()
 
         # To store modifiers which using rigify
         rigify_modifiers = []
@@ -577,234 +552,308 @@ class ApplyMetarigTransform(bpy.types.Operator):
         bpy.ops.object.mode_set(mode='OBJECT')
         bpy.ops.object.select_all(action='DESELECT')
 
-        for o in scene.objects:
-
-            print('Processing', o.name)
-
-            #ori_location = o.location.copy()
+        # Skinned objects are independent once their data is read,
+        # so skinning can run on thread pool while next objects are processed
+        executor = None
+        if self.bake_mode == 'SKINNING' and self.num_threads != 1:
+            # Imported here so add-on startup doesn't pay for it
+            from concurrent.futures import ThreadPoolExecutor
+            executor = ThreadPoolExecutor(max_workers=self.num_threads or os.cpu_count() or 1)
+        skinning_jobs = []
+        object_timings = []
+
+        try:
+            for o in scene.objects:
 
-            # Search for modifiers to apply
-            armature_mod_copies = []
-            for i, mod in enumerate(o.modifiers):
+                print('Processing', o.name)
+                object_start_time = time.time()
 
-                if mod.type != 'ARMATURE': continue
-                if not mod.object: continue
+                #ori_location = o.location.copy()
 
-                #if o.name == 'Hair':
-                #    print('Hair Mod object:', mod.object.name)
+                # Search for modifiers to apply
+                armature_mod_copies = []
+                for i, mod in enumerate(o.modifiers):
 
-                #if mod.object == metarig_obj:
-                if mod.object in {metarig_obj, rigify_obj}:
+                    if mod.type != 'ARMATURE': continue
+                    if not mod.object: continue
 
-                    mod_copy = {}
-                    mod_copy['index'] = i
-                    attr_list = dir(mod)
-                    for attr in attr_list:
-                        if attr.startswith('__') or attr in {'bl_rna', 'rna_type', 'type'}: continue
-                        mod_copy[attr] = getattr(mod, attr)
-                    armature_mod_copies.append(mod_copy)
+                    #if o.name == 'Hair':
+                    #    print('Hair Mod object:', mod.object.name)
 
-                    # Change modifier object temporarily to metarig if using rigify
-                    if mod.object == rigify_obj:
-                        # Store some temprary variables
-                        rigify_modifiers.append(mod)
-                        if o not in using_rigify_objects: using_rigify_objects.append(o)
+                    #if mod.object == metarig_obj:
+                    if mod.object in {metarig_obj, rigify_obj}:
 
-                        # Change vertex groups to metarig
-                        for vg in o.vertex_groups:
-                            key = [key for key, value in def_names.items() if value == vg.name]
-                            if key: vg.name = key[0]
+                        mod_copy = {}
+                        mod_copy['index'] = i
 
-                        # Change modifier to use metarig
-                        mod.object = metarig_obj
+                        # Evaluate mode never remove the modifier, so no need to copy its attributes
+                        if self.bake_mode != 'EVALUATE':
+                            attr_list = dir(mod)
+                            for attr in attr_list:
+                                if attr.startswith('__') or attr in {'bl_rna', 'rna_type', 'type'}: continue
+                                mod_copy[attr] = getattr(mod, attr)
+                        armature_mod_copies.append(mod_copy)
 
-            #print(o.name)
-            #if o.name == 'Hair':
-            #    print(armature_mod_copies)
-            #    return {'FINISHED'}
+                        # Change modifier object temporarily to metarig if using rigify
+                        if mod.object == rigify_obj:
+                            # Store some temprary variables
+                            rigify_modifiers.append(mod)
+                            if o not in using_rigify_objects: using_rigify_objects.append(o)
 
-            if armature_mod_copies:
+                            # Change vertex groups to metarig
+                            bone_map.rename(o.vertex_groups, to_metarig=True)
 
-                scene.objects.active = o
-                # Make the layer active
-                if not common.in_active_layers(o):
-                    make_layers_active(o)
-                # Unhide object
-                if o.hide: o.hide = False
-                o.select = True
-                bpy.ops.object.mode_set(mode='OBJECT')
+                            # Change modifier to use metarig
+                            mod.object = metarig_obj
 
-                # Check if the object has mirror modifier
-                mirror_mods = [m for m in o.modifiers if m.type == 'MIRROR']
-                need_origin_adjustment = False
-                if mirror_mods:
-                    print(o.name, 'has mirror modifier!')
-
-                    # Check its object's vertex groups
-                    weights = {}
-                    for i, vg in enumerate(o.vertex_groups):
-                        weights[vg.name] = 0
-                        for v in o.data.vertices:
-                            for g in v.groups:
-                                if g.group == i:
-                                    weights[vg.name] += g.weight
-
-                    # Remove very small weights
-                    weights = {key:w for key, w in weights.items() if w > 0.9}
-                    #print(weights)
-
-                    # Get highest hierarchy bone
-                    num_parents = 9999
-                    top_bone = None
-                    for key, weight in weights.items():
-                        pose_bone = metarig_obj.pose.bones.get(key)
-                        if pose_bone:
-                            parents = pose_bone.parent_recursive
-                            if len(parents) < num_parents:
-                                num_parents = len(parents)
-                                top_bone = pose_bone
-
-                    # If top bone has transformed
-                    if top_bone and top_bone.name in transformed_world_bone_names:
-
-                        # For now only sample first mirror mod
-                        mirror_mod = mirror_mods[0]
-                        if mirror_mod.use_x and o.location[0] == metarig_obj.location[0]:
-                            pass
-                        elif mirror_mod.use_y and o.location[1] == metarig_obj.location[1]:
-                            pass
-                        elif mirror_mod.use_z and o.location[2] == metarig_obj.location[2]:
-                            pass
-                        else:
-                            need_origin_adjustment = True
-                            print(top_bone.name)
-
-                            #space = context.space_data
-                            #space.cursor_location = o.location
-
-                            # Create empty to for origin matrix reference
-                            bpy.ops.object.empty_add(type='PLAIN_AXES', radius=0.2, location=o.location)
-                            empty = scene.objects.active
-                            empty.layers[0] = True
-                            empty.name = 'empty_' + o.name
-                            empty.rotation_mode = o.rotation_mode
-                            empty.rotation_euler = o.rotation_euler.copy()
-                            empty.rotation_quaternion = o.rotation_quaternion.copy()
-                            empty.scale = o.scale.copy()
-                            #empty.select = False
-
-                            #print(empty.name)
-
-                            # Make rig to use rest pose first
-                            metarig_obj.data.pose_position = 'REST'
-                            scene.update()
-
-                            # Parent empty to top bone
-                            bpy.ops.object.select_all(action='DESELECT')
-                            empty.select = True
-                            metarig_obj.select = True
-                            scene.objects.active = metarig_obj
-                            bpy.ops.object.mode_set(mode='POSE')
-                            #bpy.ops.pose.select_all(action='DESELECT')
-                            top_bone_data = metarig_obj.data.bones.get(top_bone.name)
-                            #top_bone.select = True
-                            metarig_obj.data.bones.active = top_bone_data
-                            bpy.ops.object.parent_set(type='BONE')
-                            bpy.ops.object.mode_set(mode='OBJECT')
-                            bpy.ops.object.select_all(action='DESELECT')
-
-                            # Go back to real pose
-                            metarig_obj.data.pose_position = 'POSE'
-                            scene.update()
-
-                            # Back to select original object
-                            scene.objects.active = o
-
-                            # Rest top bone and all it parents before applying modifier
-                            top_bone_parents = top_bone.parent_recursive
-                            top_bone.matrix_basis = Matrix()
-                            for bone in top_bone_parents:
-                                bone.matrix_basis = Matrix()
-
-                            #scene.update()
-
-                # Dealing with shape keys
-                shape_keys_found = False
-                if o.data.shape_keys:
-                    shape_keys_found = True
-                    first_key_name = o.data.shape_keys.key_blocks[0].name
-
-                    # Remember state
-                    obj_state = common.ObjectState(o)
-                    mesh_state = common.MeshState(o.data)
-
-                    key_objs = create_shape_keys_objects(o)
-
-                    #return {'FINISHED'}
+                #print(o.name)
+                #if o.name == 'Hair':
+                #    print(armature_mod_copies)
+                #    return {'FINISHED'}
 
                 if armature_mod_copies:
-                    print('Begin applying armature modifiers of', o.name)
-
-                # Apply the modifiers
-                for mod_copy in armature_mod_copies:
-                    mod = o.modifiers[mod_copy['index']]
-                    bpy.ops.object.modifier_apply(apply_as='DATA', modifier=mod.name)
-
-                if shape_keys_found:
-                    print('Begin recover shape keys of', o.name)
-                    shape_keys_recover(o, key_objs, first_key_name)
-
-                    # Recover state
-                    obj_state.revert()
-                    mesh_state.revert()
-
-                    #return {'FINISHED'}
-
-                # If origin adjustment is needed
-                if need_origin_adjustment:
-
-                    # Revert bone basis matrix
-                    top_bone.matrix_basis = basis_matrices[top_bone.name]
-                    for bone in top_bone_parents:
-                        bone.matrix_basis = basis_matrices[bone.name]
+                    profiler.begin('bake ' + o.name)
 
-                    # Clear parent on empty object to get real matrix world
-                    bpy.ops.object.select_all(action='DESELECT')
-                    empty.select = True
-                    scene.objects.active = empty
-                    bpy.ops.object.parent_clear(type='CLEAR_KEEP_TRANSFORM')
                     scene.objects.active = o
-
-                    o.matrix_world = empty.matrix_world
-
-                    # Delete empty
-                    scene.objects.unlink(empty)
-                    bpy.data.objects.remove(empty, do_unlink=True)
-
-                # Add back modifier and set back its attributes
-                for mod_copy in armature_mod_copies:
-                    # New modifier
-                    bpy.ops.object.modifier_add(type='ARMATURE')
-
-                    # Get the new modifier
-                    last_idx = len(o.modifiers) - 1
-                    mod = o.modifiers[last_idx]
-
-                    # Set the attributes
-                    for attr, value in mod_copy.items():
-                        if attr != 'index':
-                            setattr(mod, attr, value)
-
-                    # Set back the original stack position
-                    if last_idx > 0:
-                        idx_diff = last_idx - mod_copy['index']
-                        for i in range(idx_diff):
-                            bpy.ops.object.modifier_move_up(modifier=mod.name)
-                #print('safe?')
-
-                #o.select = False
-                #if o.name == 'Head':
-                #    return {'FINISHED'}
+                    # Make the layer active
+                    if not common.in_active_layers(o):
+                        make_layers_active(o)
+                    # Unhide object
+                    if o.hide: o.hide = False
+                    o.select = True
+                    bpy.ops.object.mode_set(mode='OBJECT')
+
+                    # Check if the object has mirror modifier
+                    mirror_mods = [m for m in o.modifiers if m.type == 'MIRROR']
+                    need_origin_adjustment = False
+                    if mirror_mods:
+                        print(o.name, 'has mirror modifier!')
+
+                        # Check its object's vertex groups
+                        totals = common.get_weight_matrix(o).group_totals()
+                        weights = {vg.name : totals[vg.index] for vg in o.vertex_groups}
+
+                        # Remove very small weights
+                        weights = {key:w for key, w in weights.items() if w > 0.9}
+                        #print(weights)
+
+                        # Get highest hierarchy bone
+                        num_parents = 9999
+                        top_bone = None
+                        for key, weight in weights.items():
+                            pose_bone = metarig_obj.pose.bones.get(key)
+                            if pose_bone:
+                                parents = pose_bone.parent_recursive
+                                if len(parents) < num_parents:
+                                    num_parents = len(parents)
+                                    top_bone = pose_bone
+
+                        # If top bone has transformed
+                        if top_bone and top_bone.name in transformed_world_bone_names:
+
+                            # For now only sample first mirror mod
+                            mirror_mod = mirror_mods[0]
+                            if mirror_mod.use_x and o.location[0] == metarig_obj.location[0]:
+                                pass
+                            elif mirror_mod.use_y and o.location[1] == metarig_obj.location[1]:
+                                pass
+                            elif mirror_mod.use_z and o.location[2] == metarig_obj.location[2]:
+                                pass
+                            else:
+                                need_origin_adjustment = True
+                                print(top_bone.name)
+
+                                #space = context.space_data
+                                #space.cursor_location = o.location
+
+                                # Create empty to for origin matrix reference
+                                bpy.ops.object.empty_add(type='PLAIN_AXES', radius=0.2, location=o.location)
+                                empty = scene.objects.active
+                                empty.layers[0] = True
+                                empty.name = 'empty_' + o.name
+                                empty.rotation_mode = o.rotation_mode
+                                empty.rotation_euler = o.rotation_euler.copy()
+                                empty.rotation_quaternion = o.rotation_quaternion.copy()
+                                empty.scale = o.scale.copy()
+                                #empty.select = False
+
+                                #print(empty.name)
+
+                                # Make rig to use rest pose first
+                                metarig_obj.data.pose_position = 'REST'
+                                common.update_scene(scene)
+
+                                # Parent empty to top bone
+                                bpy.ops.object.select_all(action='DESELECT')
+                                empty.select = True
+                                metarig_obj.select = True
+                                scene.objects.active = metarig_obj
+                                bpy.ops.object.mode_set(mode='POSE')
+                                #bpy.ops.pose.select_all(action='DESELECT')
+                                top_bone_data = metarig_obj.data.bones.get(top_bone.name)
+                                #top_bone.select = True
+                                metarig_obj.data.bones.active = top_bone_data
+                                bpy.ops.object.parent_set(type='BONE')
+                                bpy.ops.object.mode_set(mode='OBJECT')
+                                bpy.ops.object.select_all(action='DESELECT')
+
+                                # Go back to real pose
+                                metarig_obj.data.pose_position = 'POSE'
+                                common.update_scene(scene)
+
+                                # Back to select original object
+                                scene.objects.active = o
+
+                                # Rest top bone and all it parents before applying modifier
+                                top_bone_names = [top_bone.name] + [b.name for b in top_bone.parent_recursive]
+                                pose_buffer.reset(metarig_obj.pose.bones, top_bone_names)
+
+                                #scene.update()
+
+                    # Use direct skinning if every armature modifier can be evaluated by it
+                    armature_mods = [o.modifiers[mod_copy['index']] for mod_copy in armature_mod_copies]
+                    direct_skinning = (self.bake_mode == 'SKINNING' and
+                            all(is_skinnable_modifier(o, mod) for mod in armature_mods))
+
+                    if direct_skinning:
+                        print('Begin skinning', o.name)
+                        profiler.begin('skinning')
+
+                        # Pose need to be updated if origin adjustment reset some bones
+                        if need_origin_adjustment:
+                            common.update_scene(scene)
+
+                        if executor:
+                            data, read_time = timed_call(get_skinning_data, o, armature_mods)
+                            future = executor.submit(timed_call, rig_utils.skin_coords, *data)
+                            skinning_jobs.append((o, read_time, future))
+                        else:
+                            skin_object(o, armature_mods)
+                        profiler.end()
+
+                    elif self.bake_mode == 'EVALUATE':
+                        print('Begin evaluating', o.name)
+                        profiler.begin('evaluate')
+
+                        if need_origin_adjustment:
+                            common.update_scene(scene)
+
+                        evaluate_object(o, armature_mods)
+                        profiler.end()
+
+                    else:
+                        # Dealing with shape keys
+                        shape_keys_found = False
+                        if o.data.shape_keys:
+                            profiler.begin('shape keys')
+                            shape_keys_found = True
+                            first_key_name = o.data.shape_keys.key_blocks[0].name
+
+                            # Remember state
+                            obj_state = common.ObjectState(o)
+                            mesh_state = common.MeshState(o.data)
+
+                            if self.bake_mode == 'STREAM':
+                                print('Begin baking', o.name, 'shape keys')
+                                key_settings = get_shape_key_settings(o)
+                                key_coords = bake_deformed_coords(o, armature_mods,
+                                        range(1, len(o.data.shape_keys.key_blocks)))
+                                bpy.ops.object.shape_key_remove(all=True)
+                            else:
+                                key_objs = create_shape_keys_objects(o)
+                            profiler.end()
+
+                            #return {'FINISHED'}
+
+                        if armature_mod_copies:
+                            print('Begin applying armature modifiers of', o.name)
+
+                        # Apply the modifiers
+                        profiler.begin('apply modifiers')
+                        for mod_copy in armature_mod_copies:
+                            mod = o.modifiers[mod_copy['index']]
+                            bpy.ops.object.modifier_apply(apply_as='DATA', modifier=mod.name)
+                        profiler.end()
+
+                        if shape_keys_found:
+                            print('Begin recover shape keys of', o.name)
+                            profiler.begin('shape key recovery')
+                            if self.bake_mode == 'STREAM':
+                                shape_keys_restore(o, key_settings, key_coords)
+                            else:
+                                shape_keys_recover(o, key_objs, first_key_name)
+
+                            # Recover state
+                            obj_state.revert()
+                            mesh_state.revert()
+                            profiler.end()
+
+                            #return {'FINISHED'}
+
+                    # If origin adjustment is needed
+                    if need_origin_adjustment:
+
+                        # Revert bone basis matrix
+                        pose_buffer.restore(metarig_obj.pose.bones, top_bone_names)
+
+                        # Clear parent on empty object to get real matrix world
+                        bpy.ops.object.select_all(action='DESELECT')
+                        empty.select = True
+                        scene.objects.active = empty
+                        bpy.ops.object.parent_clear(type='CLEAR_KEEP_TRANSFORM')
+                        scene.objects.active = o
+
+                        o.matrix_world = empty.matrix_world
+
+                        # Delete empty
+                        scene.objects.unlink(empty)
+                        bpy.data.objects.remove(empty, do_unlink=True)
+
+                    # Add back modifier and set back its attributes
+                    # Direct skinning and evaluate mode never remove the modifiers
+                    if not direct_skinning and self.bake_mode != 'EVALUATE':
+                        profiler.begin('add modifiers')
+                        for mod_copy in armature_mod_copies:
+                            # New modifier
+                            bpy.ops.object.modifier_add(type='ARMATURE')
+
+                            # Get the new modifier
+                            last_idx = len(o.modifiers) - 1
+                            mod = o.modifiers[last_idx]
+
+                            # Set the attributes
+                            for attr, value in mod_copy.items():
+                                if attr != 'index':
+                                    setattr(mod, attr, value)
+
+                            # Set back the original stack position
+                            if last_idx > 0:
+                                idx_diff = last_idx - mod_copy['index']
+                                for i in range(idx_diff):
+                                    bpy.ops.object.modifier_move_up(modifier=mod.name)
+                        profiler.end()
+                    #print('safe?')
+
+                    #o.select = False
+                    #if o.name == 'Head':
+                    #    return {'FINISHED'}
+
+                    profiler.end()
+                    if not (direct_skinning and executor):
+                        object_timings.append((o.name, time.time() - object_start_time))
+
+            # Write back skinned objects
+            profiler.begin('write skinned')
+            for o, read_time, future in skinning_jobs:
+                coords, skin_time = future.result()
+                write_start_time = time.time()
+                set_skinned_coords(o, coords)
+                object_timings.append((o.name, read_time + skin_time + time.time() - write_start_time))
+            profiler.end()
+        finally:
+            # Worker threads should never outlive the operator, even on error
+            if executor:
+                executor.shutdown()
 
         # Apply metarig to rest pose
         scene.objects.active = metarig_obj
@@ -814,7 +863,7 @@ class ApplyMetarigTransform(bpy.types.Operator):
         # Check extra bones
         extra_bones = {}
         for b in metarig_obj.data.bones:
-            if b.name not in def_names and b.name not in extra_exception:
+            if bone_map.is_extra(b.name):
                 if b.parent:
                     extra_bones[b.name] = b.parent.name
                 else: extra_bones[b.name] = ''
@@ -864,9 +913,7 @@ class ApplyMetarigTransform(bpy.types.Operator):
 
         # Bring back to rigify objects
         for o in using_rigify_objects:
-            for vg in o.vertex_groups:
-                if vg.name in def_names:
-                    vg.name = def_names[vg.name]
+            bone_map.rename(o.vertex_groups, to_metarig=False)
 
         for mod in rigify_modifiers:
             mod.object = rigify_obj
@@ -927,7 +974,9 @@ class ApplyMetarigTransform(bpy.types.Operator):
                 scene.objects.active = metarig_obj
 
             # Regenerate rigify
+            profiler.begin('rigify_generate')
             bpy.ops.pose.rigify_generate()
+            profiler.end()
 
             # Get new rigify object
             rigify_obj = scene.objects.active
@@ -948,14 +997,10 @@ class ApplyMetarigTransform(bpy.types.Operator):
                 # Reparent extra bones
                 bpy.ops.object.mode_set(mode='EDIT')
                 for eb, par in extra_bones.items():
-                    if par and par in def_names:
+                    parent_name = bone_map.to_org(par) if par else ''
+                    if parent_name:
                         #bpy.ops.armature.select_all(action='DESELECT')
                         # Get parent bone
-                        parent_name = def_names[par]
-                        parent_name = parent_name.replace('DEF-', 'ORG-', 1)
-                        if [a for a in {'upper_arm', 'forearm', 'thigh', 'shin'} if a in parent_name]:
-                            parent_name = parent_name.replace('.01.', '.', 1)
-                            parent_name = parent_name.replace('.02.', '.', 1)
                         parent = rigify_obj.data.edit_bones.get(parent_name)
                         #rigify_obj.data.bones.active = parent
 
@@ -1033,11 +1078,24 @@ class ApplyMetarigTransform(bpy.types.Operator):
                         pb[prop_name] = value
 
         # Revert state
-        revert()
+        profiler.begin('revert')
+        scene_state.revert()
+        profiler.end()
 
         # Bring back original legacy mode setting
         context.user_preferences.addons['rigify'].preferences.legacy_mode = original_legacy_mode
 
+        # Weight matrices are only needed while baking
+        common.clear_weight_matrix_cache()
+
+        # Report objects timings, slowest first
+        object_timings.sort(key=lambda t: t[1], reverse=True)
+        for name, seconds in object_timings:
+            print('%.3fs' % seconds, name)
+        if object_timings:
+            self.report({'INFO'}, 'Baked ' + str(len(object_timings)) + ' objects, ' +
+                    ', '.join('%s %.2fs' % t for t in object_timings[:5]))
+
         #print('Metness')
         return {'FINISHED'}
 
@@ -1058,6 +1116,9 @@ class MetarigRigifyToggle(bpy.types.Operator):
         default='AUTO',
         )
 
+    incremental = BoolProperty(name='Incremental', default=True,
+            description='Only touch objects bound to the rigs and bones that need to change')
+
     def modify_shapekeys(self, obj, shapekey_part):
         scene = bpy.context.scene
         props = scene.basemesh_tools_props
@@ -1089,15 +1150,14 @@ class MetarigRigifyToggle(bpy.types.Operator):
         return (metarig_obj and metarig_obj.type == 'ARMATURE' and
                 rigify_obj and rigify_obj.type == 'ARMATURE')
 
+    @common.profiled
     def execute(self, context):
         scene = bpy.context.scene
         props = scene.basemesh_tools_props
-        objs = [o for o in scene.objects]
 
         self.metarig_obj = scene.objects.get(props.metarig_object)
         self.rigify_obj = scene.objects.get(props.rigify_object)
-
-        remember()
+        bone_map = get_bone_name_map(scene, self)
 
         if self.convert_type == 'TO_METARIG':
             to_metarig = True
@@ -1119,6 +1179,19 @@ class MetarigRigifyToggle(bpy.types.Operator):
             target_rig_obj = self.rigify_obj
             target_key = props.rigify_shape_key_name
 
+        # Incremental mode only visit and remember objects bound to source rig
+        if self.incremental:
+            parented_objs = common.rig_bindings.get_bone_children(scene, source_rig_obj)
+            modifier_objs = common.rig_bindings.get_modifier_users(scene, source_rig_obj)
+            remember_objs = [self.metarig_obj, self.rigify_obj] + parented_objs + modifier_objs
+        else:
+            parented_objs = modifier_objs = [o for o in scene.objects]
+            remember_objs = None
+
+        profiler.begin('remember')
+        scene_state = remember(objects=remember_objs)
+        profiler.end()
+
         if not no_active_object_error_prevention():
             self.report({'WARNING'}, "No object found in this layer!")
             return {'CANCELLED'}
@@ -1142,18 +1215,15 @@ class MetarigRigifyToggle(bpy.types.Operator):
         #    pose_matrices[pb.name] = pb.matrix_basis.copy()
 
         # Make all armature layers active
-        for i in range(len(target_rig_obj.data.layers)):
-            target_rig_obj.data.layers[i] = True
+        for i, l in enumerate(target_rig_obj.data.layers):
+            if not l: target_rig_obj.data.layers[i] = True
 
         # Unhide all bones
         for bone in target_rig_obj.data.bones:
-            bone.hide = False
+            if bone.hide: bone.hide = False
         # Make target bones in rest position:
-        for pb in target_rig_obj.pose.bones:
-            #if not any([prefix for prefix in {'DEF-', 'MCH-', 'ORG-'} if prefix in bone.name]):
-            pb.matrix_basis = Matrix()
-        for pb in source_rig_obj.pose.bones:
-            pb.matrix_basis = Matrix()
+        for rig_obj in (target_rig_obj, source_rig_obj):
+            state_utils.PoseBuffer(rig_obj.pose.bones).reset(rig_obj.pose.bones)
 
         #start_time = time.time()
         #return {'FINISHED'}
@@ -1161,7 +1231,7 @@ class MetarigRigifyToggle(bpy.types.Operator):
         #print(source_rig_obj)
 
         # Search for object parent to rig
-        for o in objs:
+        for o in parented_objs:
 
             #print(o.name)
             #return {'FINISHED'}
@@ -1179,11 +1249,9 @@ class MetarigRigifyToggle(bpy.types.Operator):
                 target_bone_name = ''
                 #start_time = time.time()
                 if to_metarig:
-                    target_bone_name = [key for key, value in def_names.items() if value == o.parent_bone]
-                    if target_bone_name:
-                        target_bone_name = target_bone_name[0]
-                elif o.parent_bone in def_names:
-                    target_bone_name = def_names[o.parent_bone]
+                    target_bone_name = bone_map.to_metarig(o.parent_bone, '')
+                else:
+                    target_bone_name = bone_map.to_deform(o.parent_bone, '')
 
                 if not target_bone_name or target_bone_name == '':
                     target_bone_name = o.parent_bone
@@ -1235,7 +1303,8 @@ class MetarigRigifyToggle(bpy.types.Operator):
         #print('Bol foken shet')
 
         # Search for objects which use the source rig
-        for o in objs:
+        rebound_objs = []
+        for o in modifier_objs:
 
             #if not o.type == 'MESH': continue
 
@@ -1254,27 +1323,24 @@ class MetarigRigifyToggle(bpy.types.Operator):
             scene.objects.active = o
             o.select = True
 
-            if to_metarig:
-                # Convert rigify vertex group to metarig
-                for vg in o.vertex_groups:
-                    key = [key for key, value in def_names.items() if value == vg.name]
-                    if key: 
-                        vg.name = key[0]
-            else:
-                # Convert metarig to rigify weight paint
-                for vg in o.vertex_groups:
-                    if vg.name in def_names:
-                        vg.name = def_names[vg.name]
+            # Convert vertex groups between rigify and metarig weight paint
+            bone_map.rename(o.vertex_groups, to_metarig)
 
             # Change modifier object to target rig
             modifier_found.object = target_rig_obj
+            rebound_objs.append(o)
 
             self.modify_shapekeys(o, target_key)
 
             o.select = False
 
+        # Keep registry in sync with the new bindings
+        common.rig_bindings.move([o for o in parented_objs if o.parent == target_rig_obj] + rebound_objs)
+
         # Revert state
-        revert()
+        profiler.begin('revert')
+        scene_state.revert()
+        profiler.end()
 
         # Layers change
         if to_metarig:
@@ -1362,6 +1428,34 @@ class SubPanelToggle(bpy.types.Operator):
 
         return {'FINISHED'}
 
+class ProfilingToggle(bpy.types.Operator):
+    bl_idname = "view3d.basemesh_tools_profiling_toggle"
+    bl_label = "Toggle Profiling"
+    bl_description = "Record timings and operator counts of basemesh tools operators"
+
+    def execute(self, context):
+        profiler.enabled = not profiler.enabled
+        return {'FINISHED'}
+
+class ExportProfilingTrace(bpy.types.Operator, ExportHelper):
+    bl_idname = "view3d.basemesh_tools_export_trace"
+    bl_label = "Export Chrome Trace"
+    bl_description = "Export last profiled run as Chrome trace json"
+
+    filename_ext = '.json'
+    filter_glob = StringProperty(default='*.json', options={'HIDDEN'})
+
+    @classmethod
+    def poll(cls, context):
+        return bool(profiler.spans)
+
+    def execute(self, context):
+        profiler.export_chrome_trace(self.filepath)
+        return {'FINISHED'}
+
+# Maximum number of profiling rows shown on panel
+MAX_PROFILING_ROWS = 30
+
 class BasemeshToolsPanel(bpy.types.Panel):
     #bl_category = "Basemesh"
     #bl_region_type = "TOOLS"
@@ -1393,6 +1487,7 @@ class BasemeshToolsPanel(bpy.types.Panel):
             inbox = box.column(align=True)
             inbox.prop_search(props, "metarig_object", bpy.data, "objects", text='Metarig', icon='OBJECT_DATA')
             inbox.prop_search(props, "rigify_object", bpy.data, "objects", text='Rigify', icon='OBJECT_DATA')
+            inbox.prop(props, 'bone_map_file', text='Bone Map')
 
             metarig_object = scene.objects.get(props.metarig_object)
             rigify_object = scene.objects.get(props.rigify_object)
@@ -1426,6 +1521,33 @@ class BasemeshToolsPanel(bpy.types.Panel):
             c.operator('object.rigify_fast_select', text='Hand IKs', icon='GROUP_BONE').type = 'HAND_IKS'
             c.operator('object.rigify_fast_select', text='Feet IKs', icon='GROUP_BONE').type = 'FEET_IKS'
 
+        row = c.row(align=True)
+        icon = 'TRIA_DOWN' if props.profiling_settings_visible else 'TRIA_RIGHT'
+        row.operator('view3d.basemesh_tools_subpanel_toggle', icon=icon , text='', emboss=False).prop_name = 'profiling_settings_visible'
+        row.label('Profiling')
+
+        if props.profiling_settings_visible:
+            box = c.box()
+            inbox = box.column(align=True)
+            text = 'Disable Profiling' if profiler.enabled else 'Enable Profiling'
+            inbox.operator('view3d.basemesh_tools_profiling_toggle', text=text, icon='TIME')
+
+            # Last run breakdown
+            if profiler.name:
+                inbox.label(profiler.name + ': %.3fs' % profiler.total_seconds)
+                breakdown = profiler.breakdown()
+                for name, depth, seconds, calls in breakdown[:MAX_PROFILING_ROWS]:
+                    text = '    ' * depth + name + ': %.3fs' % seconds
+                    if calls > 1: text += ' (' + str(calls) + 'x)'
+                    inbox.label(text)
+                if len(breakdown) > MAX_PROFILING_ROWS:
+                    inbox.label('...')
+
+                for name in ('operators', 'mode switches', 'scene updates'):
+                    inbox.label(name.capitalize() + ': ' + str(profiler.counters.get(name, 0)))
+
+                inbox.operator('view3d.basemesh_tools_export_trace', icon='FILE_TEXT')
+
 class ForceMirrorPanel(bpy.types.Panel):
     #bl_category = "Basemesh"
     bl_space_type = "VIEW_3D"
@@ -1435,8 +1557,8 @@ class ForceMirrorPanel(bpy.types.Panel):
     bl_options = {'DEFAULT_CLOSED'} 
 
     def draw(self, context):
-        #scene = context.scene
-        #props = scene.basemesh_tools_props
+        scene = context.scene
+        props = scene.basemesh_tools_props
 
         layout = self.layout
         c = layout.column(align=True)
@@ -1445,13 +1567,14 @@ class ForceMirrorPanel(bpy.types.Panel):
         c.operator('mesh.flip_mirror_modifier', icon='MOD_MIRROR')
 
         c.label('Force Mirror:')
-
-        c.operator('mesh.force_mirror', text="X+ to X-", icon='MOD_MIRROR').mode = 'X_PLUS_MIN'
-        c.operator('mesh.force_mirror', text="X- to X+", icon='MOD_MIRROR').mode = 'X_MIN_PLUS'
-        c.operator('mesh.force_mirror', text="Y+ to Y-", icon='MOD_MIRROR').mode = 'Y_PLUS_MIN'
-        c.operator('mesh.force_mirror', text="Y- to Y+", icon='MOD_MIRROR').mode = 'Y_MIN_PLUS'
-        c.operator('mesh.force_mirror', text="Z+ to Z-", icon='MOD_MIRROR').mode = 'Z_PLUS_MIN'
-        c.operator('mesh.force_mirror', text="Z- to Z+", icon='MOD_MIRROR').mode = 'Z_MIN_PLUS'
+        c.prop_search(props, "force_mirror_object", bpy.data, "objects", text='Plane', icon='OBJECT_DATA')
+
+        for mode, text in (('X_PLUS_MIN', "X+ to X-"), ('X_MIN_PLUS', "X- to X+"),
+                ('Y_PLUS_MIN', "Y+ to Y-"), ('Y_MIN_PLUS', "Y- to Y+"),
+                ('Z_PLUS_MIN', "Z+ to Z-"), ('Z_MIN_PLUS', "Z- to Z+")):
+            op = c.operator('mesh.force_mirror', text=text, icon='MOD_MIRROR')
+            op.mode = mode
+            op.mirror_object = props.force_mirror_object
         c.operator('mesh.force_mirror_advance', text="Advance", icon='MOD_MIRROR')
 
 class ShapeKeyMirrorPanel(bpy.types.Panel):
@@ -1472,49 +1595,84 @@ class ShapeKeyMirrorPanel(bpy.types.Panel):
         c.operator('mesh.shape_key_mirror', text="Mirror", icon='SHAPEKEY_DATA')
         c.operator('mesh.shape_key_reset', text="Reset", icon='SHAPEKEY_DATA')
 
+# Keymap items added by this add-on, as (keymap, keymap item)
+addon_keymaps = []
+
 def set_keybind():
+    # Already registered, registering again does nothing
+    if addon_keymaps:
+        return
+
     wm = bpy.context.window_manager
 
-    q_keybind_found = False
+    # No add-on keyconfig on background mode
+    if not wm.keyconfigs.addon:
+        return
 
     # Get object non modal keymaps
     km = wm.keyconfigs.addon.keymaps.get('Object Non-modal')
     if not km:
         km = wm.keyconfigs.addon.keymaps.new('Object Non-modal')
-    
-    # Search for Q keybind
+
+    # Deactivate other Q keybind, only done once when this add-on keybind is created
     for kmi in km.keymap_items:
-        
-        if kmi.type == 'Q' and kmi.shift:
-            if kmi.idname == 'mesh.toggle_metarig_rigify':
-                q_keybind_found = True
-                kmi.active = True
-            else:
-                # Deactivate other Q keybind
-                kmi.active = False
+        if kmi.type == 'Q' and kmi.shift and kmi.idname != 'mesh.toggle_metarig_rigify':
+            kmi.active = False
 
     # Set Q Keybind
-    if not q_keybind_found:
-        new_shortcut = km.keymap_items.new('mesh.toggle_metarig_rigify', 'Q', 'PRESS', shift=True)
+    kmi = km.keymap_items.new('mesh.toggle_metarig_rigify', 'Q', 'PRESS', shift=True)
+    addon_keymaps.append((km, kmi))
+
+def remove_keybind():
+    for km, kmi in addon_keymaps:
+        km.keymap_items.remove(kmi)
+    addon_keymaps.clear()
 
 class BasemeshToolsProps(bpy.types.PropertyGroup):
     metarig_object = StringProperty(name='Metarig Object', default='')
     rigify_object = StringProperty(name='Rigify Object', default='')
     metarig_shape_key_name = StringProperty(name='Metarig Shape Key', default='Basis')
     rigify_shape_key_name = StringProperty(name='Rigify Shape Key', default='')
+    bone_map_file = StringProperty(name='Bone Map File', default='', subtype='FILE_PATH',
+            description='Json file with custom def_names and extra_exception tables for non rigify rigs')
+    force_mirror_object = StringProperty(name='Force Mirror Object', default='',
+            description='Force mirror uses axis plane of this object as mirror plane, object origin is used if empty')
 
     # For collapse sections
     armature_object_settings_visible = BoolProperty(default=False)
     shape_keys_settings_visible = BoolProperty(default=False)
     fast_select_settings_visible = BoolProperty(default=False)
+    profiling_settings_visible = BoolProperty(default=False)
 
 def register():
     bpy.utils.register_module(__name__)
     bpy.types.Scene.basemesh_tools_props = PointerProperty(type=BasemeshToolsProps)
     set_keybind()
 
+    # Handlers to keep rig bindings registry up to date
+    if common.rig_bindings_update not in bpy.app.handlers.scene_update_post:
+        bpy.app.handlers.scene_update_post.append(common.rig_bindings_update)
+    if common.rig_bindings_reset not in bpy.app.handlers.load_post:
+        bpy.app.handlers.load_post.append(common.rig_bindings_reset)
+    if common.weight_matrix_cache_update not in bpy.app.handlers.scene_update_post:
+        bpy.app.handlers.scene_update_post.append(common.weight_matrix_cache_update)
+    if mirror_tools.mirror_map_cache_reset not in bpy.app.handlers.load_post:
+        bpy.app.handlers.load_post.append(mirror_tools.mirror_map_cache_reset)
+
 def unregister():
 	bpy.utils.unregister_module(__name__)
+	remove_keybind()
+
+	if common.rig_bindings_update in bpy.app.handlers.scene_update_post:
+		bpy.app.handlers.scene_update_post.remove(common.rig_bindings_update)
+	if common.rig_bindings_reset in bpy.app.handlers.load_post:
+		bpy.app.handlers.load_post.remove(common.rig_bindings_reset)
+	if common.weight_matrix_cache_update in bpy.app.handlers.scene_update_post:
+		bpy.app.handlers.scene_update_post.remove(common.weight_matrix_cache_update)
+	if mirror_tools.mirror_map_cache_reset in bpy.app.handlers.load_post:
+		bpy.app.handlers.load_post.remove(mirror_tools.mirror_map_cache_reset)
+	common.clear_weight_matrix_cache()
+	mirror_tools.mirror_map_cache.clear()
 
 if __name__ == "__main__":
     register()
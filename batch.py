@@ -0,0 +1,225 @@
+# Batch Apply Metarig Transform or Metarig/Rigify toggle across many .blend files.
+#
+# Run from command line with plain python:
+#   python batch.py --blender /path/to/blender --jobs 4 --output-dir out --report report.json *.blend
+#
+# Every file is processed by its own headless Blender process, running this same
+# script in worker mode. Worker saves the result and writes a small json result file
+# which is collected into the report.
+
+import os, sys, json, time, argparse, subprocess, tempfile
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+ACTIONS = ('APPLY', 'TOGGLE', 'TO_METARIG', 'TO_RIGIFY')
+
+# Add-on module name is the name of this folder
+ADDON_NAME = os.path.basename(os.path.dirname(os.path.abspath(__file__)))
+
+class Job:
+    def __init__(self, filepath, action, output, blender='blender', addon=ADDON_NAME,
+            metarig_object='', rigify_object='', timeout=None):
+        self.filepath = filepath
+        self.action = action
+        self.output = output
+        self.blender = blender
+        self.addon = addon
+        self.metarig_object = metarig_object
+        self.rigify_object = rigify_object
+        self.timeout = timeout
+
+# Default worker, run the job on headless Blender and return result dict
+def blender_worker(job):
+    fd, result_path = tempfile.mkstemp(suffix='.json')
+    os.close(fd)
+
+    args = [job.blender, '--background', '--factory-startup', job.filepath,
+            '--python', os.path.abspath(__file__), '--',
+            '--worker', '--action', job.action, '--output', job.output,
+            '--addon', job.addon, '--result', result_path,
+            '--metarig', job.metarig_object, '--rigify', job.rigify_object]
+
+    log = ''
+    try:
+        proc = subprocess.run(args, stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                universal_newlines=True, timeout=job.timeout)
+        log = proc.stdout
+
+        with open(result_path) as f:
+            result = json.load(f)
+        if proc.returncode != 0 and result.get('status') == 'OK':
+            result['status'] = 'FAILED'
+            result['error'] = 'Blender exit code ' + str(proc.returncode)
+
+    except subprocess.TimeoutExpired:
+        result = {'status' : 'FAILED', 'error' : 'Timeout'}
+    except (OSError, ValueError) as e:
+        result = {'status' : 'FAILED', 'error' : str(e)}
+    finally:
+        if os.path.exists(result_path):
+            os.remove(result_path)
+
+    if result['status'] != 'OK':
+        result['log'] = log[-2000:]
+
+    return result
+
+def run_job(worker, job):
+    start_time = time.time()
+    try:
+        result = dict(worker(job))
+    except Exception as e:
+        result = {'status' : 'FAILED', 'error' : repr(e)}
+
+    result['file'] = job.filepath
+    result['output'] = job.output
+    result['action'] = job.action
+    result['seconds'] = time.time() - start_time
+    return result
+
+# Run all jobs on a pool with number of jobs workers at once.
+# Worker is any callable receiving a Job and returning dict with at least 'status',
+# results are returned in the same order as jobs.
+def run_batch(jobs, worker=blender_worker, num_jobs=None, callback=None):
+    num_jobs = num_jobs or os.cpu_count() or 1
+
+    # Blender processes do the real work, threads are only waiting for them
+    with ThreadPoolExecutor(max_workers=num_jobs) as executor:
+        futures = [executor.submit(run_job, worker, job) for job in jobs]
+        if callback:
+            for future in as_completed(futures):
+                callback(future.result())
+
+    return [future.result() for future in futures]
+
+def make_report(results, total_seconds):
+    failed = [r for r in results if r['status'] != 'OK']
+    return {
+            'total_seconds' : total_seconds,
+            'num_files' : len(results),
+            'num_failed' : len(failed),
+            'results' : results,
+            }
+
+# Output path of every input file. Files written to output folder keep their path
+# relative to the common folder of all inputs, so inputs with the same file name
+# never overwrite each other. Same input given twice gets an index.
+def get_output_paths(filepaths, output_dir, suffix):
+    paths = []
+    if output_dir:
+        abspaths = [os.path.abspath(f) for f in filepaths]
+        try:
+            base = os.path.commonpath([os.path.dirname(p) for p in abspaths]) if abspaths else ''
+            paths = [os.path.join(output_dir, os.path.relpath(p, base)) for p in abspaths]
+        except ValueError:
+            # Inputs on different drives have no common folder
+            paths = [os.path.join(output_dir, os.path.basename(p)) for p in abspaths]
+    else:
+        for filepath in filepaths:
+            name, ext = os.path.splitext(filepath)
+            paths.append(name + suffix + ext)
+
+    used = set()
+    result = []
+    for path in paths:
+        name, ext = os.path.splitext(path)
+        index = 1
+        while os.path.normcase(path) in used:
+            path = name + '_' + str(index) + ext
+            index += 1
+        used.add(os.path.normcase(path))
+        result.append(path)
+
+    return result
+
+# This part run inside Blender
+def worker_main(args):
+    import bpy, addon_utils
+
+    start_time = time.time()
+    result = {'status' : 'OK'}
+
+    try:
+        addon_utils.enable('rigify', default_set=True)
+        addon_utils.enable(args.addon, default_set=True)
+
+        scene = bpy.context.scene
+        props = scene.basemesh_tools_props
+        if args.metarig: props.metarig_object = args.metarig
+        if args.rigify: props.rigify_object = args.rigify
+
+        if args.action == 'APPLY':
+            ret = bpy.ops.mesh.apply_metarig_transform()
+        elif args.action == 'TOGGLE':
+            ret = bpy.ops.mesh.toggle_metarig_rigify(convert_type='AUTO')
+        else:
+            ret = bpy.ops.mesh.toggle_metarig_rigify(convert_type=args.action)
+
+        if 'FINISHED' not in ret:
+            raise RuntimeError('Operator returned ' + ', '.join(ret))
+
+        result['operator_seconds'] = time.time() - start_time
+
+        bpy.ops.wm.save_as_mainfile(filepath=os.path.abspath(args.output), copy=True)
+
+    except Exception as e:
+        result = {'status' : 'FAILED', 'error' : repr(e)}
+
+    with open(args.result, 'w') as f:
+        json.dump(result, f)
+
+def main(argv=None):
+    if argv is None:
+        argv = sys.argv[1:]
+        # Blender pass script arguments after --
+        if '--' in sys.argv:
+            argv = sys.argv[sys.argv.index('--') + 1:]
+
+    parser = argparse.ArgumentParser(description='Batch process basemesh tools rig operations')
+    parser.add_argument('files', nargs='*', help='.blend files to process')
+    parser.add_argument('--action', default='APPLY', choices=ACTIONS)
+    parser.add_argument('--blender', default='blender', help='Blender executable')
+    parser.add_argument('--jobs', type=int, default=None, help='Number of Blender processes at once')
+    parser.add_argument('--output-dir', default='', help='Output folder, default is next to input file')
+    parser.add_argument('--suffix', default='_applied', help='Output file suffix if output folder is not set')
+    parser.add_argument('--report', default='', help='Json report path, default is stdout')
+    parser.add_argument('--timeout', type=float, default=None, help='Timeout per file in seconds')
+    parser.add_argument('--addon', default=ADDON_NAME)
+    parser.add_argument('--metarig', default='', help='Override metarig object name')
+    parser.add_argument('--rigify', default='', help='Override rigify object name')
+
+    # Worker only arguments
+    parser.add_argument('--worker', action='store_true', help=argparse.SUPPRESS)
+    parser.add_argument('--output', default='', help=argparse.SUPPRESS)
+    parser.add_argument('--result', default='', help=argparse.SUPPRESS)
+
+    args = parser.parse_args(argv)
+
+    if args.worker:
+        worker_main(args)
+        return 0
+
+    outputs = get_output_paths(args.files, args.output_dir, args.suffix)
+    for folder in {os.path.dirname(output) for output in outputs}:
+        if folder and not os.path.isdir(folder):
+            os.makedirs(folder)
+
+    jobs = [Job(f, args.action, output, args.blender, args.addon, args.metarig, args.rigify, args.timeout)
+            for f, output in zip(args.files, outputs)]
+
+    def print_progress(result):
+        print(result['status'], '%.2fs' % result['seconds'], result['file'], file=sys.stderr)
+
+    start_time = time.time()
+    results = run_batch(jobs, num_jobs=args.jobs, callback=print_progress)
+    report = make_report(results, time.time() - start_time)
+
+    if args.report:
+        with open(args.report, 'w') as f:
+            json.dump(report, f, indent=2)
+    else:
+        print(json.dumps(report, indent=2))
+
+    return 1 if report['num_failed'] else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,529 @@
+# Benchmark basemesh tools on synthetic basemesh and rig fixtures.
+#
+# Pure algorithm tier, only needs numpy:
+#   python benchmark.py --sizes 1000 10000 100000 1000000 --output bench.json
+#
+# Add operator tier by running headless Blender with this same script in worker mode:
+#   python benchmark.py --blender /path/to/blender --output bench.json
+# It also times the add-on import and register on startup, and loading the deferred modules on first use.
+# It also compares per-coordinate and foreach_get/foreach_set shape key copy, as seconds
+# per million vertices.
+#
+# Compare with previous results, exit code is 1 if something is slower than threshold:
+#   python benchmark.py --baseline bench.json --threshold 0.2
+
+import os, sys, json, time, argparse, subprocess, tempfile
+import numpy as np
+
+# Add-on module name is the name of this folder
+ADDON_NAME = os.path.basename(os.path.dirname(os.path.abspath(__file__)))
+
+DEFAULT_SIZES = (1000, 10000, 100000, 1000000)
+
+# Number of vertex groups of the many groups weight benchmarks, more than rigify deform bones
+MANY_GROUPS = 128
+
+FORCE_MIRROR_MODES = ('X_PLUS_MIN', 'X_MIN_PLUS', 'Y_PLUS_MIN', 'Y_MIN_PLUS', 'Z_PLUS_MIN', 'Z_MIN_PLUS')
+
+# Body profile of the synthetic humanoid, radius at normalized height from feet to head
+BODY_PROFILE = ((0.0, 0.06), (0.25, 0.08), (0.48, 0.13), (0.55, 0.16), (0.7, 0.15),
+        (0.8, 0.2), (0.85, 0.06), (0.88, 0.05), (0.93, 0.1), (1.0, 0.02))
+
+class Fixture:
+    # Synthetic basemesh: a closed quad grid wrapped around a humanoid profile,
+    # symmetric on x axis except for vertices moved by asymmetry
+    def __init__(self, num_verts, num_keys=8, num_groups=32, asymmetry=0.01, seed=0):
+        rng = np.random.RandomState(seed)
+
+        # Even number of segments so every vertex has a mirror
+        segments = max(4, int(np.sqrt(num_verts / 2.0)) // 2 * 2)
+        rings = max(2, num_verts // segments)
+
+        heights = np.linspace(0.0, 1.0, rings)
+        profile = np.array(BODY_PROFILE)
+        radii = np.interp(heights, profile[:, 0], profile[:, 1])
+        angles = (np.arange(segments) + 0.5) * (2.0 * np.pi / segments)
+
+        coords = np.empty((rings, segments, 3))
+        coords[:, :, 0] = radii[:, None] * np.cos(angles)
+        coords[:, :, 1] = radii[:, None] * np.sin(angles) * 0.6
+        coords[:, :, 2] = heights[:, None] * 1.8
+        self.coords = coords.reshape(-1, 3)
+
+        # Quads between rings, wrapping around segments
+        ring = np.arange(rings - 1)[:, None] * segments
+        seg = np.arange(segments)[None, :]
+        next_seg = (seg + 1) % segments
+        self.faces = np.stack([ring + seg, ring + next_seg, ring + segments + next_seg, ring + segments + seg],
+                axis=-1).reshape(-1, 4)
+
+        edges = np.concatenate([self.faces[:, [0, 1]], self.faces[:, [1, 2]],
+            self.faces[:, [2, 3]], self.faces[:, [3, 0]]])
+        self.edges = np.unique(np.sort(edges, axis=1), axis=0)
+
+        # Asymmetric vertices
+        num_moved = int(len(self.coords) * asymmetry)
+        moved = rng.choice(len(self.coords), num_moved, replace=False)
+        self.coords[moved] += rng.normal(0.0, 0.002, (num_moved, 3))
+
+        # Shape keys are smooth offsets of the basis
+        offsets = np.sin(self.coords[None, :, 2] * rng.uniform(2.0, 10.0, (num_keys, 1)))
+        self.key_coords = self.coords[None] + offsets[:, :, None] * 0.01
+        self.key_coords = np.concatenate([self.coords[None], self.key_coords]).astype(np.float32)
+
+        # Vertex groups are bands on height, half of them on each side
+        self.num_groups = num_groups
+        band = np.clip((self.coords[:, 2] / 1.8 * (num_groups // 2)).astype(np.int64), 0, num_groups // 2 - 1)
+        side = (self.coords[:, 0] < 0.0).astype(np.int64)
+        group = band * 2 + side
+        neighbor = np.minimum(group + 2, num_groups - 1)
+        blend = rng.uniform(0.0, 1.0, len(self.coords))
+        self.vert_ids = np.concatenate([np.arange(len(self.coords))] * 2)
+        self.group_ids = np.concatenate([group, neighbor])
+        self.weights = np.concatenate([blend, 1.0 - blend])
+
+        self.group_matrices = np.tile(np.identity(4), (num_groups, 1, 1))
+        self.group_matrices[:, :3, 3] = rng.normal(0.0, 0.01, (num_groups, 3))
+
+        self.group_names = ['band_' + str(i // 2) + ('.R' if i % 2 else '.L') for i in range(num_groups)]
+
+    @property
+    def num_verts(self):
+        return len(self.coords)
+
+# Mirror name function before the compiled resolver, one dictionary scan per name
+def old_mirror_name(name, mirror_dict):
+    splitnames = name.split('.')
+    last_word = splitnames[-1]
+
+    extra = ''
+    crop_name = name
+    if last_word.isdigit() and len(splitnames) > 1:
+        extra = '.' + last_word
+        crop_name = name[:-len(last_word)-1]
+
+    for l, r in mirror_dict.items():
+        if crop_name.endswith(l):
+            return crop_name[:-len(l)] + r + extra
+        if crop_name.endswith(r):
+            return crop_name[:-len(r)] + l + extra
+    return ''
+
+# Return best run time of function in seconds
+def best_time(func, repeat=3):
+    best = float('inf')
+    for i in range(repeat):
+        start_time = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start_time)
+    return best
+
+# Pure algorithm benchmarks, return {name : seconds}
+def run_algorithm_benchmarks(fixture, repeat=3):
+    import mirror_utils, rig_utils
+
+    coords = fixture.coords
+    reflected = coords * [-1.0, 1.0, 1.0]
+    loop_verts = fixture.faces.ravel()
+    loop_totals = np.full(len(fixture.faces), 4)
+    loop_starts = np.arange(len(fixture.faces)) * 4
+    mirror = mirror_utils.mirror_map(coords, fixture.edges)
+    origins = np.concatenate([np.arange(fixture.num_verts), np.arange(fixture.num_verts) + fixture.num_verts])
+    weight_matrix = rig_utils.WeightMatrix.from_entries(fixture.num_verts, fixture.vert_ids,
+            fixture.group_ids, fixture.weights, fixture.num_groups)
+    flip_map = np.arange(fixture.num_groups) ^ 1
+
+    many = Fixture(fixture.num_verts, 0, MANY_GROUPS, seed=1)
+    many_weight_matrix = rig_utils.WeightMatrix.from_entries(many.num_verts, many.vert_ids,
+            many.group_ids, many.weights, many.num_groups)
+    many_flip_map = np.arange(many.num_groups) ^ 1
+
+    num_bones = fixture.num_groups
+    channels = {attr : np.tile(value, (num_bones, 1)) for attr, value in rig_utils.POSE_CHANNELS}
+    rotation_modes = ['QUATERNION'] * num_bones
+
+    # Uncached resolver so every run resolve all names again
+    names = [name + '.' + str(i).zfill(3) for i in range(max(1, fixture.num_verts // 100)) for name in fixture.group_names]
+    resolver = mirror_utils.MirrorNameResolver(mirror_utils.mirror_dict, mirror_utils.mirror_prefix_dict, cache_size=0)
+    cached_resolver = mirror_utils.MirrorNameResolver(mirror_utils.mirror_dict, mirror_utils.mirror_prefix_dict)
+    cached_resolver.resolve_many(names)
+
+    benchmarks = {
+            'pair_by_position' : lambda: mirror_utils.pair_by_position(reflected, coords),
+            'mirror_map' : lambda: mirror_utils.mirror_map(coords, fixture.edges),
+            'update_mirror_map' : lambda: mirror_utils.update_mirror_map(mirror, coords, fixture.edges),
+            'topology_hash' : lambda: mirror_utils.topology_hash(fixture.num_verts, fixture.edges, len(fixture.faces)),
+            'mesh_hash' : lambda: mirror_utils.mesh_hash(fixture.num_verts, fixture.edges, len(fixture.faces), coords),
+            'classify_half' : lambda: mirror_utils.classify_half(
+                mirror_utils.polygon_centers(coords, loop_verts, loop_starts, loop_totals)),
+            'symmetrize_shape_keys' : lambda: mirror_utils.symmetrize_shape_keys(fixture.key_coords, origins),
+            'weight_matrix' : lambda: rig_utils.WeightMatrix.from_entries(fixture.num_verts,
+                fixture.vert_ids, fixture.group_ids, fixture.weights, fixture.num_groups).group_totals(),
+            'remap_groups' : lambda: weight_matrix.remap_groups(flip_map),
+            'weight_matrix_many_groups' : lambda: rig_utils.WeightMatrix.from_entries(many.num_verts,
+                many.vert_ids, many.group_ids, many.weights, many.num_groups).group_totals(),
+            'remap_groups_many_groups' : lambda: many_weight_matrix.remap_groups(many_flip_map),
+            'linear_blend_skinning' : lambda: rig_utils.linear_blend_skinning(fixture.key_coords,
+                fixture.vert_ids, fixture.group_ids, fixture.weights, fixture.group_matrices),
+            'mirror_names' : lambda: resolver.resolve_many(names),
+            'mirror_names_cached' : lambda: cached_resolver.resolve_many(names),
+            'mirror_names_old' : lambda: [old_mirror_name(name, mirror_utils.mirror_dict) for name in names],
+            'pose_transformed_mask' : lambda: rig_utils.pose_transformed_mask(channels, rotation_modes),
+            }
+
+    return {name : best_time(func, repeat) for name, func in benchmarks.items()}
+
+# Modules of this add-on that can be imported without Blender
+PURE_MODULES = ('profiling', 'mirror_utils', 'rig_utils', 'state_utils', 'rigify_names')
+
+# Import time of every pure module, each on fresh interpreter so nothing is cached
+def run_import_benchmarks(repeat=3):
+    folder = os.path.dirname(os.path.abspath(__file__))
+    code = 'import sys, time; sys.path.insert(0, sys.argv[1]); start_time = time.perf_counter(); ' \
+            'import {}; print(time.perf_counter() - start_time)'
+
+    results = {}
+    for module in PURE_MODULES:
+        times = []
+        for i in range(repeat):
+            output = subprocess.check_output([sys.executable, '-c', code.format(module), folder],
+                    universal_newlines=True)
+            times.append(float(output))
+        results['import_' + module] = min(times)
+    return results
+
+# This part run inside Blender
+
+def get_view3d_override():
+    import bpy
+    for screen in bpy.data.screens:
+        for area in screen.areas:
+            if area.type == 'VIEW_3D':
+                region = [r for r in area.regions if r.type == 'WINDOW'][0]
+                return {'screen' : screen, 'area' : area, 'region' : region,
+                        'scene' : bpy.context.scene, 'object' : bpy.context.object,
+                        'active_object' : bpy.context.object, 'edit_object' : bpy.context.edit_object}
+    return {}
+
+# Create mesh object from fixture with shape keys and vertex groups
+def create_fixture_object(fixture, name='Basemesh'):
+    import bpy
+    scene = bpy.context.scene
+
+    mesh = bpy.data.meshes.new(name)
+    mesh.vertices.add(fixture.num_verts)
+    mesh.vertices.foreach_set('co', fixture.coords.astype(np.float32).ravel())
+    mesh.loops.add(len(fixture.faces) * 4)
+    mesh.loops.foreach_set('vertex_index', fixture.faces.astype(np.int32).ravel())
+    mesh.polygons.add(len(fixture.faces))
+    mesh.polygons.foreach_set('loop_start', (np.arange(len(fixture.faces)) * 4).astype(np.int32))
+    mesh.polygons.foreach_set('loop_total', np.full(len(fixture.faces), 4, dtype=np.int32))
+    mesh.update(calc_edges=True)
+
+    obj = bpy.data.objects.new(name, mesh)
+    scene.objects.link(obj)
+    scene.objects.active = obj
+    obj.select = True
+
+    for i, co in enumerate(fixture.key_coords):
+        kb = obj.shape_key_add(name='Basis' if i == 0 else 'key_' + str(i), from_mix=False)
+        kb.data.foreach_set('co', co.ravel())
+
+    for i, group_name in enumerate(fixture.group_names):
+        vg = obj.vertex_groups.new(group_name)
+        mask = fixture.group_ids == i
+        vert_ids = fixture.vert_ids[mask]
+        weights = np.round(fixture.weights[mask], 2)
+        for weight in np.unique(weights):
+            vg.add(vert_ids[weights == weight].tolist(), float(weight), 'REPLACE')
+
+    return obj
+
+def clear_scene():
+    import bpy
+    if bpy.context.object and bpy.context.object.mode != 'OBJECT':
+        bpy.ops.object.mode_set(mode='OBJECT')
+    for obj in list(bpy.context.scene.objects):
+        bpy.context.scene.objects.unlink(obj)
+        bpy.data.objects.remove(obj, do_unlink=True)
+
+# Run operator once on fresh fixture object, setup is called before timing
+def time_operator(fixture, operator, setup=None, **kwargs):
+    clear_scene()
+    obj = create_fixture_object(fixture)
+    if setup: setup(obj)
+
+    override = get_view3d_override()
+    start_time = time.perf_counter()
+    ret = operator(override, **kwargs) if override else operator(**kwargs)
+    seconds = time.perf_counter() - start_time
+
+    if 'FINISHED' not in ret:
+        raise RuntimeError('Operator returned ' + ', '.join(ret))
+    return seconds
+
+def setup_edit_select_all(obj):
+    import bpy
+    bpy.ops.object.mode_set(mode='EDIT')
+    bpy.ops.mesh.select_all(action='SELECT')
+
+# Fixture stands on z = 0, move mesh and shape keys down so z mirror modes have both halves
+def setup_center_z(obj):
+    mesh = obj.data
+    collections = [mesh.vertices]
+    if mesh.shape_keys:
+        collections += [kb.data for kb in mesh.shape_keys.key_blocks]
+
+    coords = np.empty(len(mesh.vertices) * 3, dtype=np.float32)
+    mesh.vertices.foreach_get('co', coords)
+    center = (coords[2::3].min() + coords[2::3].max()) / 2.0
+
+    for collection in collections:
+        collection.foreach_get('co', coords)
+        coords[2::3] -= center
+        collection.foreach_set('co', coords)
+    mesh.update()
+
+def setup_mirror_modifier(obj):
+    mod = obj.modifiers.new('Mirror', 'MIRROR')
+    mod.use_mirror_vertex_groups = True
+
+# Add rigify metarig, bind fixture object to it and pose some bones
+def setup_metarig(obj, generate=False):
+    import bpy
+    scene = bpy.context.scene
+    props = scene.basemesh_tools_props
+
+    obj.vertex_groups.clear()
+    bpy.ops.object.armature_human_metarig_add()
+    metarig_obj = scene.objects.active
+    props.metarig_object = metarig_obj.name
+
+    if generate:
+        bpy.ops.pose.rigify_generate()
+        props.rigify_object = scene.objects.active.name
+
+    bpy.ops.object.mode_set(mode='OBJECT')
+    bpy.ops.object.select_all(action='DESELECT')
+    obj.select = True
+    metarig_obj.select = True
+    scene.objects.active = metarig_obj
+    bpy.ops.object.parent_set(type='ARMATURE_ENVELOPE')
+
+    for name in ('upper_arm.L', 'thigh.L', 'spine'):
+        pb = metarig_obj.pose.bones.get(name)
+        if pb:
+            pb.rotation_mode = 'XYZ'
+            pb.rotation_euler = (0.2, 0.1, 0.3)
+            pb.scale = (1.1, 1.1, 1.1)
+
+    scene.objects.active = obj
+    scene.update()
+
+# Copy shape key to mesh vertices one coordinate at a time, like before foreach_get/foreach_set
+def copy_coords_loop(key, vertices):
+    for j, v in enumerate(vertices):
+        v.co.x = key.data[j].co.x
+        v.co.y = key.data[j].co.y
+        v.co.z = key.data[j].co.z
+
+# Seconds per million vertices to copy last shape key to mesh vertices, old and new way
+def run_coords_benchmarks(fixture, common):
+    clear_scene()
+    obj = create_fixture_object(fixture)
+    key = obj.data.shape_keys.key_blocks[-1]
+    vertices = obj.data.vertices
+
+    benchmarks = {
+            'coords_copy_loop' : lambda: copy_coords_loop(key, vertices),
+            'coords_copy_foreach' : lambda: common.set_coords(vertices, common.get_coords(key.data)),
+            }
+
+    scale = 1e6 / fixture.num_verts
+    return {name + '_per_million' : best_time(func, 1) * scale for name, func in benchmarks.items()}
+
+# Read weights of object with many vertex groups into weight matrix and sum them per group,
+# like the mirror origin detection of Apply Metarig Transform
+def run_weight_benchmarks(fixture, common):
+    clear_scene()
+    obj = create_fixture_object(Fixture(fixture.num_verts, 0, MANY_GROUPS, seed=1))
+
+    def group_totals():
+        common.clear_weight_matrix_cache()
+        return common.get_weight_matrix(obj).group_totals()
+
+    return {'weight_group_totals_many_groups' : best_time(group_totals, 1)}
+
+def run_operator_benchmarks(fixture):
+    import bpy
+
+    benchmarks = []
+    for mode in FORCE_MIRROR_MODES:
+        setup = setup_center_z if mode.startswith('Z') else None
+        benchmarks.append(('force_mirror_' + mode.lower(), bpy.ops.mesh.force_mirror, setup, {'mode' : mode}))
+    benchmarks += [
+            ('force_mirror_advance', bpy.ops.mesh.force_mirror_advance, None, {}),
+            ('shape_key_mirror', bpy.ops.mesh.shape_key_mirror, setup_edit_select_all, {}),
+            ('shape_key_reset', bpy.ops.mesh.shape_key_reset, setup_edit_select_all, {}),
+            ('flip_mirror_modifier', bpy.ops.mesh.flip_mirror_modifier, setup_mirror_modifier, {}),
+            ('metarig_rigify_toggle', bpy.ops.mesh.toggle_metarig_rigify,
+                lambda obj: setup_metarig(obj, generate=True), {'convert_type' : 'AUTO'}),
+            ]
+    for bake_mode in ('OPERATOR', 'SKINNING', 'STREAM', 'EVALUATE'):
+        benchmarks.append(('apply_metarig_transform_' + bake_mode.lower(), bpy.ops.mesh.apply_metarig_transform,
+            setup_metarig, {'bake_mode' : bake_mode}))
+
+    results = {}
+    errors = {}
+    for name, operator, setup, kwargs in benchmarks:
+        try:
+            results[name] = time_operator(fixture, operator, setup, **kwargs)
+        except Exception as e:
+            errors[name] = repr(e)
+
+    return results, errors
+
+def blender_main(args):
+    import addon_utils, importlib
+    addon_utils.enable('rigify', default_set=True)
+
+    # Add-on startup cost on first import, split into import and register
+    start_time = time.perf_counter()
+    addon = importlib.import_module(args.addon)
+    import_seconds = time.perf_counter() - start_time
+    start_time = time.perf_counter()
+    addon.register()
+    register_seconds = time.perf_counter() - start_time
+    addon.unregister()
+
+    # Modules deferred on startup are loaded by the first operator that uses them
+    start_time = time.perf_counter()
+    for name in ('mirror_utils', 'rig_utils', 'state_utils'):
+        getattr(getattr(addon, name), '__file__')
+    first_use_seconds = time.perf_counter() - start_time
+
+    report = {'results' : {'addon_import' : import_seconds, 'addon_register' : register_seconds,
+        'addon_enable' : import_seconds + register_seconds, 'addon_first_use' : first_use_seconds}, 'errors' : {}}
+
+    # Enable again, module is already imported so this is mostly register cost
+    addon_utils.enable(args.addon, default_set=True)
+    addon_utils.disable(args.addon)
+    start_time = time.perf_counter()
+    addon_utils.enable(args.addon, default_set=True)
+    report['results']['addon_reenable'] = time.perf_counter() - start_time
+
+    common = importlib.import_module(args.addon + '.common')
+
+    for size in args.sizes:
+        fixture = Fixture(size, args.keys, args.groups, args.asymmetry)
+        for name, seconds in run_coords_benchmarks(fixture, common).items():
+            report['results'][name + '@' + str(size)] = seconds
+        for name, seconds in run_weight_benchmarks(fixture, common).items():
+            report['results'][name + '@' + str(size)] = seconds
+
+        results, errors = run_operator_benchmarks(fixture)
+        for name, seconds in results.items():
+            report['results'][name + '@' + str(size)] = seconds
+        for name, error in errors.items():
+            report['errors'][name + '@' + str(size)] = error
+
+    with open(args.result, 'w') as f:
+        json.dump(report, f)
+
+# Run operator tier on headless Blender, return report dict
+def run_blender_tier(args):
+    fd, result_path = tempfile.mkstemp(suffix='.json')
+    os.close(fd)
+
+    command = [args.blender, '--background', '--factory-startup', '--python', os.path.abspath(__file__), '--',
+            '--worker', '--result', result_path, '--addon', args.addon,
+            '--keys', str(args.keys), '--groups', str(args.groups), '--asymmetry', str(args.asymmetry),
+            '--sizes'] + [str(size) for size in args.sizes]
+
+    try:
+        subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, universal_newlines=True)
+        with open(result_path) as f:
+            return json.load(f)
+    except (OSError, ValueError) as e:
+        return {'results' : {}, 'errors' : {'blender' : repr(e)}}
+    finally:
+        if os.path.exists(result_path):
+            os.remove(result_path)
+
+# Ratio of current to baseline time of every benchmark on both
+def compare(results, baseline_results):
+    return {name : seconds / baseline_results[name] for name, seconds in results.items()
+            if baseline_results.get(name)}
+
+def main(argv=None):
+    if argv is None:
+        argv = sys.argv[1:]
+        # Blender pass script arguments after --
+        if '--' in sys.argv:
+            argv = sys.argv[sys.argv.index('--') + 1:]
+
+    parser = argparse.ArgumentParser(description='Benchmark basemesh tools on synthetic fixtures')
+    parser.add_argument('--sizes', type=int, nargs='+', default=list(DEFAULT_SIZES), help='Number of vertices of fixtures')
+    parser.add_argument('--keys', type=int, default=8, help='Number of shape keys')
+    parser.add_argument('--groups', type=int, default=32, help='Number of vertex groups')
+    parser.add_argument('--asymmetry', type=float, default=0.01, help='Fraction of vertices without exact mirror')
+    parser.add_argument('--repeat', type=int, default=3, help='Runs of every pure algorithm benchmark, best is taken')
+    parser.add_argument('--blender', default='', help='Blender executable to also run operator benchmarks')
+    parser.add_argument('--addon', default=ADDON_NAME)
+    parser.add_argument('--output', default='', help='Json result path, default is stdout')
+    parser.add_argument('--baseline', default='', help='Json result to compare with')
+    parser.add_argument('--threshold', type=float, default=0.2, help='Allowed slow down ratio before failing')
+
+    # Worker only arguments
+    parser.add_argument('--worker', action='store_true', help=argparse.SUPPRESS)
+    parser.add_argument('--result', default='', help=argparse.SUPPRESS)
+
+    args = parser.parse_args(argv)
+
+    if args.worker:
+        blender_main(args)
+        return 0
+
+    # Algorithm modules are imported as top level modules, they only need numpy
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+    report = {'config' : {'sizes' : args.sizes, 'keys' : args.keys, 'groups' : args.groups,
+        'asymmetry' : args.asymmetry}, 'results' : {}, 'errors' : {}}
+
+    for name, seconds in run_import_benchmarks(args.repeat).items():
+        report['results'][name] = seconds
+        print('%.4fs' % seconds, name, file=sys.stderr)
+
+    for size in args.sizes:
+        fixture = Fixture(size, args.keys, args.groups, args.asymmetry)
+        for name, seconds in run_algorithm_benchmarks(fixture, args.repeat).items():
+            report['results'][name + '@' + str(size)] = seconds
+            print('%.4fs' % seconds, name + '@' + str(size), file=sys.stderr)
+
+    if args.blender:
+        blender_report = run_blender_tier(args)
+        report['results'].update(blender_report['results'])
+        report['errors'].update(blender_report['errors'])
+
+    exit_code = 0
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        ratios = compare(report['results'], baseline['results'])
+        report['ratios'] = ratios
+        regressions = {name : ratio for name, ratio in ratios.items() if ratio > 1.0 + args.threshold}
+        report['regressions'] = regressions
+        for name, ratio in sorted(regressions.items()):
+            print('SLOWER %.2fx' % ratio, name, file=sys.stderr)
+        if regressions: exit_code = 1
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    else:
+        print(json.dumps(report, indent=2))
+
+    return exit_code
+
+if __name__ == "__main__":
+    sys.exit(main())
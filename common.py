@@ -1,47 +1,114 @@
-import bpy
-
-mirror_dict = {
-        'left' : 'right',
-        'Left' : 'Right',
-        '.L' : '.R',
-        '_L' : '_R',
-        '.l' : '.r',
-        '_l' : '_r'
-        }
+import bpy, bmesh, functools
+from bpy.app.handlers import persistent
+from . import lazy, rig_utils, state_utils
+from .profiling import profiler
+np = lazy.lazy_import('numpy')
 
 def in_active_layers(obj):
     sce = bpy.context.scene
     return any([l for i, l in enumerate(obj.layers) if l and sce.layers[i]])
 
-def get_mirror_name(name):
+# Read co of mesh vertices or shape key data as (n, 3) array
+def get_coords(collection):
+    co = np.empty(len(collection) * 3, dtype=np.float32)
+    collection.foreach_get('co', co)
+    return co.reshape(-1, 3)
+
+# Write (n, 3) array to co of mesh vertices or shape key data
+def set_coords(collection, coords):
+    collection.foreach_set('co', np.ascontiguousarray(coords, dtype=np.float32).ravel())
+
+# Read co of all shape key blocks as one (k, n, 3) array
+def get_shape_key_coords(key_blocks):
+    num_verts = len(key_blocks[0].data) if len(key_blocks) else 0
+    coords = np.empty((len(key_blocks), num_verts * 3), dtype=np.float32)
+    for i, kb in enumerate(key_blocks):
+        kb.data.foreach_get('co', coords[i])
+    return coords.reshape(len(key_blocks), -1, 3)
+
+def set_shape_key_coords(key_blocks, coords):
+    for kb, co in zip(key_blocks, coords):
+        set_coords(kb.data, co)
+
+def get_select_flags(collection):
+    return state_utils.get_bool_flags(collection, 'select')
+
+# Read pose bone matrices as (n, 4, 4) row major array
+def get_pose_matrices(pose_bones, attr='matrix_basis'):
+    matrices = np.empty(len(pose_bones) * 16, dtype=np.float32)
+    pose_bones.foreach_get(attr, matrices)
+    # Blender store matrix in column major order
+    return matrices.reshape(-1, 4, 4).transpose(0, 2, 1)
+
+# Read vertex group weights as sparse (vertex, group, weight) arrays
+def get_vertex_weights(mesh):
+    vert_ids = []
+    group_ids = []
+    weights = []
+    for v in mesh.vertices:
+        for g in v.groups:
+            vert_ids.append(v.index)
+            group_ids.append(g.group)
+            weights.append(g.weight)
+
+    return (np.array(vert_ids, dtype=np.int64),
+            np.array(group_ids, dtype=np.int64),
+            np.array(weights, dtype=np.float64))
+
+# Weight matrices of meshes, keyed by mesh pointer.
+# Blender doesn't have revision counter for weights, so entries are dropped by
+# weight_matrix_cache_update when their object data is updated, and operators
+# clear the cache when they return.
+weight_matrix_cache = {}
+
+def get_weight_matrix(obj):
+    mesh = obj.data
+    revision = (mesh.name, len(mesh.vertices), len(obj.vertex_groups))
+
+    cached = weight_matrix_cache.get(mesh.as_pointer())
+    if cached and cached[0] == revision:
+        return cached[1]
+
+    vert_ids, group_ids, weights = get_vertex_weights(mesh)
+    weight_matrix = rig_utils.WeightMatrix.from_entries(len(mesh.vertices), vert_ids, group_ids, weights,
+            len(obj.vertex_groups))
+    weight_matrix_cache[mesh.as_pointer()] = (revision, weight_matrix)
+
+    return weight_matrix
 
-    # Split name for detect digit at the end
-    splitnames = name.split('.')
-    last_word = splitnames[-1]
+def clear_weight_matrix_cache(mesh=None):
+    if mesh:
+        weight_matrix_cache.pop(mesh.as_pointer(), None)
+    else: weight_matrix_cache.clear()
 
-    # If last word is digit, crop it
-    extra = ''
-    crop_name = name
-    if last_word.isdigit() and len(splitnames) > 1:
-        extra = '.' + last_word
-        crop_name = name[:-len(last_word)-1]
+@persistent
+def weight_matrix_cache_update(scene):
+    # Nothing to drop most of the time, handler is called very often
+    if not weight_matrix_cache or not bpy.data.objects.is_updated:
+        return
+    for o in scene.objects:
+        if o.type == 'MESH' and o.is_updated_data:
+            weight_matrix_cache.pop(o.data.as_pointer(), None)
 
-    mir_name = ''
-    for l, r in mirror_dict.items():
+def get_int_array(collection, attr):
+    values = np.empty(len(collection), dtype=np.int32)
+    collection.foreach_get(attr, values)
+    return values.astype(np.int64)
 
-        if crop_name.endswith(l):
-            ori = l
-            mir = r
-        elif crop_name.endswith(r):
-            ori = r
-            mir = l
-        else:
-            continue
+# Face topology arrays of a mesh: loop starts, loop totals, loop vertices and loop edges
+def get_face_topology(mesh):
+    return (get_int_array(mesh.polygons, 'loop_start'),
+            get_int_array(mesh.polygons, 'loop_total'),
+            get_int_array(mesh.loops, 'vertex_index'),
+            get_int_array(mesh.loops, 'edge_index'))
 
-        mir_name = crop_name[:-len(ori)] + mir + extra
-        break
+def get_edge_vertices(mesh):
+    edges = np.empty(len(mesh.edges) * 2, dtype=np.int32)
+    mesh.edges.foreach_get('vertices', edges)
+    return edges.reshape(-1, 2)
 
-    return mir_name
+def set_select_flags(collection, flags):
+    collection.foreach_set('select', np.ascontiguousarray(flags, dtype=bool))
 
 class ObjectState:
     def __init__(self, obj):
@@ -67,3 +134,206 @@ class MeshState:
             for name, value in self.shape_keys_values.items():
                 kb = self.mesh.shape_keys.key_blocks.get(name)
                 if kb: kb.value = value
+
+# Last element of edit mode select history as (type, index)
+def get_active_elem(bm):
+    if not bm.select_history:
+        return None
+    elem = bm.select_history[-1]
+    if isinstance(elem, bmesh.types.BMVert):
+        return ('VERT', elem.index)
+    if isinstance(elem, bmesh.types.BMEdge):
+        return ('EDGE', elem.index)
+    return ('FACE', elem.index)
+
+class SelectionState:
+    # Vert, edge and face selection of a mesh as boolean arrays with the active face.
+    # Mesh should be on object mode, active vert or edge only exists on edit mode
+    # select history, so it should be taken before leaving edit mode with get_active_elem.
+    def __init__(self, mesh, active_elem=None):
+        self.mesh = mesh
+        self.verts = get_select_flags(mesh.vertices)
+        self.edges = get_select_flags(mesh.edges)
+        self.faces = get_select_flags(mesh.polygons)
+        self.active_face = mesh.polygons.active
+        self.active_elem = active_elem
+
+    # Restore selection by index, only flags that are changed are written.
+    # Collections with different number of elements are skipped.
+    def revert(self):
+        for collection, flags in ((self.mesh.vertices, self.verts), (self.mesh.edges, self.edges),
+                (self.mesh.polygons, self.faces)):
+            if len(collection) == len(flags) and (get_select_flags(collection) != flags).any():
+                set_select_flags(collection, flags)
+        if 0 <= self.active_face < len(self.mesh.polygons) and self.mesh.polygons.active != self.active_face:
+            self.mesh.polygons.active = self.active_face
+
+    # Add remembered active element back to select history of edit mode bmesh
+    def revert_history(self, bm):
+        if not self.active_elem: return
+        elem_type, index = self.active_elem
+        elems = bm.verts if elem_type == 'VERT' else bm.edges if elem_type == 'EDGE' else bm.faces
+        if index < len(elems):
+            elems.ensure_lookup_table()
+            bm.select_history.add(elems[index])
+
+class RigBindings:
+    # Registry of objects bound to armature objects, by armature modifier or bone parent.
+    # Objects reported as updated by scene handler are updated one by one,
+    # it's only rebuilt after objects are added or removed or on another scene.
+    def __init__(self):
+        self.dirty = True
+        self.num_objects = 0
+        self.scene_name = ''
+        self.modifier_users = {}
+        self.bone_children = {}
+
+        # Rigs of every object as (bone parent rig name, modifier rig names)
+        self.object_rigs = {}
+
+        # Objects already updated by move, handler skips them on its next run
+        self.moved = set()
+
+    def get_object_rigs(self, obj):
+        parent = obj.parent.name if obj.parent and obj.parent.type == 'ARMATURE' and obj.parent_bone else ''
+        mod_rigs = frozenset(m.object.name for m in obj.modifiers if m.type == 'ARMATURE' and m.object)
+        return parent, mod_rigs
+
+    def bind(self, name, rigs):
+        parent, mod_rigs = rigs
+        if parent:
+            self.bone_children.setdefault(parent, set()).add(name)
+        for rig_name in mod_rigs:
+            self.modifier_users.setdefault(rig_name, set()).add(name)
+        self.object_rigs[name] = rigs
+
+    def unbind(self, name):
+        rigs = self.object_rigs.pop(name, None)
+        if not rigs: return
+        parent, mod_rigs = rigs
+        if parent:
+            self.bone_children.get(parent, set()).discard(name)
+        for rig_name in mod_rigs:
+            self.modifier_users.get(rig_name, set()).discard(name)
+
+    def update_object(self, obj):
+        rigs = self.get_object_rigs(obj)
+        if self.object_rigs.get(obj.name) != rigs:
+            self.unbind(obj.name)
+            self.bind(obj.name, rigs)
+
+    def rebuild(self, scene):
+        self.modifier_users = {}
+        self.bone_children = {}
+        self.object_rigs = {}
+        self.moved = set()
+
+        for o in scene.objects:
+            self.bind(o.name, self.get_object_rigs(o))
+
+        self.num_objects = len(scene.objects)
+        self.scene_name = scene.name
+        self.dirty = False
+
+    def ensure(self, scene):
+        if self.dirty or scene.name != self.scene_name: self.rebuild(scene)
+
+    # Update only objects flagged as updated, objects_updated is bpy.data.objects.is_updated
+    def update(self, scene, objects_updated):
+        moved = self.moved
+        if moved: self.moved = set()
+        if self.dirty or not objects_updated: return
+
+        # Added or removed objects or another scene need full rebuild
+        if len(scene.objects) != self.num_objects or scene.name != self.scene_name:
+            self.dirty = True
+            return
+
+        for o in scene.objects:
+            if (o.is_updated or o.is_updated_data) and o.name not in moved:
+                self.update_object(o)
+
+    # Objects parented to a bone of the rig, still validated since registry can be stale
+    def get_bone_children(self, scene, rig_obj):
+        self.ensure(scene)
+        objs = [scene.objects.get(name) for name in self.bone_children.get(rig_obj.name, ())]
+        return [o for o in objs if o and o.parent == rig_obj and o.parent_bone]
+
+    # Objects with armature modifier using the rig
+    def get_modifier_users(self, scene, rig_obj):
+        self.ensure(scene)
+        objs = [scene.objects.get(name) for name in self.modifier_users.get(rig_obj.name, ())]
+        return [o for o in objs if o and any(m for m in o.modifiers if m.type == 'ARMATURE' and m.object == rig_obj)]
+
+    # Update registry after objects are rebound to other rig, so handler doesn't need to
+    def move(self, objs):
+        for o in objs:
+            self.update_object(o)
+            self.moved.add(o.name)
+
+rig_bindings = RigBindings()
+
+@persistent
+def rig_bindings_update(scene):
+    # Handler is called very often, objects are only visited if some are updated
+    rig_bindings.update(scene, bpy.data.objects.is_updated)
+
+@persistent
+def rig_bindings_reset(dummy):
+    rig_bindings.dirty = True
+
+# Operator class of bpy.ops, every operator call goes through its __call__
+def get_operator_class():
+    return type(bpy.ops.object.mode_set)
+
+# Count every operator call while profiler is running
+def install_operator_counter():
+    op_class = get_operator_class()
+    if 'basemesh_original_call' in op_class.__dict__: return
+
+    original_call = op_class.__call__
+    def counted_call(self, *args, **kwargs):
+        idname = self.idname_py()
+        profiler.count('operators')
+        profiler.count('op ' + idname)
+        if idname == 'object.mode_set':
+            profiler.count('mode switches')
+        return original_call(self, *args, **kwargs)
+
+    op_class.basemesh_original_call = original_call
+    op_class.__call__ = counted_call
+
+def uninstall_operator_counter():
+    op_class = get_operator_class()
+    original_call = op_class.__dict__.get('basemesh_original_call')
+    if original_call:
+        op_class.__call__ = original_call
+        del op_class.basemesh_original_call
+
+# Decorator for operator execute, profile the whole run if profiler is enabled.
+# Operator called inside other profiled operator is recorded as a span.
+def profiled(execute):
+    @functools.wraps(execute)
+    def wrapper(self, context):
+        if not profiler.enabled:
+            return execute(self, context)
+
+        if profiler.running:
+            with profiler.span(self.bl_label):
+                return execute(self, context)
+
+        profiler.reset(self.bl_label)
+        profiler.running = True
+        install_operator_counter()
+        try:
+            return execute(self, context)
+        finally:
+            uninstall_operator_counter()
+            profiler.running = False
+            profiler.finish()
+
+    return wrapper
+
+def update_scene(scene):
+    profiler.count('scene updates')
+    scene.update()
@@ -0,0 +1,26 @@
+import sys, importlib, importlib.util
+
+# Import module that is only executed on first attribute access, so add-on startup
+# doesn't pay for numpy and algorithm modules until an operator needs them.
+# Name can be relative to package. Already imported modules are returned as is.
+def lazy_import(name, package=None):
+    name = importlib.util.resolve_name(name, package)
+    module = sys.modules.get(name)
+    if module:
+        return module
+
+    spec = importlib.util.find_spec(name)
+    if spec is None:
+        raise ImportError('No module named ' + name, name=name)
+    loader = importlib.util.LazyLoader(spec.loader)
+    spec.loader = loader
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    loader.exec_module(module)
+
+    # Submodule is set on its package like normal import, so from . import still finds it
+    parent, _, child = name.rpartition('.')
+    if parent:
+        setattr(sys.modules[parent], child, module)
+
+    return module
@@ -1,21 +1,256 @@
 import bpy, bmesh
 from bpy.props import *
-from . import common
-from mathutils import Vector, Matrix
-
-def bmesh_vert_active(bm):
-    if bm.select_history:
-        elem = bm.select_history[-1]
-        if isinstance(elem, bmesh.types.BMVert):
-            return elem
-    return None
-
-def bmesh_edge_active(bm):
-    if bm.select_history:
-        elem = bm.select_history[-1]
-        if isinstance(elem, bmesh.types.BMEdge):
-            return elem
-    return None
+from bpy.app.handlers import persistent
+from collections import OrderedDict
+from . import common, lazy, mirror_utils, rig_utils
+from .profiling import profiler
+from mathutils import Matrix
+np = lazy.lazy_import('numpy')
+
+# Vertex mirror maps of meshes, keyed by mesh pointer and axis, with topology and coordinates hash.
+# Only the most recently used maps are kept and all are dropped when a file is loaded.
+mirror_map_cache = OrderedDict()
+MIRROR_MAP_CACHE_SIZE = 16
+
+@persistent
+def mirror_map_cache_reset(dummy):
+    mirror_map_cache.clear()
+
+def mirror_layer_name(axis):
+    return 'basemesh_mirror_' + 'xyz'[axis]
+
+def cache_mirror_map(key, checksum, mirror):
+    mirror_map_cache.pop(key, None)
+    mirror_map_cache[key] = (checksum, mirror)
+    while len(mirror_map_cache) > MIRROR_MAP_CACHE_SIZE:
+        mirror_map_cache.popitem(last=False)
+
+# Get full vertex mirror map of mesh, computed on basis coordinates.
+# Map is stored on mesh integer vertex layer with topology and coordinates hash so it's kept on file,
+# if topology or basis has changed only invalid pairs are rebuilt. Mesh should be on object mode.
+def get_mirror_map(mesh, axis=0):
+    if mesh.shape_keys:
+        coords = common.get_coords(mesh.shape_keys.key_blocks[0].data)
+    else: coords = common.get_coords(mesh.vertices)
+    edges = common.get_edge_vertices(mesh)
+    checksum = mirror_utils.mesh_hash(len(mesh.vertices), edges, len(mesh.polygons), coords)
+
+    key = (mesh.as_pointer(), axis)
+    cached = mirror_map_cache.get(key)
+    if cached and cached[0] == checksum:
+        cache_mirror_map(key, checksum, cached[1])
+        return cached[1]
+
+    layer_name = mirror_layer_name(axis)
+    hash_name = layer_name + '_hash'
+    layer = mesh.vertex_layers_int.get(layer_name)
+
+    # Stored map is still valid
+    if layer and mesh.get(hash_name) == str(checksum):
+        mirror = common.get_int_array(layer.data, 'value')
+        cache_mirror_map(key, checksum, mirror)
+        return mirror
+
+    if layer:
+        mirror = mirror_utils.update_mirror_map(common.get_int_array(layer.data, 'value'), coords, edges, axis)
+    else:
+        mirror = mirror_utils.mirror_map(coords, edges, axis)
+        layer = mesh.vertex_layers_int.new(layer_name)
+
+    layer.data.foreach_set('value', mirror.astype(np.int32))
+    mesh[hash_name] = str(checksum)
+    cache_mirror_map(key, checksum, mirror)
+
+    return mirror
+
+# Index of mirror vertex group for every vertex group of object,
+# groups without mirror are mapped to themselves
+def get_vertex_group_flip_map(obj):
+    names = [vg.name for vg in obj.vertex_groups]
+    indices = {name : i for i, name in enumerate(names)}
+    mir_names = mirror_utils.mirror_name_resolver.resolve_many(names)
+    return np.array([indices.get(mir_name, i) for i, mir_name in enumerate(mir_names)], dtype=np.int64)
+
+# Float data of every loop as (n, size) array
+def get_loop_data(data, attr, size):
+    values = np.empty(len(data) * size, dtype=np.float32)
+    data.foreach_get(attr, values)
+    return values.reshape(-1, size)
+
+# Reorder float data of every loop, return the reordered (n, size) array
+def reorder_loop_data(data, attr, size, loop_ids):
+    return get_loop_data(data, attr, size)[loop_ids]
+
+# Read deform weights of bmesh verts as weight matrix
+def get_bmesh_weight_matrix(verts, deform, num_groups):
+    dverts = [v[deform] for v in verts]
+    counts = np.fromiter((len(dv) for dv in dverts), dtype=np.int64, count=len(dverts))
+    items = [item for dv in dverts for item in dv.items()]
+    group_ids = np.fromiter((i for i, w in items), dtype=np.int64, count=len(items))
+    weights = np.fromiter((w for i, w in items), dtype=np.float64, count=len(items))
+    return rig_utils.WeightMatrix.from_entries(len(verts), np.repeat(np.arange(len(verts)), counts),
+            group_ids, weights, num_groups)
+
+# Swap weights of bmesh verts to their mirror vertex groups, only verts
+# with weight on group that has mirror are rewritten. Return number of rewritten verts.
+def flip_bmesh_weights(verts, deform, flip_map):
+    swapped = flip_map != np.arange(len(flip_map))
+    if not swapped.any():
+        return 0
+
+    weight_matrix = get_bmesh_weight_matrix(verts, deform, len(flip_map))
+    flipped = weight_matrix.remap_groups(flip_map)
+    touched = np.unique(weight_matrix.vert_ids[swapped[weight_matrix.group_ids]])
+
+    indptr = flipped.indptr.tolist()
+    group_ids = flipped.group_ids.tolist()
+    weights = flipped.weights.tolist()
+    for i in touched.tolist():
+        dvert = verts[i][deform]
+        dvert.clear()
+        for j in range(indptr[i], indptr[i + 1]):
+            dvert[group_ids[j]] = weights[j]
+
+    return len(touched)
+
+# Mirror map of mesh with only the pairs that are still mirrored on coords. Cached map is used
+# for axis plane of the object, map of matrix plane is found by position. Mesh should be on object mode.
+def get_verified_mirror_map(mesh, coords, axis=0, matrix=None):
+    if matrix is None:
+        mirror = get_mirror_map(mesh, axis)
+    else: mirror = mirror_utils.spatial_mirror_map(coords, axis, matrix=matrix)
+    valid = mirror_utils.verify_mirror_map(mirror, coords, axis, matrix=matrix)
+    return np.where(valid, mirror, -1)
+
+# Merge distance of seam verts that are not welded by mirror map, same as remove doubles default
+SEAM_MERGE_DISTANCE = 0.0001
+
+# Replace faces of delete_mask with reflected copy of the kept faces, on a single bmesh without
+# temporary objects. mirror is vertex mirror map verified on current coordinates, duplicate verts are
+# welded to the kept vertex on their position and, if transfer_shape_keys is True, take shape keys of
+# the deleted vertex on their position. matrix is optional mirror plane space on object space.
+# Mesh should be on object mode. Return original vertex index of every vertex,
+# offset by number of original vertices if it's mirrored.
+def mirror_mesh_half(obj, delete_mask, mirror, axis=0, matrix=None, transfer_shape_keys=True):
+    mesh = obj.data
+    num_verts = len(mesh.vertices)
+    loop_starts, loop_totals, loop_verts, loop_edges = common.get_face_topology(mesh)
+
+    kept_verts = np.zeros(num_verts, dtype=bool)
+    kept_verts[loop_verts[np.repeat(~delete_mask, loop_totals)]] = True
+
+    # Remember shape keys of the deleted half, mirrored half will take their offsets
+    key_coords = None
+    if mesh.shape_keys and len(mesh.shape_keys.key_blocks) > 1:
+        key_coords = common.get_shape_key_coords(mesh.shape_keys.key_blocks)
+
+    profiler.begin('symmetrize')
+    bm = bmesh.new()
+    bm.from_mesh(mesh)
+    bm.faces.ensure_lookup_table()
+
+    # Track original vertex index on a temporary layer, bmesh ops can reindex elements
+    origin_layer = bm.verts.layers.int.new('basemesh_origin')
+    for i, v in enumerate(bm.verts):
+        v[origin_layer] = i
+
+    # Delete faces with their edges and verts (DEL_FACES context)
+    bmesh.ops.delete(bm, geom=[bm.faces[i] for i in np.nonzero(delete_mask)[0].tolist()], context=5)
+
+    # Duplicate kept half
+    ret = bmesh.ops.duplicate(bm, geom=bm.faces[:])
+    new_verts = [e for e in ret['geom'] if isinstance(e, bmesh.types.BMVert)]
+    new_faces = [e for e in ret['geom'] if isinstance(e, bmesh.types.BMFace)]
+
+    # Vert map can contain both original to duplicate and the reverse
+    is_new = set(new_verts)
+    sources = {}
+    for a, b in ret['vert_map'].items():
+        if b in is_new and a not in is_new:
+            sources[b] = a
+        elif a in is_new and b not in is_new:
+            sources[a] = b
+    dup_verts = list(sources.keys())
+    src_verts = list(sources.values())
+
+    # Original vertex index of the duplicates are offset by number of vertices
+    src_ids = np.array([v[origin_layer] for v in src_verts], dtype=np.int64)
+    for v, i in zip(dup_verts, (src_ids + num_verts).tolist()):
+        v[origin_layer] = i
+
+    # Mirror the duplicate on object space and flip its normals
+    reflection = mirror_utils.reflection_matrix(axis, matrix)
+    bmesh.ops.transform(bm, matrix=Matrix(reflection.tolist()), verts=new_verts)
+    bmesh.ops.reverse_faces(bm, faces=new_faces)
+
+    # Flip the vertex groups of the duplicate
+    deform = bm.verts.layers.deform.active
+    if deform:
+        flip_bmesh_weights(new_verts, deform, get_vertex_group_flip_map(obj))
+
+    # Weld duplicate verts to the kept vertex on their position, which is the mirror of their source,
+    # like verts on the mirror plane
+    kept_by_id = dict(zip(src_ids.tolist(), src_verts))
+    targetmap = {}
+    for v, i in zip(dup_verts, mirror[src_ids].tolist()):
+        target = kept_by_id.get(i)
+        if target is not None:
+            targetmap[v] = target
+
+    # Seam verts slightly off the mirror plane or without valid mirror pair are not welded by the map,
+    # they are merged with the kept verts near the plane by distance, like remove doubles
+    src_coords = common.get_coords(mesh.vertices)[src_ids]
+    plane_dist = np.linalg.norm(src_coords - mirror_utils.reflect_points(src_coords, axis, matrix), axis=1) / 2.0
+    near_plane = (plane_dist <= SEAM_MERGE_DISTANCE).tolist()
+    seam_verts = [v for v, near in zip(dup_verts, near_plane) if near and v not in targetmap]
+    if seam_verts:
+        seam_verts += [v for v, near in zip(src_verts, near_plane) if near]
+
+    bmesh.ops.weld_verts(bm, targetmap=targetmap)
+    if seam_verts:
+        bmesh.ops.remove_doubles(bm, verts=seam_verts, dist=SEAM_MERGE_DISTANCE)
+
+    origins = np.array([v[origin_layer] for v in bm.verts], dtype=np.int64)
+    bm.verts.layers.int.remove(origin_layer)
+
+    bm.to_mesh(mesh)
+    bm.free()
+    profiler.end()
+
+    # Shape keys of mirrored vertices are rewritten completely
+    if key_coords is not None:
+        with profiler.span('shape keys'):
+            targets = sources = None
+            if transfer_shape_keys:
+                # Mirrored vertices take offsets of the deleted vertex on their position
+                new_ids = np.nonzero(origins >= num_verts)[0]
+                partners = mirror[origins[new_ids] - num_verts]
+                transfer = (partners >= 0) & ~kept_verts[partners]
+                targets = new_ids[transfer]
+                sources = partners[transfer]
+
+            key_coords = mirror_utils.symmetrize_shape_keys(key_coords, origins, axis, targets, sources, matrix)
+            common.set_shape_key_coords(mesh.shape_keys.key_blocks, key_coords)
+
+    return origins
+
+# Swap weights of every vertex of mesh object to the mirror vertex groups in one bmesh pass,
+# same remap as the mirrored half of force mirror. Mesh should be on object mode.
+# Return number of rewritten verts.
+def flip_mesh_weights(obj):
+    flip_map = get_vertex_group_flip_map(obj)
+    if not len(flip_map):
+        return 0
+
+    bm = bmesh.new()
+    bm.from_mesh(obj.data)
+    deform = bm.verts.layers.deform.active
+    num_flipped = flip_bmesh_weights(bm.verts[:], deform, flip_map) if deform else 0
+    if num_flipped:
+        bm.to_mesh(obj.data)
+    bm.free()
+
+    return num_flipped
 
 class ObjectState:
     def __init__(self, obj):
@@ -45,210 +280,63 @@ class ForceMirrorAdvance(bpy.types.Operator):
     def recover(self):
         bpy.ops.object.mode_set(mode=self.obj_mode)
 
-    # Assumed happen in object mode
-    def delete_half(self, obj, direction):
-
-        self.scene.objects.active = obj
-        bpy.ops.object.mode_set(mode='EDIT')
-        bpy.ops.mesh.select_all(action='SELECT')
-        bpy.ops.mesh.symmetrize(direction = direction)
-        bpy.ops.mesh.select_all(action='DESELECT')
-
-        bm = bmesh.from_edit_mesh(obj.data)
-        bm.faces.ensure_lookup_table()
-
-        #bpy.ops.mesh.select_mode(type="FACE")
-        self.tool_settings.mesh_select_mode = (False, False, True)
-
-        if direction == 'POSITIVE_X':
-            for f in bm.faces:
-                if f.calc_center_median().x < 0.0:
-                    f.select = True
-        elif direction == 'NEGATIVE_X':
-            for f in bm.faces:
-                if f.calc_center_median().x > 0.0:
-                    f.select = True
-
-        bpy.ops.mesh.delete(type='FACE')
-        bpy.ops.object.mode_set(mode='OBJECT')
-
-    # Assumed happen in object mode
-    def separate_half(self, obj, direction):
-
-        # Populate original objects on scene
-        obj_names = [o.name for o in self.scene.objects]
-
-        self.scene.objects.active = obj
-        bpy.ops.object.mode_set(mode='EDIT')
-        bpy.ops.mesh.select_all(action='DESELECT')
-
-        bm = bmesh.from_edit_mesh(obj.data)
-        bm.faces.ensure_lookup_table()
-
-        if direction == 'POSITIVE_X':
-            for f in bm.faces:
-                if f.calc_center_median().x < 0.0:
-                    f.select = True
-        elif direction == 'NEGATIVE_X':
-            for f in bm.faces:
-                if f.calc_center_median().x > 0.0:
-                    f.select = True
-
-        bpy.ops.mesh.separate(type='SELECTED')
-
-        bpy.ops.object.mode_set(mode='OBJECT')
-
-        sep_obj = [o for o in self.scene.objects if o.name not in obj_names][0]
-
-        return sep_obj
-
-    def check_similar(self, obj1, obj2):
-        polys1 = [p for p in obj1.data.polygons]
-        polys2 = [p for p in obj2.data.polygons]
-        
-        result = {}
-
-        for p1 in polys1:
-            p2 = None
-            for p in polys2:
-                #if (p1.center - p.center).length < 0.00001:
-                if (p1.center - p.center).length < 0.0001:
-                    p2 = p
-                    break
-            if p2:
-                result[p1.index] = p2.index
-        
-        return result
-
     @classmethod
     def poll(cls, context):
         return context.object and context.object.type == 'MESH'
 
+    @common.profiled
     def execute(self, context):
 
         self.remember(context)
 
         obj = context.object
-        scene = context.scene
-
-        # Reset transfrom
-        bpy.ops.object.mode_set(mode='OBJECT')
-        bpy.ops.object.select_all(action='DESELECT')
-        #obj.matrix_world = Matrix()
+        mesh = obj.data
 
         # UV from island for unmarked meshes
-        scene.objects.active = obj
         bpy.ops.object.mode_set(mode='EDIT')
         bpy.ops.mesh.select_all(action='SELECT')
         bpy.ops.uv.seams_from_islands()
         bpy.ops.object.mode_set(mode='OBJECT')
 
-        # Duplicate two copy for original left and right
-        obj.select = True
-        bpy.ops.object.duplicate()
-        ori_half = context.object
-        ori_half.name = '_ORIGINAL_HALF'
-
-        # Delete half of the duplicate objects
-        self.delete_half(ori_half, 'NEGATIVE_X')
+        # Positive x half is kept
+        loop_starts, loop_totals, loop_verts, loop_edges = common.get_face_topology(mesh)
+        coords = common.get_coords(mesh.vertices)
+        centers = mirror_utils.polygon_centers(coords, loop_verts, loop_starts, loop_totals)
+        delete_mask = mirror_utils.classify_half(centers, 0, True)
 
-        # Mirror main object
-        scene.objects.active = obj
-        bpy.ops.object.mode_set(mode='EDIT')
-        bpy.ops.mesh.select_all(action='SELECT')
-        bpy.ops.mesh.symmetrize(direction = 'POSITIVE_X')
-        
-        bpy.ops.object.mode_set(mode='OBJECT')
-
-        # Separate half
-        mirror_half = self.separate_half(obj, 'POSITIVE_X')
-        mirror_half.name = '_MIRRORED_HALF'
-
-        # Check pair face id to original half
-        pair_ids = self.check_similar(mirror_half, ori_half)
-
-        # Separate again for faces with pairs
-        obj_names = [o.name for o in self.scene.objects]
-        scene.objects.active = mirror_half
-        bpy.ops.object.mode_set(mode='EDIT')
-        bpy.ops.mesh.select_all(action='DESELECT')
-        self.tool_settings.mesh_select_mode = (False, False, True)
-
-        bm = bmesh.from_edit_mesh(mirror_half.data)
-        bm.faces.ensure_lookup_table()
-        for i, j in pair_ids.items():
-            bm.faces[i].select = True
-
-        bpy.ops.mesh.separate(type='SELECTED')
-        bpy.ops.object.mode_set(mode='OBJECT')
-
-        mirror_half_with_pairs = [o for o in self.scene.objects if o.name not in obj_names][0]
-        mirror_half_with_pairs.name = '_MIRRORED_HALF_WITH_PAIRS'
-
-        # Sort faces for transfer consistency
-        scene.objects.active = mirror_half_with_pairs
-        bpy.ops.object.mode_set(mode='EDIT')
-        bpy.ops.mesh.select_all(action='SELECT')
-        bpy.ops.mesh.sort_elements(type='CURSOR_DISTANCE', elements={'VERT', 'EDGE', 'FACE'})
-        bpy.ops.object.mode_set(mode='OBJECT')
-
-        # Duplicate original half just in case
-        bpy.ops.object.select_all(action='DESELECT')
-        scene.objects.active = ori_half
-        ori_half.select = True
-        bpy.ops.object.duplicate()
-        ori_half_with_pairs = context.object
-        ori_half_with_pairs.name = '_ORIGINAL_HALF_WITH_PAIRS'
-
-        # Delete non paired half on original half duplicate
-        scene.objects.active = ori_half_with_pairs
-        bpy.ops.object.mode_set(mode='EDIT')
-        bpy.ops.mesh.select_all(action='SELECT')
-        self.tool_settings.mesh_select_mode = (False, False, True)
+        if not delete_mask.any() or delete_mask.all():
+            self.recover()
+            self.report({'WARNING'}, "This object is not valid to mirror")
+            return {'CANCELLED'}
 
-        bm = bmesh.from_edit_mesh(ori_half_with_pairs.data)
-        bm.faces.ensure_lookup_table()
-        for i, j in pair_ids.items():
-            bm.faces[j].select = False
+        # Remember uvs of the deleted half
+        uvs = {uv_layer.name : get_loop_data(uv_layer.data, 'uv', 2) for uv_layer in mesh.uv_layers}
 
-        bpy.ops.mesh.delete(type='FACE')
+        mirror = get_verified_mirror_map(mesh, coords)
+        origins = mirror_mesh_half(obj, delete_mask, mirror)
 
-        # Sort faces for transfer consistency
-        bpy.ops.mesh.select_all(action='SELECT')
-        bpy.ops.mesh.sort_elements(type='CURSOR_DISTANCE', elements={'VERT', 'EDGE', 'FACE'})
+        # Original vertex on the position of every vertex,
+        # mirrored vertices are on the position of mirror of their origin
+        num_verts = len(coords)
+        mirrored = origins >= num_verts
+        old_ids = origins.copy()
+        old_ids[mirrored] = mirror[origins[mirrored] - num_verts]
 
-        bpy.ops.object.mode_set(mode='OBJECT')
+        # Mirrored faces get uvs of the deleted face with the same vertices
+        new_starts, new_totals, new_verts, new_edges = common.get_face_topology(mesh)
+        mirrored_faces = np.logical_or.reduceat(mirrored[new_verts], new_starts)
+        loops1, loops2 = mirror_utils.match_face_loops(new_starts[mirrored_faces], new_totals[mirrored_faces],
+                old_ids[new_verts], loop_starts[delete_mask], loop_totals[delete_mask], loop_verts)
 
-        # Transfer uv from originals
-        bpy.ops.object.select_all(action='DESELECT')
-        ori_half_with_pairs.select = True
-        mirror_half_with_pairs.select = True
-        scene.objects.active = ori_half_with_pairs
-
-        bpy.ops.object.join_uvs()
-        #bpy.ops.object.data_transfer(data_type='SEAM')
-        #bpy.ops.object.data_transfer(data_type='UV')
-        
-
-        # Join all
-        bpy.ops.object.select_all(action='DESELECT')
-        mirror_half.select = True
-        mirror_half_with_pairs.select = True
-        obj.select = True
-        scene.objects.active = obj
-        bpy.ops.object.join()
-
-        # Remove doubles
-        bpy.ops.object.mode_set(mode='EDIT')
-        bpy.ops.mesh.select_all(action='SELECT')
-        bpy.ops.mesh.remove_doubles()
-        bpy.ops.object.mode_set(mode='OBJECT')
+        if len(loops1):
+            for uv_layer in mesh.uv_layers:
+                if uv_layer.name not in uvs: continue
+                new_uvs = get_loop_data(uv_layer.data, 'uv', 2)
+                new_uvs[loops1] = uvs[uv_layer.name][loops2]
+                uv_layer.data.foreach_set('uv', new_uvs.ravel())
 
-        # Delete leftovers
-        bpy.ops.object.select_all(action='DESELECT')
-        ori_half.select = True
-        ori_half_with_pairs.select = True
-        bpy.ops.object.delete()
+        mesh.update()
+        common.clear_weight_matrix_cache(mesh)
 
         self.recover()
 
@@ -270,48 +358,14 @@ class ForceMirror(bpy.types.Operator):
                      ('Z_MIN_PLUS',  "Z- to Z+", "")),
             default = 'X_PLUS_MIN')
 
-    def check_similar(self, obj1, obj2):
-        polys1 = [p for p in obj1.data.polygons]
-        polys2 = [p for p in obj2.data.polygons]
-        
-        poly1_result = []
-        poly2_result = []
-
-        for p1 in polys1:
-            p2 = None
-            for p in polys2:
-                #if (p1.center - p.center).length < 0.00001:
-                if (p1.center - p.center).length < 0.0001:
-                    p2 = p
-                    break
-            if p2:
-                poly1_result.append(p1.index)
-                poly2_result.append(p2.index)
-                polys2.remove(p2)
-        
-        return { obj1.name : poly1_result,
-                 obj2.name : poly2_result }
-
-    def flip_vertex_group(self, obj):
-        vg_founds = []
-        for vg in obj.vertex_groups:
-
-            if vg in vg_founds: 
-                continue
-
-            vg_name = vg.name
-            mir_name = common.get_mirror_name(vg.name)
-            #print(vg.name, mir_name)
-
-            mir_vg = obj.vertex_groups.get(mir_name)
-            if mir_vg:
-
-                mir_vg.name = '_____TEMP____'
-                vg.name = mir_name
-                mir_vg.name = vg_name
-
-                vg_founds.append(vg)
-                vg_founds.append(mir_vg)
+    shape_keys_mode = EnumProperty(
+            name = "Shape Keys",
+            items = (('TRANSFER', "Transfer", "Keep shape keys of the mirrored side where it has the same vertices"),
+                     ('MIRROR', "Mirror", "Mirror shape keys of the kept side")),
+            default = 'TRANSFER')
+
+    mirror_object = StringProperty(name='Mirror Object', default='',
+            description='Use axis plane of this object as mirror plane instead of object origin')
 
     def remember(self, context):
         ### Remember Scene
@@ -429,254 +483,51 @@ class ForceMirror(bpy.types.Operator):
     def poll(cls, context):
         return context.object and context.object.type == 'MESH' and context.space_data.type == 'VIEW_3D'
 
+    @common.profiled
     def execute(self, context):
-        
-        scene = context.scene
+
         obj = context.object
-        view = context.space_data
+        mesh = obj.data
 
         self.remember(context)
 
-        # Dealing with shape keys first
-        shape_keys_copy = False
-        if obj.data.shape_keys and len(obj.data.shape_keys.key_blocks) > 1:
-            shape_keys_copy = True
-
-            # Use basis shape
-            obj.active_shape_key_index = 0
-
-        # Go to object mode and deselect all objects first
+        # Everything is done on a single bmesh on object mode, without temporary objects
         bpy.ops.object.mode_set(mode='OBJECT')
-        bpy.ops.object.select_all(action='DESELECT')
 
-        # Select the object
-        #obj.select = True
+        axis, keep_positive = mirror_utils.parse_mirror_mode(self.mode)
 
-        # Set cursor location for mirror pivot
-        view.cursor_location = obj.location
-        view.pivot_point = 'CURSOR'
+        # Mirror plane on object space, axis plane of mirror object if there's any
+        matrix = None
+        mirror_obj = context.scene.objects.get(self.mirror_object) if self.mirror_object else None
+        if mirror_obj and mirror_obj != obj:
+            matrix = np.array(obj.matrix_world.inverted() * mirror_obj.matrix_world)
 
-        # Go to edit mode
-        bpy.ops.object.mode_set(mode='EDIT')
+        # Unhide all
+        for collection in (mesh.vertices, mesh.edges, mesh.polygons):
+            collection.foreach_set('hide', np.zeros(len(collection), dtype=bool))
 
-        # Unhide all verts
-        bpy.ops.mesh.reveal()
-        #obj.data.update()
-
-        # Use face select to detect face midpoint
-        bpy.ops.mesh.select_mode(type="FACE")
-        bpy.ops.mesh.select_all(action='DESELECT')
-        bm = bmesh.from_edit_mesh(obj.data)
-
-        if self.mode == 'X_PLUS_MIN':
-            for f in bm.faces:
-                if f.calc_center_median().x < 0.0:
-                    f.select = True
-        elif self.mode == 'X_MIN_PLUS':
-            for f in bm.faces:
-                if f.calc_center_median().x > 0.0:
-                    f.select = True
-        elif self.mode == 'Y_PLUS_MIN':
-            for f in bm.faces:
-                if f.calc_center_median().y < 0.0:
-                    f.select = True
-        elif self.mode == 'Y_MIN_PLUS':
-            for f in bm.faces:
-                if f.calc_center_median().y > 0.0:
-                    f.select = True
-        elif self.mode == 'Z_PLUS_MIN':
-            for f in bm.faces:
-                if f.calc_center_median().z < 0.0:
-                    f.select = True
-        elif self.mode == 'Z_MIN_PLUS':
-            for f in bm.faces:
-                if f.calc_center_median().z > 0.0:
-                    f.select = True
-
-        #return {'FINISHED'}
-        select_len = len([f for f in bm.faces if f.select])
+        # Faces on the half to delete
+        loop_starts, loop_totals, loop_verts, loop_edges = common.get_face_topology(mesh)
+        old_coords = common.get_coords(mesh.vertices)
+        centers = mirror_utils.polygon_centers(old_coords, loop_verts, loop_starts, loop_totals)
+        delete_mask = mirror_utils.classify_half(centers, axis, keep_positive, matrix)
+        select_len = int(np.count_nonzero(delete_mask))
 
         # If all faces is selected
-        if len(bm.faces) == select_len or select_len == 0:
-            bpy.ops.object.mode_set(mode='OBJECT')
+        if len(mesh.polygons) == select_len or select_len == 0:
+            self.recover()
             self.report({'WARNING'}, "This object is not valid to mirror, try other axis")
             return {'CANCELLED'}
 
-        # If object using armature
-        if self.arm_obj:
-            self.arm_obj.data.pose_position = 'REST'
-
-        if shape_keys_copy:
-            # Separate mesh for preserving the shape keys
-            bpy.ops.mesh.separate(type='SELECTED')
-            # The leftover mesh is only selected mesh and deselect it
-            left_obj = [o for o in scene.objects if o.select and common.in_active_layers(o) and not o.hide][0]
-
-            # Apply leftover object transform
-            bpy.ops.object.mode_set(mode='OBJECT')
-            scene.objects.active = left_obj
-            bpy.ops.object.transform_apply(location=True, rotation=True, scale=True)
-            left_obj.select = False
-
-            # Sort mesh elements on leftover object
-            bpy.ops.object.mode_set(mode='EDIT')
-            bpy.ops.mesh.select_all(action='SELECT')
-            bpy.ops.mesh.sort_elements(type='CURSOR_DISTANCE', elements={'VERT'})
-            bpy.ops.object.mode_set(mode='OBJECT')
-        else:
-            bpy.ops.mesh.delete(type='FACE')
-
-        # Back to main object
-        scene.objects.active = obj
-        bpy.ops.object.mode_set(mode='EDIT')
-
-        # Update bmesh because number verts is changed
-        #bmesh.update_edit_mesh(obj.data, True)
-        bm = bmesh.from_edit_mesh(obj.data)
-
-        for f in bm.faces:
-            f.select = True
+        # Cached mirror map pairs the welded and shape key transfer vertices
+        mirror = get_verified_mirror_map(mesh, old_coords, axis, matrix)
+        mirror_mesh_half(obj, delete_mask, mirror, axis, matrix, self.shape_keys_mode == 'TRANSFER')
 
-        # Duplicate and separate mesh
-        bpy.ops.mesh.duplicate()
-        bpy.ops.mesh.separate(type='SELECTED')
+        for collection in (mesh.vertices, mesh.edges, mesh.polygons):
+            common.set_select_flags(collection, np.zeros(len(collection), dtype=bool))
 
-        # Go out of the edit mode
-        bpy.ops.object.mode_set(mode='OBJECT')
-
-        # Get the separated object, the only selected object
-        mir_obj = [o for o in scene.objects if o.select and common.in_active_layers(o) and not o.hide][0]
-        scene.objects.active = mir_obj
-
-        # Mirror the object
-        if self.mode in {'X_PLUS_MIN', 'X_MIN_PLUS'}:
-            bpy.ops.transform.mirror(constraint_axis=(True, False, False), constraint_orientation='GLOBAL')
-        elif self.mode in {'Y_PLUS_MIN', 'Y_MIN_PLUS'}:
-            bpy.ops.transform.mirror(constraint_axis=(False, True, False), constraint_orientation='GLOBAL')
-        elif self.mode in {'Z_PLUS_MIN', 'Z_MIN_PLUS'}:
-            bpy.ops.transform.mirror(constraint_axis=(False, False, True), constraint_orientation='GLOBAL')
-
-        bpy.ops.object.transform_apply(location=True, rotation=True, scale=True)
-
-        if shape_keys_copy:
-
-            # Delete the shapes because it'll copy from the mesh leftover
-            bpy.ops.object.shape_key_remove(all=True)
-
-            # Sort mesh elements on mirror object
-            bpy.ops.object.mode_set(mode='EDIT')
-            bpy.ops.mesh.select_all(action='SELECT')
-            bpy.ops.mesh.sort_elements(type='CURSOR_DISTANCE', elements={'VERT'})
-            bpy.ops.object.mode_set(mode='OBJECT')
-
-            # Check the same faces between leftover object to mirror object
-            similar_face_ids = self.check_similar(left_obj, mir_obj)
-
-            # Select similar faces on mirror object
-            bpy.ops.object.mode_set(mode='EDIT')
-            bpy.ops.mesh.select_all(action='DESELECT')
-            bm = bmesh.from_edit_mesh(mir_obj.data)
-            bm.faces.ensure_lookup_table()
-            for i in similar_face_ids[mir_obj.name]:
-                bm.faces[i].select = True
-
-            # Separate the the similar faces for copying shape keys
-            bpy.ops.mesh.separate(type='SELECTED')
-            mir_obj.select = False
-            mir_obj_similar = [o for o in scene.objects if o.select and common.in_active_layers(o) and not o.hide][0]
-            mir_obj_similar.select = False
-
-            bpy.ops.object.mode_set(mode='OBJECT')
-
-            # Sort similar mirror object
-            scene.objects.active = left_obj
-            bpy.ops.object.mode_set(mode='EDIT')
-            bpy.ops.mesh.select_all(action='SELECT')
-            bpy.ops.mesh.sort_elements(type='CURSOR_DISTANCE', elements={'VERT'})
-            bpy.ops.object.mode_set(mode='OBJECT')
-
-            # Delete non similar faces on leftover object
-            bpy.ops.object.mode_set(mode='EDIT')
-            bpy.ops.mesh.select_all(action='SELECT')
-            bm = bmesh.from_edit_mesh(left_obj.data)
-            bm.faces.ensure_lookup_table()
-            for i in similar_face_ids[left_obj.name]:
-                bm.faces[i].select = False
-            bpy.ops.mesh.delete(type='FACE')
-            # Resort the vertices
-            bpy.ops.mesh.select_all(action='SELECT')
-            bpy.ops.mesh.sort_elements(type='CURSOR_DISTANCE', elements={'VERT'})
-            bpy.ops.object.mode_set(mode='OBJECT')
-
-            # Transfer shape keys
-            left_obj.select = True
-            mir_obj_similar.select = True
-            scene.objects.active = mir_obj_similar
-            for i, kb in enumerate(left_obj.data.shape_keys.key_blocks):
-                if i == 0: continue
-                left_obj.active_shape_key_index = i
-                bpy.ops.object.shape_key_transfer()
-                mir_obj_similar.show_only_shape_key = False
-
-            # Make basis shape as active
-            mir_obj_similar.active_shape_key_index = 0
-
-            # Delete leftover object
-            mir_obj_similar.select = False
-            scene.objects.active = left_obj
-            bpy.ops.object.delete()
-
-            # Select all vertex on original mirror but nothing on similar mirror object
-            # This is hack so shape keys will not messed up when merging
-            scene.objects.active = mir_obj
-            bpy.ops.object.mode_set(mode='EDIT')
-            bpy.ops.mesh.select_all(action='SELECT')
-            bpy.ops.object.mode_set(mode='OBJECT')
-            scene.objects.active = mir_obj_similar
-            bpy.ops.object.mode_set(mode='EDIT')
-            bpy.ops.mesh.select_all(action='DESELECT')
-            bpy.ops.object.mode_set(mode='OBJECT')
-
-            # Merge with the original mirror object
-            mir_obj_similar.select = True
-            mir_obj.select = True
-            scene.objects.active = mir_obj
-            bpy.ops.object.join()
-
-            #return {'FINISHED'}
-
-            # Remove doubles
-            bpy.ops.object.mode_set(mode='EDIT')
-            #bpy.ops.mesh.select_all(action='SELECT')
-            #bpy.ops.mesh.remove_doubles()
-            bpy.ops.mesh.remove_doubles(use_unselected=True)
-            bpy.ops.object.mode_set(mode='OBJECT')
-
-        #return {'FINISHED'}
-
-        # Flip the vertex groups
-        self.flip_vertex_group(mir_obj)
-
-        # Merge objects
-        bpy.ops.object.select_all(action='DESELECT')
-        mir_obj.select = True
-        obj.select = True
-        scene.objects.active = obj
-        bpy.ops.object.join()
-
-        # Go to edit mode again
-        bpy.ops.object.mode_set(mode='EDIT')
-
-        # Remove doubles
-        bpy.ops.mesh.select_all(action='SELECT')
-        bpy.ops.mesh.remove_doubles()
-
-        # Fix normals
-        bpy.ops.mesh.normals_make_consistent(inside=False)
-
-        bpy.ops.mesh.select_all(action='DESELECT')
-
-        bpy.ops.object.mode_set(mode='OBJECT')
+        mesh.update()
+        common.clear_weight_matrix_cache(mesh)
 
         self.recover()
 
@@ -688,130 +539,46 @@ class ShapeKeyMirror(bpy.types.Operator):
     bl_description = "Mirror shape key value on selected vertices"
     bl_options = {'REGISTER', 'UNDO'}
 
-    def loop_mirror(self, ids):
-        for i in ids:
-            self.bm.verts[i].select = True
-        
-            bpy.ops.mesh.select_mirror()
-            
-            #print(i)
-            
-            mir_ids = [v.index for v in self.bm.verts if v.select and v.index != i]
-            #print(mir_ids)
-            
-            if mir_ids:
-                self.pair_ids[i] = mir_ids[0]
-                self.bm.verts[mir_ids[0]].select = False
-            else:
-                self.bm.verts[i].select = False
-
-    def refresh_bmesh(self, mesh):
-        self.bm = bmesh.from_edit_mesh(mesh)
-        self.bm.verts.ensure_lookup_table()
-
     @classmethod
     def poll(cls, context):
         obj = context.object
         return obj and obj.type == 'MESH' and obj.mode == 'EDIT' and obj.data.shape_keys
 
+    @common.profiled
     def execute(self, context):
         obj = context.object
         mesh = obj.data
-        settings = context.tool_settings
+
+        # Active vert or edge is lost when leaving edit mode
+        active_elem = common.get_active_elem(bmesh.from_edit_mesh(mesh))
 
         # Go to object mode to get selection
         bpy.ops.object.mode_set(mode='OBJECT')
-
-        # Remember some value
-        ori_use_mirror_x = mesh.use_mirror_x
-        ori_use_mirror_topology = mesh.use_mirror_topology
-        ori_key_index = obj.active_shape_key_index
-
-        # Remember selection mode
-        ori_select_mode = []
-        ori_select_mode.append(settings.mesh_select_mode[0])
-        ori_select_mode.append(settings.mesh_select_mode[1])
-        ori_select_mode.append(settings.mesh_select_mode[2])
-
-        # Remember selection index
-        ori_verts = [i for i, v in enumerate(mesh.vertices) if v.select]
-        ori_edges = [i for i, e in enumerate(mesh.edges) if e.select]
-        ori_polys = [i for i, p in enumerate(mesh.polygons) if p.select]
-
-        # Should be on vertex selection mode
-        settings.mesh_select_mode = (True, False, False)
-
-        # Back to edit mode
-        bpy.ops.object.mode_set(mode='EDIT')
-        self.refresh_bmesh(mesh)
-
-        # Try topology mirror first
-        mesh.use_mirror_x = True
-        mesh.use_mirror_topology = True
+        selection = common.SelectionState(mesh, active_elem)
 
         key = obj.active_shape_key
-        #key_val = self.bm.verts.layers.shape.get(key.name)
-
-        #print()
-
-        # Populate mirror indices
-        sel_ids = [v.index for v in mesh.vertices if v.select]
-        #print(sel_ids)
-        bpy.ops.mesh.select_all(action='DESELECT')
-
-        self.pair_ids = {}
 
-        # Iterate mirror to each vertices to get pair vertices
-        self.loop_mirror(sel_ids)
-
-        #print(self.pair_ids)
-
-        # If there are some vertices still remains unpaired
-        if len(self.pair_ids) != len(sel_ids):
-            # Remaining indices not yet paired
-            rem_ids = [i for i in sel_ids if i not in self.pair_ids]
-            #print(rem_ids)
-        
-            # Try to mirror with no topology
-            mesh.use_mirror_topology = False
-            obj.active_shape_key_index = 0
-            self.refresh_bmesh(mesh)
-
-            # Reiterate mirror
-            self.loop_mirror(rem_ids)
-
-            obj.active_shape_key_index = ori_key_index
-            self.refresh_bmesh(mesh)
-
-        #print(self.pair_ids)
-
-        # Got to object mode to edit shapekey data
-        bpy.ops.object.mode_set(mode='OBJECT')
+        # Get pair of selected vertices, only pairs still mirrored on current basis are used.
+        # Unpaired vertices are -1 and center vertices are their own mirror so skip them
+        basis_coords = common.get_coords(mesh.shape_keys.key_blocks[0].data)
+        mirror = get_verified_mirror_map(mesh, basis_coords)
+        sel_ids = np.nonzero(selection.verts)[0]
+        mir_ids = mirror[sel_ids]
+        paired = (mir_ids >= 0) & (mir_ids != sel_ids)
+        pair_ids = zip(sel_ids[paired].tolist(), mir_ids[paired].tolist())
 
         # Edit shape key data
-        for i, mir_i in self.pair_ids.items():
-            co = key.data[i].co
-            key.data[mir_i].co.x = -co.x
-            key.data[mir_i].co.y = co.y
-            key.data[mir_i].co.z = co.z
-
-        # Recover mirror setting
-        mesh.use_mirror_x = ori_use_mirror_x
-        mesh.use_mirror_topology = ori_use_mirror_topology
-
-        # Recover selection
-        settings.mesh_select_mode = (ori_select_mode[0], ori_select_mode[1], ori_select_mode[2])
-
-        # Reselect stuff
-        for i in ori_verts:
-            mesh.vertices[i].select = True
-        for i in ori_edges:
-            mesh.edges[i].select = True
-        for i in ori_polys:
-            mesh.polygons[i].select = True
+        dst_ids, ori_ids, mirrored = mirror_utils.resolve_chained_pairs(pair_ids)
+        if len(dst_ids):
+            key_co = common.get_coords(key.data)
+            new_co = key_co[ori_ids]
+            new_co[mirrored, 0] *= -1
+            key_co[dst_ids] = new_co
+            common.set_coords(key.data, key_co)
 
         # Finally go back to edit mode
         bpy.ops.object.mode_set(mode='EDIT')
+        selection.revert_history(bmesh.from_edit_mesh(mesh))
 
         return {'FINISHED'}
 
@@ -826,6 +593,7 @@ class ShapeKeyReset(bpy.types.Operator):
         obj = context.object
         return obj and obj.type == 'MESH' and obj.mode == 'EDIT' and obj.data.shape_keys
 
+    @common.profiled
     def execute(self, context):
 
         #bpy.ops.object.mode_set(mode='OBJECT')
@@ -851,12 +619,11 @@ class ShapeKeyReset(bpy.types.Operator):
 
         bpy.ops.object.mode_set(mode='OBJECT')
 
-        for i, v in enumerate(mesh.vertices):
-            if v.select:
-                #print(i, key.data[i].co, v.co)
-                key.data[i].co.x = v.co.x
-                key.data[i].co.y = v.co.y
-                key.data[i].co.z = v.co.z
+        sel = common.get_select_flags(mesh.vertices)
+        if sel.any():
+            key_co = common.get_coords(key.data)
+            key_co[sel] = common.get_coords(mesh.vertices)[sel]
+            common.set_coords(key.data, key_co)
 
         bpy.ops.object.mode_set(mode='EDIT')
 
@@ -875,13 +642,21 @@ class FlipMirrorModifier(bpy.types.Operator):
     def poll(cls, context):
         return context.object and context.object.type == 'MESH'
 
+    @common.profiled
     def execute(self, context):
         obj = context.object
+        mesh = obj.data
 
         self.mode = obj.mode
 
-        # Go to object mode to get selection
+        # Active vert or edge is only on edit mode select history
+        active_elem = None
+        if obj.mode == 'EDIT':
+            active_elem = common.get_active_elem(bmesh.from_edit_mesh(mesh))
+
+        # Mesh data can only be written on object mode
         bpy.ops.object.mode_set(mode='OBJECT')
+        selection = common.SelectionState(mesh, active_elem)
 
         # Get mirror modifier
         mod = None
@@ -900,106 +675,73 @@ class FlipMirrorModifier(bpy.types.Operator):
 
         # Check if mirror modifier has only one axis
         axis = [mod.use_x, mod.use_y, mod.use_z]
-        axis_num = 0
-        for a in axis:
-            if a: axis_num += 1
-        if axis_num > 1 or axis_num == 0:
+        if axis.count(True) != 1:
             self.revert(context)
             self.report({'ERROR'}, "Can only flip with only one axis")
             return {'CANCELLED'}
 
-        # Remember selection
-        bpy.ops.object.mode_set(mode='EDIT')
-        bm = bmesh.from_edit_mesh(obj.data)
-        bm.verts.ensure_lookup_table()
-        bm.edges.ensure_lookup_table()
-        bm.faces.ensure_lookup_table()
-        sel_verts = [i for i, v in enumerate(bm.verts) if v.select]
-        sel_edges = [i for i, e in enumerate(bm.edges) if e.select]
-        sel_faces = [i for i, f in enumerate(bm.faces) if f.select]
-
-        active_vert = bmesh_vert_active(bm)
-        if active_vert: active_vert = active_vert.index
-
-        active_edge = bmesh_edge_active(bm)
-        if active_edge: active_edge = active_edge.index
-
-        active_face = bm.faces.active
-        if active_face: active_face = active_face.index
-
-        bpy.ops.object.mode_set(mode='OBJECT')
-
-        # Remember some variable
-        self.use_mirror_merge = mod.use_mirror_merge
-        self.use_clip = mod.use_clip
-        self.use_mirror_vertex_groups = mod.use_mirror_vertex_groups
-        self.use_mirror_u = mod.use_mirror_u
-        self.use_mirror_v = mod.use_mirror_v
-        self.mirror_object = mod.mirror_object
-
-        # Disable merge and clip before applying
-        mod.use_mirror_merge = False
-        mod.use_clip = False
-
-        # Get number of vertices
-        num_verts = len(obj.data.vertices)
-
-        # Apply mirror modifier
-        bpy.ops.object.modifier_apply(apply_as='DATA', modifier=mod.name)
-
-        # Go to edit mode to delete half
-        bpy.ops.object.mode_set(mode='EDIT')
-
-        # Get bmesh
-        bm = bmesh.from_edit_mesh(obj.data)
-        bm.verts.ensure_lookup_table()
-
-        # Deselect all first
-        bpy.ops.mesh.select_all(action='DESELECT')
-
-        # Select all with index below num of verts before applying
-        for i in range(0, num_verts):
-            bm.verts[i].select = True
-
-        # Delete half
-        bpy.ops.mesh.delete(type='VERT')
-
-        # Reselect
-        bm.verts.ensure_lookup_table()
-        bm.edges.ensure_lookup_table()
-        bm.faces.ensure_lookup_table()
-        for i in sel_verts:
-            bm.verts[i].select = True
-        for i in sel_edges:
-            bm.edges[i].select = True
-        for i in sel_faces:
-            bm.faces[i].select = True
-        if active_vert:
-            bm.select_history.add(bm.verts[active_vert])
-        if active_edge:
-            bm.select_history.add(bm.edges[active_edge])
-        if active_face:
-            bm.faces.active = bm.faces[active_face]
-
-        # Bring back modifier
-        bpy.ops.object.modifier_add(type='MIRROR')
-
-        # Move up new mirror modifier
-        new_mod = obj.modifiers[-1]
-        for i in range(len(obj.modifiers) - 1):
-            bpy.ops.object.modifier_move_up(modifier = new_mod.name)
-
-        # Bring back modifier attributes
-        new_mod.use_x = axis[0]
-        new_mod.use_y = axis[1]
-        new_mod.use_z = axis[2]
-        new_mod.use_mirror_merge = self.use_mirror_merge
-        new_mod.use_clip = self.use_clip
-        new_mod.use_mirror_vertex_groups = self.use_mirror_vertex_groups
-        new_mod.mirror_object = self.mirror_object
+        # Reflection on object space, mirror object plane is used if there's any
+        space = None
+        if mod.mirror_object:
+            space = np.array(obj.matrix_world.inverted() * mod.mirror_object.matrix_world)
+        reflection = mirror_utils.reflection_matrix(axis.index(True), space)
+        rotation = reflection[:3, :3].T
+        translation = reflection[:3, 3]
+
+        # Weights of one side now belong to the other side, done on the unchanged mesh
+        # since weights are remapped through a bmesh
+        if mod.use_mirror_vertex_groups:
+            flip_mesh_weights(obj)
+
+        # Custom normals are read before topology changes
+        normals = None
+        if mesh.has_custom_normals:
+            mesh.calc_normals_split()
+            normals = np.empty(len(mesh.loops) * 3, dtype=np.float32)
+            mesh.loops.foreach_get('normal', normals)
+            normals = normals.reshape(-1, 3)
+
+        # Reflect vertices and every shape key in place
+        with profiler.span('reflect'):
+            common.set_coords(mesh.vertices, common.get_coords(mesh.vertices).dot(rotation) + translation)
+            if mesh.shape_keys:
+                key_blocks = mesh.shape_keys.key_blocks
+                common.set_shape_key_coords(key_blocks, common.get_shape_key_coords(key_blocks).dot(rotation) + translation)
+
+        # Reflection turns faces inside out, so reverse winding of every face with its loop data
+        with profiler.span('reverse winding'):
+            loop_starts, loop_totals, loop_verts, loop_edges = common.get_face_topology(mesh)
+            loop_ids, edge_ids = mirror_utils.reversed_loop_order(loop_starts, loop_totals)
+            mesh.loops.foreach_set('vertex_index', loop_verts[loop_ids].astype(np.int32))
+            mesh.loops.foreach_set('edge_index', loop_edges[edge_ids].astype(np.int32))
+
+            for uv_layer in mesh.uv_layers:
+                uvs = reorder_loop_data(uv_layer.data, 'uv', 2, loop_ids)
+                if mod.use_mirror_u: uvs[:, 0] = 1.0 - uvs[:, 0] + getattr(mod, 'mirror_offset_u', 0.0)
+                if mod.use_mirror_v: uvs[:, 1] = 1.0 - uvs[:, 1] + getattr(mod, 'mirror_offset_v', 0.0)
+                uv_layer.data.foreach_set('uv', uvs.ravel())
+
+            for vcol in mesh.vertex_colors:
+                if not len(vcol.data): continue
+                size = len(vcol.data[0].color)
+                vcol.data.foreach_set('color', reorder_loop_data(vcol.data, 'color', size, loop_ids).ravel())
+
+        mesh.update()
+
+        if normals is not None:
+            # Normals are transformed by inverse transpose of the reflection
+            normals = normals[loop_ids].dot(np.linalg.inv(reflection[:3, :3]))
+            normals /= np.maximum(np.linalg.norm(normals, axis=1), 1e-12)[:, None]
+            mesh.normals_split_custom_set(normals.tolist())
+
+        # Element order is unchanged, so selection can be restored by index
+        selection.revert()
 
         self.revert(context)
 
+        if self.mode == 'EDIT':
+            selection.revert_history(bmesh.from_edit_mesh(mesh))
+
         return {'FINISHED'}
 
 #class MirrorUV(bpy.types.Operator):
@@ -0,0 +1,413 @@
+import re, zlib, functools
+import numpy as np
+
+# Offsets to visit the 27 neighbor cells of a grid cell
+NEIGHBOR_OFFSETS = [(x, y, z) for x in (-1, 0, 1) for y in (-1, 0, 1) for z in (-1, 0, 1)]
+
+# Maximum number of cells per axis, so packed cell keys always fit in int64
+MAX_CELLS_PER_AXIS = 1 << 20
+
+class SpatialHash:
+    # Uniform grid index over a (n, 3) coordinate array.
+    # Cell size is never smaller than tolerance, so every point within tolerance
+    # of a query can be found on the 27 cells around the query cell.
+    def __init__(self, coords, tolerance):
+        self.coords = np.asarray(coords, dtype=np.float64).reshape(-1, 3)
+        self.tolerance = tolerance
+
+        if len(self.coords):
+            self.origin = self.coords.min(axis=0)
+            span = float((self.coords.max(axis=0) - self.origin).max())
+        else:
+            self.origin = np.zeros(3)
+            span = 0.0
+
+        # Indexed points use cells 2 to MAX_CELLS_PER_AXIS - 3, so any query next to them
+        # and all of its neighbor cells still fit on the grid
+        self.cell_size = max(tolerance, span / (MAX_CELLS_PER_AXIS - 5), 1e-12)
+
+        # Index is sorted by packed cell key so a cell is a contiguous range
+        keys = self.cell_keys(self.cells(self.coords))
+        self.order = np.argsort(keys, kind='stable')
+        self.sorted_keys = keys[self.order]
+
+    def cells(self, coords):
+        # Shift by two cells so neighbor cells of any useful query are never negative
+        return np.floor((coords - self.origin) / self.cell_size).astype(np.int64) + 2
+
+    def cell_keys(self, cells):
+        return (cells[:, 0] << 40) | (cells[:, 1] << 20) | cells[:, 2]
+
+    # Return all (query index, indexed point index) pairs closer than tolerance
+    def query_pairs(self, coords):
+        coords = np.asarray(coords, dtype=np.float64).reshape(-1, 3)
+        empty = np.empty(0, dtype=np.int64)
+        if not len(coords) or not len(self.coords):
+            return empty, empty
+
+        # Queries outside of the grid are more than a cell away from every indexed point
+        query_cells = self.cells(coords)
+        valid = np.all((query_cells >= 1) & (query_cells <= MAX_CELLS_PER_AXIS - 2), axis=1)
+        query_ids = np.nonzero(valid)[0]
+
+        # Sorted query keys make the binary searches cache friendly,
+        # neighbor keys are just a constant shift so they stay sorted
+        keys = self.cell_keys(query_cells[valid])
+        order = np.argsort(keys, kind='stable')
+        query_ids = query_ids[order]
+        keys = keys[order]
+
+        ids1 = []
+        ids2 = []
+
+        for x, y, z in NEIGHBOR_OFFSETS:
+            shifted = keys + ((x << 40) + (y << 20) + z)
+            lo = np.searchsorted(self.sorted_keys, shifted, side='left')
+            hi = np.searchsorted(self.sorted_keys, shifted, side='right')
+            counts = hi - lo
+            if not counts.any(): continue
+
+            # Expand every query into its candidate range
+            q = np.repeat(query_ids, counts)
+            starts = np.repeat(lo - np.cumsum(counts) + counts, counts)
+            c = self.order[starts + np.arange(len(q))]
+
+            dist = np.linalg.norm(coords[q] - self.coords[c], axis=1)
+            close = dist < self.tolerance
+            ids1.append(q[close])
+            ids2.append(c[close])
+
+        if not ids1:
+            return empty, empty
+
+        ids1 = np.concatenate(ids1)
+        ids2 = np.concatenate(ids2)
+
+        # Sort by query index then by indexed point index
+        order = np.lexsort((ids2, ids1))
+        return ids1[order], ids2[order]
+
+# Pair points of coords1 with points of coords2 closer than tolerance.
+# Every coords1 point take the lowest index coords2 point within tolerance,
+# if unique is True, already paired coords2 points are not used again.
+# Return two index arrays with the same length.
+def pair_by_position(coords1, coords2, tolerance=0.0001, unique=True):
+    ids1, ids2 = SpatialHash(coords2, tolerance).query_pairs(coords1)
+    if not len(ids1):
+        return ids1, ids2
+
+    first = np.ones(len(ids1), dtype=bool)
+    first[1:] = ids1[1:] != ids1[:-1]
+
+    # Fast path, if no coords2 point is the first candidate of two coords1 points,
+    # taking the first candidate is the same as the greedy pairing
+    if not unique or len(np.unique(ids2[first])) == np.count_nonzero(first):
+        return ids1[first], ids2[first]
+
+    # Slow path only loop over candidates, not over all points
+    used = np.zeros(len(coords2), dtype=bool)
+    result1 = []
+    result2 = []
+    last = -1
+    for i, j in zip(ids1.tolist(), ids2.tolist()):
+        if i == last or used[j]: continue
+        used[j] = True
+        last = i
+        result1.append(i)
+        result2.append(j)
+
+    return np.array(result1, dtype=np.int64), np.array(result2, dtype=np.int64)
+
+# Sequentially writing mirrored coordinates from source to destination index
+# can read values written by earlier pairs. Return the original index and
+# whether the value is mirrored (odd number of flips) for every destination,
+# so all writes can be done at once with the same result.
+def resolve_chained_pairs(pairs):
+    written = {}
+    for src, dst in pairs:
+        origin, flips = written.get(src, (src, 0))
+        written[dst] = (origin, flips + 1)
+
+    dst_ids = np.fromiter(written.keys(), dtype=np.int64, count=len(written))
+    values = list(written.values())
+    origin_ids = np.array([v[0] for v in values], dtype=np.int64)
+    mirrored = np.array([v[1] % 2 == 1 for v in values], dtype=bool)
+
+    return dst_ids, origin_ids, mirrored
+
+AXIS_INDEX = {'X' : 0, 'Y' : 1, 'Z' : 2}
+
+# Parse mirror mode like 'X_PLUS_MIN' or direction like 'POSITIVE_X',
+# return axis index and whether positive side is kept
+def parse_mirror_mode(mode):
+    if mode.startswith('POSITIVE_') or mode.startswith('NEGATIVE_'):
+        return AXIS_INDEX[mode[-1]], mode.startswith('POSITIVE_')
+    return AXIS_INDEX[mode[0]], mode.endswith('PLUS_MIN')
+
+# Shape keys of symmetrized mesh as (k, m, 3) array. key_coords is (k, n, 3) original
+# shape keys with reference key first, origins is original vertex index of every vertex,
+# offset by n if the vertex is a mirrored copy. Mirrored vertices get reflected shape keys
+# of their origin, then targets take offsets of original vertices on sources instead.
+# Offsets are relative to reference key, so offset between any two keys is kept as is
+# and keys relative to other keys stay valid. matrix is optional mirror plane space.
+def symmetrize_shape_keys(key_coords, origins, axis=0, targets=None, sources=None, matrix=None):
+    key_coords = np.asarray(key_coords)
+    num_verts = key_coords.shape[1]
+    origins = np.asarray(origins, dtype=np.int64)
+    mirrored = origins >= num_verts
+
+    result = key_coords[:, np.where(mirrored, origins - num_verts, origins)]
+    if matrix is None:
+        result[:, mirrored, axis] *= -1
+    else:
+        shape = result[:, mirrored].shape
+        result[:, mirrored] = reflect_points(result[:, mirrored], axis, matrix).reshape(shape)
+
+    if targets is not None and len(targets):
+        offsets = key_coords[:, sources] - key_coords[0, sources]
+        result[:, targets] = result[0, targets] + offsets
+
+    return result
+
+# Loop permutations that reverse the winding of every face, first loop of each face is kept.
+# Return (loop_ids, edge_ids): new loop i takes vertex and loop data of loop_ids[i]
+# and edge index of edge_ids[i].
+def reversed_loop_order(loop_starts, loop_totals):
+    loop_starts = np.asarray(loop_starts, dtype=np.int64)
+    loop_totals = np.asarray(loop_totals, dtype=np.int64)
+    starts = np.repeat(loop_starts, loop_totals)
+    totals = np.repeat(loop_totals, loop_totals)
+    local = np.arange(len(starts)) - starts
+    return starts + (totals - local) % totals, starts + (totals - local - 1) % totals
+
+# Affine (4, 4) reflection across a plane of space matrix, plane normal is the matrix axis
+def reflection_matrix(axis=0, space=None):
+    scale = np.identity(4)
+    scale[axis, axis] = -1.0
+    if space is None:
+        return scale
+    space = np.asarray(space, dtype=np.float64)
+    return space.dot(scale).dot(np.linalg.inv(space))
+
+# Reflect (n, 3) points across the mirror plane, the plane of axis
+# or the plane of axis of matrix space if it's not None
+def reflect_points(coords, axis=0, matrix=None):
+    coords = np.asarray(coords, dtype=np.float64).reshape(-1, 3)
+    if matrix is None:
+        reflected = coords.copy()
+        reflected[:, axis] *= -1
+        return reflected
+    reflection = reflection_matrix(axis, matrix)
+    return coords.dot(reflection[:3, :3].T) + reflection[:3, 3]
+
+# Median center of every face, same as BMFace.calc_center_median()
+def polygon_centers(coords, loop_verts, loop_starts, loop_totals):
+    coords = np.asarray(coords, dtype=np.float64)
+    if not len(loop_starts):
+        return np.empty((0, 3))
+    sums = np.add.reduceat(coords[loop_verts], loop_starts, axis=0)
+    return sums / np.asarray(loop_totals)[:, None]
+
+# Faces on the side that is not kept, matrix is optional mirror plane space
+# on the same space as points, mirror plane is the plane of its axis
+def classify_half(points, axis=0, keep_positive=True, matrix=None):
+    points = np.asarray(points, dtype=np.float64).reshape(-1, 3)
+    if matrix is not None:
+        inv = np.linalg.inv(np.asarray(matrix, dtype=np.float64))
+        points = points @ inv[:3, :3].T + inv[:3, 3]
+    if keep_positive:
+        return points[:, axis] < 0.0
+    return points[:, axis] > 0.0
+
+# Checksum of mesh topology, edges is (n, 2) vertex index array
+def topology_hash(num_verts, edges, num_faces=0):
+    edges = np.ascontiguousarray(edges, dtype=np.int32)
+    return zlib.crc32(edges.tobytes(), zlib.crc32(np.array([num_verts, num_faces], dtype=np.int64).tobytes()))
+
+# Checksum of mesh topology and vertex coordinates, positions only moved also change it
+def mesh_hash(num_verts, edges, num_faces, coords):
+    coords = np.ascontiguousarray(coords, dtype=np.float32)
+    return zlib.crc32(coords.tobytes(), topology_hash(num_verts, edges, num_faces))
+
+# Vertex neighbors as CSR arrays, neighbors of vertex i are on indices[indptr[i]:indptr[i + 1]]
+def vertex_adjacency(num_verts, edges):
+    edges = np.asarray(edges, dtype=np.int64).reshape(-1, 2)
+    sources = np.concatenate([edges[:, 0], edges[:, 1]])
+    targets = np.concatenate([edges[:, 1], edges[:, 0]])
+    order = np.argsort(sources, kind='stable')
+    indptr = np.zeros(num_verts + 1, dtype=np.int64)
+    np.cumsum(np.bincount(sources, minlength=num_verts), out=indptr[1:])
+    return indptr, targets[order]
+
+# Mirror map by position, vertex i mirror is vertex mirror[i], -1 if not found.
+# matrix is optional mirror plane space, like on reflect_points.
+def spatial_mirror_map(coords, axis=0, tolerance=0.0001, matrix=None):
+    coords = np.asarray(coords, dtype=np.float64).reshape(-1, 3)
+    reflected = reflect_points(coords, axis, matrix)
+
+    mirror = np.full(len(coords), -1, dtype=np.int64)
+    ids1, ids2 = pair_by_position(reflected, coords, tolerance)
+    mirror[ids1] = ids2
+    return mirror
+
+# Pair unmatched vertices using already paired neighbors. Mirror of unmatched vertex should be
+# a neighbor of the mirror of all its paired neighbors, it's paired only if that's unambiguous.
+def topology_mirror_fallback(mirror, num_verts, edges):
+    mirror = np.array(mirror, dtype=np.int64, copy=True)
+    unmatched = set(np.nonzero(mirror < 0)[0].tolist())
+    if not unmatched:
+        return mirror
+
+    indptr, indices = vertex_adjacency(num_verts, edges)
+    def neighbors(v):
+        return indices[indptr[v]:indptr[v + 1]].tolist()
+    used = set(mirror[mirror >= 0].tolist())
+
+    changed = True
+    while changed and unmatched:
+        changed = False
+        for v in sorted(unmatched):
+            if v not in unmatched: continue
+
+            paired = [n for n in neighbors(v) if mirror[n] >= 0]
+            if not paired: continue
+
+            candidates = set(neighbors(mirror[paired[0]]))
+            for n in paired[1:]:
+                candidates &= set(neighbors(mirror[n]))
+            candidates = [c for c in candidates if c not in used and (c == v or c in unmatched)]
+            if len(candidates) != 1: continue
+
+            c = candidates[0]
+            mirror[v] = c
+            mirror[c] = v
+            used.update((v, c))
+            unmatched.discard(v)
+            unmatched.discard(c)
+            changed = True
+
+    return mirror
+
+# Full vertex mirror map, by position first then by topology for asymmetric vertices
+def mirror_map(coords, edges, axis=0, tolerance=0.0001, matrix=None):
+    mirror = spatial_mirror_map(coords, axis, tolerance, matrix)
+    return topology_mirror_fallback(mirror, len(mirror), edges)
+
+# Check stored mirror map against current coordinates, entries are valid if
+# the pair is symmetric and their positions are still mirrored
+def verify_mirror_map(mirror, coords, axis=0, tolerance=0.0001, matrix=None):
+    mirror = np.asarray(mirror, dtype=np.int64)
+    coords = np.asarray(coords, dtype=np.float64).reshape(-1, 3)
+    n = len(coords)
+
+    valid = (mirror >= 0) & (mirror < n)
+    ids = np.nonzero(valid)[0]
+    partners = mirror[ids]
+    valid[ids] = mirror[partners] == ids
+
+    ids = np.nonzero(valid)[0]
+    reflected = reflect_points(coords[ids], axis, matrix)
+    valid[ids] = np.linalg.norm(reflected - coords[mirror[ids]], axis=1) < tolerance
+
+    return valid
+
+# Rebuild only invalid entries of a stored mirror map
+def update_mirror_map(mirror, coords, edges, axis=0, tolerance=0.0001, matrix=None):
+    coords = np.asarray(coords, dtype=np.float64).reshape(-1, 3)
+    mirror = np.array(mirror, dtype=np.int64, copy=True)
+    if len(mirror) != len(coords):
+        return mirror_map(coords, edges, axis, tolerance, matrix)
+
+    valid = verify_mirror_map(mirror, coords, axis, tolerance, matrix)
+    mirror[~valid] = -1
+
+    # Pair by position only between unmatched vertices
+    unmatched = np.nonzero(~valid)[0]
+    if len(unmatched):
+        reflected = reflect_points(coords[unmatched], axis, matrix)
+        ids1, ids2 = pair_by_position(reflected, coords[unmatched], tolerance)
+        mirror[unmatched[ids1]] = unmatched[ids2]
+
+    return topology_mirror_fallback(mirror, len(mirror), edges)
+
+# Match faces with the same set of vertices, faces are loop starts and totals on their loop_verts.
+# Faces with negative vertex index are never matched. Return loop index arrays,
+# loop loops1[i] of the first faces is on the same vertex as loop loops2[i] of the second faces.
+def match_face_loops(loop_starts1, loop_totals1, loop_verts1, loop_starts2, loop_totals2, loop_verts2):
+    loop_verts1 = np.asarray(loop_verts1, dtype=np.int64)
+    loop_verts2 = np.asarray(loop_verts2, dtype=np.int64)
+
+    faces = {}
+    for start, total in zip(np.asarray(loop_starts2).tolist(), np.asarray(loop_totals2).tolist()):
+        verts = loop_verts2[start:start + total].tolist()
+        if min(verts) < 0: continue
+        faces[tuple(sorted(verts))] = {v : start + k for k, v in enumerate(verts)}
+
+    loops1 = []
+    loops2 = []
+    for start, total in zip(np.asarray(loop_starts1).tolist(), np.asarray(loop_totals1).tolist()):
+        verts = loop_verts1[start:start + total].tolist()
+        loops = faces.get(tuple(sorted(verts)))
+        if loops is None: continue
+        loops1.extend(range(start, start + total))
+        loops2.extend(loops[v] for v in verts)
+
+    return np.array(loops1, dtype=np.int64), np.array(loops2, dtype=np.int64)
+
+# Sides at the end of the name, like hand.L
+mirror_dict = {
+        'left' : 'right',
+        'Left' : 'Right',
+        '.L' : '.R',
+        '_L' : '_R',
+        '.l' : '.r',
+        '_l' : '_r'
+        }
+
+# Sides that can be at the start of the name, followed by separator like L_hand
+mirror_prefix_dict = {
+        'Left' : 'Right',
+        'left' : 'right',
+        'L' : 'R',
+        }
+
+class MirrorNameResolver:
+    # Resolve mirror names with compiled patterns for every side convention.
+    # Side at the end can be followed by number like hand.L.001 or thumb.01.L.02,
+    # it's checked first so names like left_eye.L keep the old behavior.
+    # Side at the start should be followed by separator like L_hand.
+    # Results are memoized on bounded least recently used cache.
+    def __init__(self, suffixes, prefixes, cache_size=4096):
+        self.sides = {}
+        for sides in (suffixes, prefixes):
+            for l, r in sides.items():
+                self.sides[l] = r
+                self.sides[r] = l
+
+        def alternatives(sides):
+            sides = list(sides) + list(sides.values())
+            # Longer sides are tried first so 'left' is never matched as '.l'
+            return '|'.join(re.escape(side) for side in sorted(sides, key=len, reverse=True))
+
+        self.suffix_pattern = re.compile(r'({})(?:\.[0-9]+)?$'.format(alternatives(suffixes)))
+        self.prefix_pattern = re.compile(r'^({})(?=[_.\-])'.format(alternatives(prefixes)))
+
+        self.resolve = functools.lru_cache(maxsize=cache_size)(self.resolve_uncached)
+
+    # Return mirror name, empty if name has no side
+    def resolve_uncached(self, name):
+        match = self.suffix_pattern.search(name) or self.prefix_pattern.match(name)
+        if not match:
+            return ''
+        start, end = match.span(1)
+        return name[:start] + self.sides[match.group(1)] + name[end:]
+
+    def resolve_many(self, names):
+        resolve = self.resolve
+        return [resolve(name) for name in names]
+
+mirror_name_resolver = MirrorNameResolver(mirror_dict, mirror_prefix_dict)
+
+# Return mirror name, empty if name has no side
+def get_mirror_name(name):
+    return mirror_name_resolver.resolve(name)
@@ -0,0 +1,91 @@
+import json, time
+from collections import OrderedDict
+
+class NullSpan:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        return False
+
+# Shared no-op span, so disabled profiler doesn't allocate anything
+NULL_SPAN = NullSpan()
+
+class Span:
+    def __init__(self, profiler, name):
+        self.profiler = profiler
+        self.name = name
+
+    def __enter__(self):
+        self.profiler.begin(self.name)
+        return self
+
+    def __exit__(self, *args):
+        self.profiler.end()
+        return False
+
+class Profiler:
+    # Nested timing spans and counters of the last profiled run.
+    # Every call returns right away when it's disabled.
+    def __init__(self):
+        self.enabled = False
+        self.running = False
+        self.reset()
+
+    def reset(self, name=''):
+        self.name = name
+        self.start_time = time.perf_counter()
+        self.total_seconds = 0.0
+
+        # Finished spans as (name, start seconds, duration seconds, depth)
+        self.spans = []
+        self.counters = {}
+        self.stack = []
+
+    def begin(self, name):
+        if not self.enabled: return
+        self.stack.append((name, time.perf_counter()))
+
+    def end(self):
+        if not self.enabled or not self.stack: return
+        name, start = self.stack.pop()
+        self.spans.append((name, start - self.start_time, time.perf_counter() - start, len(self.stack)))
+
+    def span(self, name):
+        if not self.enabled:
+            return NULL_SPAN
+        return Span(self, name)
+
+    def count(self, name, num=1):
+        if not self.enabled: return
+        self.counters[name] = self.counters.get(name, 0) + num
+
+    # Close unfinished spans and set total time, return total time
+    def finish(self):
+        while self.stack:
+            self.end()
+        self.total_seconds = time.perf_counter() - self.start_time
+        return self.total_seconds
+
+    # Total seconds and number of calls of every span name and depth, in first start order
+    def breakdown(self):
+        totals = OrderedDict()
+        for name, start, duration, depth in sorted(self.spans, key=lambda s: s[1]):
+            seconds, calls = totals.get((name, depth), (0.0, 0))
+            totals[(name, depth)] = (seconds + duration, calls + 1)
+        return [(name, depth, seconds, calls) for (name, depth), (seconds, calls) in totals.items()]
+
+    # Chrome trace event format, can be opened on chrome://tracing
+    def chrome_trace(self):
+        events = [{'name' : name, 'ph' : 'X', 'pid' : 1, 'tid' : 1,
+            'ts' : start * 1e6, 'dur' : duration * 1e6} for name, start, duration, depth in self.spans]
+        events.sort(key=lambda e: e['ts'])
+        events.append({'name' : 'counters', 'ph' : 'C', 'pid' : 1, 'tid' : 1,
+            'ts' : self.total_seconds * 1e6, 'args' : dict(self.counters)})
+        return {'traceEvents' : events, 'otherData' : {'run' : self.name, 'total_seconds' : self.total_seconds}}
+
+    def export_chrome_trace(self, filepath):
+        with open(filepath, 'w') as f:
+            json.dump(self.chrome_trace(), f)
+
+profiler = Profiler()
@@ -0,0 +1,260 @@
+import numpy as np
+
+# Vertices with smaller total weight are left undeformed, same as armature modifier
+MIN_TOTAL_WEIGHT = 0.0001
+
+class WeightMatrix:
+    # Sparse vertex x group weight matrix in CSR layout,
+    # weights of vertex i are on indptr[i]:indptr[i + 1]
+    def __init__(self, indptr, group_ids, weights, num_groups):
+        self.indptr = indptr
+        self.group_ids = group_ids
+        self.weights = weights
+        self.num_groups = num_groups
+
+    @classmethod
+    def from_entries(cls, num_verts, vert_ids, group_ids, weights, num_groups=None):
+        vert_ids = np.asarray(vert_ids, dtype=np.int64)
+        group_ids = np.asarray(group_ids, dtype=np.int64)
+        weights = np.asarray(weights, dtype=np.float64)
+
+        order = np.argsort(vert_ids, kind='stable')
+        indptr = np.zeros(num_verts + 1, dtype=np.int64)
+        np.cumsum(np.bincount(vert_ids, minlength=num_verts), out=indptr[1:])
+
+        if num_groups is None:
+            num_groups = int(group_ids.max()) + 1 if len(group_ids) else 0
+
+        return cls(indptr, group_ids[order], weights[order], num_groups)
+
+    @property
+    def num_verts(self):
+        return len(self.indptr) - 1
+
+    @property
+    def vert_ids(self):
+        return np.repeat(np.arange(self.num_verts), np.diff(self.indptr))
+
+    # Return (vertex, group, weight) arrays
+    def entries(self):
+        return self.vert_ids, self.group_ids, self.weights
+
+    def group_totals(self):
+        return np.bincount(self.group_ids, self.weights, minlength=self.num_groups)
+
+    def group_vertex_counts(self):
+        return np.bincount(self.group_ids, minlength=self.num_groups)
+
+    def vertex_totals(self):
+        return np.bincount(self.vert_ids, self.weights, minlength=self.num_verts)
+
+    # Dense weights of a single group for all vertices
+    def group_weights(self, group):
+        result = np.zeros(self.num_verts)
+        mask = self.group_ids == group
+        result[self.vert_ids[mask]] = self.weights[mask]
+        return result
+
+    # Weight matrix with every group replaced by group_map[group],
+    # only on vertices flagged on vert_mask if it's not None
+    def remap_groups(self, group_map, vert_mask=None):
+        group_ids = np.asarray(group_map, dtype=np.int64)[self.group_ids]
+        if vert_mask is not None:
+            group_ids = np.where(np.asarray(vert_mask, dtype=bool)[self.vert_ids], group_ids, self.group_ids)
+        return WeightMatrix(self.indptr, group_ids, self.weights, self.num_groups)
+
+# Matrices that bring vertex from rest to pose position for each vertex group.
+# rest_matrices and pose_matrices are (g, 4, 4) bone matrices on armature space,
+# premat is the object space to armature space matrix.
+def skinning_matrices(rest_matrices, pose_matrices, premat=None):
+    matrices = np.matmul(pose_matrices, np.linalg.inv(rest_matrices))
+    if premat is not None:
+        premat = np.asarray(premat, dtype=np.float64)
+        matrices = np.matmul(np.matmul(np.linalg.inv(premat), matrices), premat)
+    return matrices
+
+# Blend group matrices per vertex using sparse (vertex, group, weight) entries.
+# Only groups flagged on deform_groups are used, if it's not None.
+# Return (n, 3, 4) affine matrices, identity for vertices with no weight.
+def blend_matrices(num_verts, vert_ids, group_ids, weights, group_matrices, deform_groups=None):
+    vert_ids = np.asarray(vert_ids, dtype=np.int64)
+    group_ids = np.asarray(group_ids, dtype=np.int64)
+    weights = np.asarray(weights, dtype=np.float64)
+
+    # Ignore groups without deforming bone and non positive weights
+    mask = weights > 0.0
+    if deform_groups is not None:
+        mask &= np.asarray(deform_groups, dtype=bool)[group_ids]
+    vert_ids = vert_ids[mask]
+    group_ids = group_ids[mask]
+    weights = weights[mask]
+
+    flat = np.asarray(group_matrices, dtype=np.float64)[:, :3, :].reshape(-1, 12)
+    contrib = weights[:, None] * flat[group_ids]
+
+    blended = np.empty((num_verts, 12))
+    for i in range(12):
+        blended[:, i] = np.bincount(vert_ids, contrib[:, i], minlength=num_verts)
+    totals = np.bincount(vert_ids, weights, minlength=num_verts)
+
+    deformed = totals > MIN_TOTAL_WEIGHT
+    blended[deformed] /= totals[deformed, None]
+    blended[~deformed] = np.identity(4)[:3].ravel()
+
+    return blended.reshape(-1, 3, 4)
+
+# Transform (..., n, 3) coordinates with (n, 3, 4) per vertex matrices
+def apply_blended(coords, blended):
+    coords = np.asarray(coords, dtype=np.float64)
+    return np.einsum('nij,...nj->...ni', blended[:, :, :3], coords) + blended[:, :, 3]
+
+# Linear blend skinning of (..., n, 3) coordinates, leading axes can be used
+# to deform base mesh and all shape keys with one matrix multiply
+def linear_blend_skinning(coords, vert_ids, group_ids, weights, group_matrices, deform_groups=None):
+    num_verts = np.shape(coords)[-2]
+    blended = blend_matrices(num_verts, vert_ids, group_ids, weights, group_matrices, deform_groups)
+    return apply_blended(coords, blended)
+
+# Skin (..., n, 3) coordinates by several armatures one after another,
+# armatures is a list of (group_matrices, deform_groups).
+# It only use NumPy, so it's safe to run on other thread
+def skin_coords(coords, vert_ids, group_ids, weights, armatures):
+    for group_matrices, deform_groups in armatures:
+        coords = linear_blend_skinning(coords, vert_ids, group_ids, weights, group_matrices, deform_groups)
+    return coords
+
+class BoneNameMap:
+    # Bidirectional mapping between metarig bone names and deform bone names,
+    # every lookup is a dictionary lookup.
+    # forward is metarig name to deform name, exceptions are bones that are not
+    # mapped but also not extra bones, split_bones are bones that rigify split into
+    # .01/.02 deform bones but have single ORG bone.
+    def __init__(self, forward, exceptions=(), deform_prefix='DEF-', org_prefix='ORG-', split_bones=()):
+        self.forward = dict(forward)
+        self.exceptions = frozenset(exceptions)
+        self.deform_prefix = deform_prefix
+        self.org_prefix = org_prefix
+        self.split_bones = tuple(split_bones)
+
+        # First metarig name wins if several map to the same deform name
+        self.reverse = {}
+        for metarig_name, deform_name in self.forward.items():
+            self.reverse.setdefault(deform_name, metarig_name)
+
+        self.org_names = {name : self.make_org_name(name) for name in self.forward}
+
+    # Raise ValueError if data doesn't have the layout of a bone map file
+    @staticmethod
+    def validate_dict(data):
+        def is_names(values):
+            return isinstance(values, (list, tuple)) and all(isinstance(v, str) for v in values)
+
+        if not isinstance(data, dict):
+            raise ValueError('Bone map should be a dictionary, not ' + type(data).__name__)
+        def_names = data.get('def_names', {})
+        if not isinstance(def_names, dict) or not is_names(list(def_names.keys()) + list(def_names.values())):
+            raise ValueError('def_names should be a dictionary of bone names')
+        for key in ('extra_exception', 'split_bones'):
+            if not is_names(data.get(key, ())):
+                raise ValueError(key + ' should be a list of bone names')
+        for key in ('deform_prefix', 'org_prefix'):
+            if not isinstance(data.get(key, ''), str):
+                raise ValueError(key + ' should be a string')
+
+    @classmethod
+    def from_dict(cls, data):
+        cls.validate_dict(data)
+        return cls(data.get('def_names', {}), data.get('extra_exception', ()),
+                data.get('deform_prefix', 'DEF-'), data.get('org_prefix', 'ORG-'),
+                data.get('split_bones', ()))
+
+    @classmethod
+    def from_json(cls, filepath):
+        import json
+        with open(filepath) as f:
+            return cls.from_dict(json.load(f))
+
+    def make_org_name(self, metarig_name):
+        name = self.forward[metarig_name].replace(self.deform_prefix, self.org_prefix, 1)
+        if [b for b in self.split_bones if b in name]:
+            name = name.replace('.01.', '.', 1)
+            name = name.replace('.02.', '.', 1)
+        return name
+
+    def to_deform(self, name, default=None):
+        return self.forward.get(name, default)
+
+    def to_metarig(self, name, default=None):
+        return self.reverse.get(name, default)
+
+    # ORG bone name on generated rig for metarig bone name, empty if not mapped
+    def to_org(self, name):
+        return self.org_names.get(name, '')
+
+    # Extra bones are metarig bones that are neither mapped nor exceptions
+    def is_extra(self, name):
+        return name not in self.forward and name not in self.exceptions
+
+    # Rename all items with name attribute (like vertex groups) in one pass,
+    # only items that need new name are touched. Return number of renamed items.
+    def rename(self, items, to_metarig):
+        table = self.reverse if to_metarig else self.forward
+        num_renamed = 0
+        for item in items:
+            new_name = table.get(item.name)
+            if new_name and new_name != item.name:
+                item.name = new_name
+                num_renamed += 1
+        return num_renamed
+
+# Pose channels that can be read and written with foreach_get/foreach_set, with rest values
+POSE_CHANNELS = (
+        ('location', (0.0, 0.0, 0.0)),
+        ('rotation_quaternion', (1.0, 0.0, 0.0, 0.0)),
+        ('rotation_euler', (0.0, 0.0, 0.0)),
+        ('rotation_axis_angle', (0.0, 0.0, 1.0, 0.0)),
+        ('scale', (1.0, 1.0, 1.0)),
+        )
+
+def rotation_channel(rotation_mode):
+    if rotation_mode == 'QUATERNION':
+        return 'rotation_quaternion'
+    if rotation_mode == 'AXIS_ANGLE':
+        return 'rotation_axis_angle'
+    return 'rotation_euler'
+
+# Rest values of pose channels, only rotation channel used by each bone is reset
+# so unused rotation channels are kept, same as setting matrix_basis to identity
+def rest_pose_channels(channels, rotation_modes):
+    channels_used = np.array([rotation_channel(m) for m in rotation_modes])
+    rest = {}
+    for attr, value in POSE_CHANNELS:
+        values = np.array(channels[attr], copy=True)
+        if attr.startswith('rotation_'):
+            values[channels_used == attr] = value
+        else: values[:] = value
+        rest[attr] = values
+    return rest
+
+# Bones which pose is different from rest pose, within tolerance
+def pose_transformed_mask(channels, rotation_modes, tolerance=1e-6):
+    mask = np.any(np.abs(channels['location']) > tolerance, axis=1)
+    mask |= np.any(np.abs(channels['scale'] - 1.0) > tolerance, axis=1)
+
+    # Quaternion is identity if its vector part is zero, whatever the sign
+    quat = np.any(np.abs(channels['rotation_quaternion'][:, 1:]) > tolerance, axis=1)
+    euler = np.any(np.abs(channels['rotation_euler']) > tolerance, axis=1)
+    axis_angle = np.abs(channels['rotation_axis_angle'][:, 0]) > tolerance
+
+    channels_used = np.array([rotation_channel(m) for m in rotation_modes])
+    mask |= np.where(channels_used == 'rotation_quaternion', quat,
+            np.where(channels_used == 'rotation_axis_angle', axis_angle, euler))
+
+    return mask
+
+# Elementwise math.isclose over (..., 4, 4) matrices, true where all elements are close
+def matrices_close(matrices_a, matrices_b, rel_tol=1e-09, abs_tol=0.0):
+    a = np.asarray(matrices_a, dtype=np.float64)
+    b = np.asarray(matrices_b, dtype=np.float64)
+    close = np.abs(a - b) <= np.maximum(rel_tol * np.maximum(np.abs(a), np.abs(b)), abs_tol)
+    return close.all(axis=(-2, -1))
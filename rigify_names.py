@@ -0,0 +1,117 @@
+# Rigify metarig to deform bone names, only imported when the rigify bone map is first built
+
+extra_exception = [
+    'DEF-upper_arm.02.L',
+    'DEF-upper_arm.02.R',
+    
+    'DEF-forearm.02.L',
+    'DEF-forearm.02.R',
+    
+    'DEF-thumb.01.L.02',
+    'DEF-thumb.01.R.02',
+    
+    'DEF-f_index.01.L.02',
+    'DEF-f_index.01.R.02',
+    
+    'DEF-f_middle.01.L.02',
+    'DEF-f_middle.01.R.02',
+    
+    'DEF-f_ring.01.L.02',
+    'DEF-f_ring.01.R.02',
+    
+    'DEF-f_pinky.01.L.02',
+    'DEF-f_pinky.01.R.02',
+    
+    'DEF-thigh.02.L',
+    'DEF-thigh.02.R',
+    
+    'DEF-shin.02.L',
+    'DEF-shin.02.R',
+
+    'heel.L',
+    'heel.R',
+
+    'heel.02.L',
+    'heel.02.R'
+]
+
+def_names = { 'hips' : 'DEF-hips',
+         'spine' : 'DEF-spine',
+         'chest' : 'DEF-chest',
+         'neck' : 'DEF-neck',
+         'head' : 'DEF-head',
+         
+         'shoulder.L' : 'DEF-shoulder.L',
+         'shoulder.R' : 'DEF-shoulder.R',
+         
+         'upper_arm.L' : 'DEF-upper_arm.01.L',
+         'upper_arm.R' : 'DEF-upper_arm.01.R',
+         
+         'forearm.L' : 'DEF-forearm.01.L',
+         'forearm.R' : 'DEF-forearm.01.R',
+         
+         'hand.L' : 'DEF-hand.L',
+         'hand.R' : 'DEF-hand.R',
+         
+         'palm.01.L' : 'DEF-palm.01.L',
+         'palm.02.L' : 'DEF-palm.02.L',
+         'palm.03.L' : 'DEF-palm.03.L',
+         'palm.04.L' : 'DEF-palm.04.L',
+         
+         'palm.01.R' : 'DEF-palm.01.R',
+         'palm.02.R' : 'DEF-palm.02.R',
+         'palm.03.R' : 'DEF-palm.03.R',
+         'palm.04.R' : 'DEF-palm.04.R',
+         
+         'thumb.01.L' : 'DEF-thumb.01.L.01',
+         'thumb.02.L' : 'DEF-thumb.02.L',
+         'thumb.03.L' : 'DEF-thumb.03.L',
+         
+         'thumb.01.R' : 'DEF-thumb.01.R.01',
+         'thumb.02.R' : 'DEF-thumb.02.R',
+         'thumb.03.R' : 'DEF-thumb.03.R',
+         
+         'f_index.01.L' : 'DEF-f_index.01.L.01',
+         'f_index.02.L' : 'DEF-f_index.02.L',
+         'f_index.03.L' : 'DEF-f_index.03.L',
+         
+         'f_index.01.R' : 'DEF-f_index.01.R.01',
+         'f_index.02.R' : 'DEF-f_index.02.R',
+         'f_index.03.R' : 'DEF-f_index.03.R',
+         
+         'f_middle.01.L' : 'DEF-f_middle.01.L.01',
+         'f_middle.02.L' : 'DEF-f_middle.02.L',
+         'f_middle.03.L' : 'DEF-f_middle.03.L',
+         
+         'f_middle.01.R' : 'DEF-f_middle.01.R.01',
+         'f_middle.02.R' : 'DEF-f_middle.02.R',
+         'f_middle.03.R' : 'DEF-f_middle.03.R',
+         
+         'f_ring.01.L' : 'DEF-f_ring.01.L.01',
+         'f_ring.02.L' : 'DEF-f_ring.02.L',
+         'f_ring.03.L' : 'DEF-f_ring.03.L',
+         
+         'f_ring.01.R' : 'DEF-f_ring.01.R.01',
+         'f_ring.02.R' : 'DEF-f_ring.02.R',
+         'f_ring.03.R' : 'DEF-f_ring.03.R',
+         
+         'f_pinky.01.L' : 'DEF-f_pinky.01.L.01',
+         'f_pinky.02.L' : 'DEF-f_pinky.02.L',
+         'f_pinky.03.L' : 'DEF-f_pinky.03.L',
+         
+         'f_pinky.01.R' : 'DEF-f_pinky.01.R.01',
+         'f_pinky.02.R' : 'DEF-f_pinky.02.R',
+         'f_pinky.03.R' : 'DEF-f_pinky.03.R',
+         
+         'thigh.L' : 'DEF-thigh.01.L',
+         'thigh.R' : 'DEF-thigh.01.R',
+         
+         'shin.L' : 'DEF-shin.01.L',
+         'shin.R' : 'DEF-shin.01.R',
+         
+         'foot.L' : 'DEF-foot.L',
+         'foot.R' : 'DEF-foot.R',
+         
+         'toe.L' : 'DEF-toe.L',
+         'toe.R' : 'DEF-toe.R'
+       }
@@ -0,0 +1,250 @@
+# Snapshot and diff based revert of scene selection, modes, layers, hides and armature poses.
+# Works on anything with the bpy collection interface, so it can run without Blender.
+import time
+import numpy as np
+
+try:
+    from . import rig_utils
+    from .profiling import profiler
+except ImportError:
+    import rig_utils
+    from profiling import profiler
+
+def get_bool_flags(collection, attr, size=1):
+    flags = np.zeros(len(collection) * size, dtype=bool)
+    collection.foreach_get(attr, flags)
+    return flags.reshape(-1, size) if size > 1 else flags
+
+# Read bool attribute of objects, objects can be a collection or a list
+def get_object_flags(objs, attr, size=1):
+    if hasattr(objs, 'foreach_get'):
+        return get_bool_flags(objs, attr, size)
+    if size > 1:
+        return np.array([tuple(getattr(o, attr)) for o in objs], dtype=bool).reshape(-1, size)
+    return np.array([getattr(o, attr) for o in objs], dtype=bool)
+
+# Default mode switch of scene state, bpy is only imported when it's called inside Blender
+def object_mode_set(mode):
+    import bpy
+    bpy.ops.object.mode_set(mode=mode)
+
+class PoseBuffer:
+    # Location, rotation and scale of all pose bones as flat arrays
+    def __init__(self, pose_bones):
+        self.names = [pb.name for pb in pose_bones]
+        self.rotation_modes = [pb.rotation_mode for pb in pose_bones]
+        self.channels = {}
+        for attr, value in rig_utils.POSE_CHANNELS:
+            values = np.empty(len(pose_bones) * len(value), dtype=np.float32)
+            pose_bones.foreach_get(attr, values)
+            self.channels[attr] = values.reshape(-1, len(value))
+
+    def same_bones(self, pose_bones):
+        return len(pose_bones) == len(self.names) and [pb.name for pb in pose_bones] == self.names
+
+    def write(self, pose_bones, channels):
+        for attr, values in channels.items():
+            current = np.empty(values.size, dtype=np.float32)
+            pose_bones.foreach_get(attr, current)
+            if not np.array_equal(current, values.ravel()):
+                pose_bones.foreach_set(attr, np.ascontiguousarray(values, dtype=np.float32).ravel())
+
+    # Restore captured pose, only given bone names if names is not None
+    def restore(self, pose_bones, names=None):
+        if names is None and self.same_bones(pose_bones):
+            self.write(pose_bones, self.channels)
+            return
+
+        ids = {name : i for i, name in enumerate(self.names)}
+        for name in (self.names if names is None else names):
+            pb = pose_bones.get(name)
+            i = ids.get(name)
+            if not pb or i is None: continue
+            for attr, values in self.channels.items():
+                setattr(pb, attr, values[i].tolist())
+
+    # Set captured bones to rest pose, like setting matrix_basis to identity
+    def reset(self, pose_bones, names=None):
+        rest = rig_utils.rest_pose_channels(self.channels, self.rotation_modes)
+        if names is None and self.same_bones(pose_bones):
+            self.write(pose_bones, rest)
+            return
+
+        ids = {name : i for i, name in enumerate(self.names)}
+        for name in (self.names if names is None else names):
+            pb = pose_bones.get(name)
+            i = ids.get(name)
+            if not pb or i is None: continue
+            for attr, values in rest.items():
+                setattr(pb, attr, values[i].tolist())
+
+    def transformed(self, tolerance=1e-6):
+        return rig_utils.pose_transformed_mask(self.channels, self.rotation_modes, tolerance)
+
+    def transformed_names(self, tolerance=1e-6):
+        return [self.names[i] for i in np.nonzero(self.transformed(tolerance))[0]]
+
+class ArmatureState:
+    # Bone hide flags, pose matrices and armature layers of an armature object
+    def __init__(self, obj):
+        self.bone_names = [b.name for b in obj.data.bones]
+        self.hides = get_bool_flags(obj.data.bones, 'hide')
+        self.hide_selects = get_bool_flags(obj.data.bones, 'hide_select')
+        self.pose = PoseBuffer(obj.pose.bones)
+        self.layers = tuple(obj.data.layers)
+
+class SceneState:
+    # Compact snapshot of selection, modes, layers, hides and armature poses of a scene.
+    # Revert only writes values that are different from current state.
+    # Armature objects with name on skip_armatures are not remembered.
+    # If objects is not None, only those objects are remembered and reverted.
+    # mode_set switches mode of active object, it's only called by revert.
+    def __init__(self, scene, skip_armatures=(), objects=None, mode_set=object_mode_set):
+        self.scene = scene
+        self.mode_set = mode_set
+        self.partial = objects is not None
+        self.timings = {}
+        self.writes = {}
+
+        start_time = time.time()
+        objs = scene.objects if objects is None else list(objects)
+        self.object_names = [o.name for o in objs]
+        self.selects = get_object_flags(objs, 'select')
+        self.active = scene.objects.active.name if scene.objects.active else ''
+        self.timed('selection', start_time)
+
+        start_time = time.time()
+        # Only remember non object modes, most objects are on object mode
+        self.modes = {o.name : o.mode for o in objs if o.mode != 'OBJECT'}
+        self.hides = get_object_flags(objs, 'hide')
+        self.timed('objects', start_time)
+
+        start_time = time.time()
+        self.scene_layers = tuple(scene.layers)
+        self.object_layers = get_object_flags(objs, 'layers', 20)
+        self.timed('layers', start_time)
+
+        start_time = time.time()
+        self.armatures = {}
+        for o in objs:
+            if o.type == 'ARMATURE' and o.name not in skip_armatures:
+                self.armatures[o.name] = ArmatureState(o)
+        self.timed('bones', start_time)
+
+    def timed(self, category, start_time):
+        self.timings[category] = self.timings.get(category, 0.0) + time.time() - start_time
+
+    def count_write(self, category, num=1):
+        self.writes[category] = self.writes.get(category, 0) + num
+        profiler.count('revert writes ' + category, num)
+
+    def in_active_layers(self, obj):
+        return any(l and self.scene.layers[i] for i, l in enumerate(obj.layers))
+
+    # Return remembered indices and current objects that still exist
+    def match_objects(self):
+        objs = self.scene.objects
+        if not self.partial and [o.name for o in objs] == self.object_names:
+            return list(range(len(objs))), list(objs)
+
+        ids = []
+        matched = []
+        for i, name in enumerate(self.object_names):
+            o = objs.get(name)
+            if o:
+                ids.append(i)
+                matched.append(o)
+        return ids, matched
+
+    def revert(self):
+        scene = self.scene
+        ids, objs = self.match_objects()
+
+        # Revert selection
+        start_time = time.time()
+        self.mode_set('OBJECT')
+        for i, o in zip(ids, objs):
+            if o.select != self.selects[i]:
+                o.select = bool(self.selects[i])
+                self.count_write('selection')
+
+        # Objects added after remembering are deselected
+        if not self.partial and len(objs) != len(scene.objects):
+            names = set(self.object_names)
+            for o in scene.objects:
+                if o.name not in names and o.select:
+                    o.select = False
+                    self.count_write('selection')
+        self.timed('selection', start_time)
+
+        # Revert scene and object layers first, mode can only be set on visible objects
+        start_time = time.time()
+        if tuple(scene.layers) != self.scene_layers:
+            scene.layers = self.scene_layers
+            self.count_write('layers')
+        for i, o in zip(ids, objs):
+            layers = tuple(self.object_layers[i].tolist())
+            if tuple(o.layers) != layers:
+                o.layers = layers
+                self.count_write('layers')
+        self.timed('layers', start_time)
+
+        # Revert mode
+        start_time = time.time()
+        for o in objs:
+            mode = self.modes.get(o.name, 'OBJECT')
+            if o.mode != mode and self.in_active_layers(o):
+                scene.objects.active = o
+                self.mode_set(mode)
+                self.count_write('objects')
+
+        # Revert active
+        active = scene.objects.get(self.active)
+        if active and scene.objects.active != active:
+            scene.objects.active = active
+        self.timed('objects', start_time)
+
+        # Revert rig layers, bone hides and pose
+        start_time = time.time()
+        for name, state in self.armatures.items():
+            o = scene.objects.get(name)
+            if not o or o.type != 'ARMATURE': continue
+
+            if tuple(o.data.layers) != state.layers:
+                o.data.layers = state.layers
+                self.count_write('layers')
+
+            self.revert_bones(o, state)
+        self.timed('bones', start_time)
+
+        # Revert object hide, only hide back objects that were hidden
+        start_time = time.time()
+        for i, o in zip(ids, objs):
+            if self.hides[i] and not o.hide:
+                o.hide = True
+                self.count_write('objects')
+        self.timed('objects', start_time)
+
+    def revert_bones(self, obj, state):
+        bones = obj.data.bones
+        pose_bones = obj.pose.bones
+
+        # Fast path, same bones as remembered so arrays can be compared directly
+        if [b.name for b in bones] == state.bone_names:
+            for attr, stored in (('hide', state.hides), ('hide_select', state.hide_selects)):
+                if (get_bool_flags(bones, attr) != stored).any():
+                    bones.foreach_set(attr, stored)
+                    self.count_write('bones')
+        else:
+            for i, bone_name in enumerate(state.bone_names):
+                bone = bones.get(bone_name)
+                if not bone: continue
+                if bone.hide != state.hides[i]:
+                    bone.hide = bool(state.hides[i])
+                    self.count_write('bones')
+                if bone.hide_select != state.hide_selects[i]:
+                    bone.hide_select = bool(state.hide_selects[i])
+                    self.count_write('bones')
+
+        state.pose.restore(pose_bones)
+        self.count_write('pose')
@@ -0,0 +1,1163 @@
+# Stand-in for the parts of bpy, bmesh and mathutils used by the add-on, so its operators can run
+# on pytest without Blender. install() puts the fake modules on sys.modules, import_addon() imports
+# the add-on folder as a package and new_context() gives every test an empty scene.
+#
+# Mesh, shape key, vertex group, armature and object data are plain Python objects and
+# collections implement foreach_get/foreach_set on flat arrays like Blender.
+# bmesh is a small pure Python version with only the ops used by mirror tools.
+# Object.to_mesh mixes shape keys like Blender, show_only_shape_key included, and deforms by
+# armature modifiers with linear blend skinning. Pose bone matrix is set by the test,
+# it's not computed from pose bone channels.
+#
+# Only operators on OPERATORS are implemented, calling any other bpy.ops operator raises
+# NotImplementedError. Apply Metarig Transform itself drives Blender tools this stand-in doesn't
+# have (rigify generate, pose copy/paste, modifier apply, join shapes), so only its bake functions
+# are tested here, the whole operator runs on the Blender tier of benchmark.py.
+import os, sys, types, importlib.util
+import numpy as np
+
+# Add-on is imported under this name, like the folder name of installed add-on
+ADDON_NAME = 'basemesh_tools'
+
+NUM_LAYERS = 20
+NUM_BONE_LAYERS = 32
+
+def layers(*ids, size=NUM_LAYERS):
+    return [i in ids for i in range(size)]
+
+# Layers of objects, scenes and armatures are edited by item, tuple assignment is kept as list
+def layers_property(name):
+    def getter(self):
+        return getattr(self, name)
+    def setter(self, value):
+        setattr(self, name, [bool(v) for v in value])
+    return property(getter, setter)
+
+### mathutils
+
+class Matrix:
+    def __init__(self, rows=None):
+        self.values = np.identity(4) if rows is None else np.array(rows, dtype=np.float64)
+
+    def __array__(self, dtype=None, copy=None):
+        return self.values.astype(dtype or np.float64, copy=True)
+
+    def __len__(self):
+        return len(self.values)
+
+    def __getitem__(self, i):
+        return self.values[i]
+
+    # Matrix product, vectors are transformed as points
+    def __mul__(self, other):
+        if isinstance(other, Matrix):
+            return Matrix(self.values.dot(other.values))
+        co = np.append(np.asarray(other, dtype=np.float64)[:3], 1.0)
+        return tuple(self.values.dot(co)[:3].tolist())
+
+    def inverted(self):
+        return Matrix(np.linalg.inv(self.values))
+
+    def copy(self):
+        return Matrix(self.values)
+
+    @classmethod
+    def Translation(cls, vector):
+        matrix = cls()
+        matrix.values[:3, 3] = vector
+        return matrix
+
+### bpy collections and ID data
+
+class Collection(list):
+    active = None
+
+    def get(self, name, default=None):
+        for item in self:
+            if item.name == name:
+                return item
+        return default
+
+    def foreach_get(self, attr, array):
+        if len(self):
+            array[:] = np.ravel([getattr(item, attr) for item in self])
+
+    def foreach_set(self, attr, array):
+        if not len(self): return
+        values = np.reshape(array, (len(self), -1)).tolist()
+        for item, value in zip(self, values):
+            setattr(item, attr, value[0] if len(value) == 1 else tuple(value))
+
+class ID:
+    is_updated = False
+    is_updated_data = False
+
+    def __init__(self, name):
+        self.name = name
+        self.id_props = {}
+
+    def __getitem__(self, key):
+        return self.id_props[key]
+
+    def __setitem__(self, key, value):
+        self.id_props[key] = value
+
+    def __contains__(self, key):
+        return key in self.id_props
+
+    def get(self, key, default=None):
+        return self.id_props.get(key, default)
+
+    def keys(self):
+        return self.id_props.keys()
+
+    def as_pointer(self):
+        return id(self)
+
+class DataCollection(Collection):
+    is_updated = False
+
+    def remove(self, item, do_unlink=False):
+        list.remove(self, item)
+
+class BlendData:
+    def __init__(self):
+        self.objects = DataCollection()
+        self.meshes = DataCollection()
+        self.armatures = DataCollection()
+        self.texts = DataCollection()
+
+### Mesh
+
+class MeshVertex:
+    def __init__(self, index, co):
+        self.index = index
+        self.co = tuple(co)
+        self.select = False
+        self.hide = False
+        self.groups = Collection()
+
+class VertexGroupElement:
+    def __init__(self, group, weight):
+        self.group = group
+        self.weight = weight
+
+class MeshEdge:
+    def __init__(self, index, vertices):
+        self.index = index
+        self.vertices = tuple(vertices)
+        self.select = False
+        self.hide = False
+
+class MeshPolygon:
+    def __init__(self, index, loop_start, loop_total):
+        self.index = index
+        self.loop_start = loop_start
+        self.loop_total = loop_total
+        self.select = False
+        self.hide = False
+
+class MeshLoop:
+    def __init__(self, index, vertex_index, edge_index):
+        self.index = index
+        self.vertex_index = vertex_index
+        self.edge_index = edge_index
+        self.normal = (0.0, 0.0, 0.0)
+
+class MeshValue:
+    def __init__(self, **values):
+        self.__dict__.update(values)
+
+class DataLayer:
+    def __init__(self, name, data):
+        self.name = name
+        self.data = data
+
+# Mesh data layers, new layer has an item for every element
+class LayerCollection(Collection):
+    def __init__(self, new_item, get_size):
+        super().__init__()
+        self.new_item = new_item
+        self.get_size = get_size
+
+    def new(self, name=''):
+        layer = DataLayer(name, Collection(self.new_item() for i in range(self.get_size())))
+        self.append(layer)
+        if self.active is None: self.active = layer
+        return layer
+
+    def remove(self, layer):
+        list.remove(self, layer)
+        if self.active is layer: self.active = self[0] if len(self) else None
+
+class Mesh(ID):
+    def __init__(self, name, coords=(), faces=(), edges=()):
+        super().__init__(name)
+        self.shape_keys = None
+        self.has_custom_normals = False
+        self.edit_bmesh = None
+        self.vertex_layers_int = LayerCollection(lambda: MeshValue(value=0), lambda: len(self.vertices))
+        self.uv_layers = LayerCollection(lambda: MeshValue(uv=(0.0, 0.0)), lambda: len(self.loops))
+        self.vertex_colors = LayerCollection(lambda: MeshValue(color=(1.0, 1.0, 1.0)), lambda: len(self.loops))
+        self.from_pydata(coords, edges, faces)
+
+    # Replace geometry, edges of faces are added after the given edges. Layers are not resized
+    def from_pydata(self, coords, edges, faces):
+        self.vertices = Collection(MeshVertex(i, co) for i, co in enumerate(coords))
+        self.edges = Collection()
+        self.polygons = Collection()
+        self.polygons.active = 0
+        self.loops = Collection()
+
+        edge_ids = {}
+        def edge_index(a, b):
+            key = (min(a, b), max(a, b))
+            if key not in edge_ids:
+                edge_ids[key] = len(self.edges)
+                self.edges.append(MeshEdge(len(self.edges), (a, b)))
+            return edge_ids[key]
+
+        for a, b in edges:
+            edge_index(a, b)
+        for face in faces:
+            self.polygons.append(MeshPolygon(len(self.polygons), len(self.loops), len(face)))
+            for i, v in enumerate(face):
+                self.loops.append(MeshLoop(len(self.loops), v, edge_index(v, face[(i + 1) % len(face)])))
+
+    def face_vertices(self):
+        return [[l.vertex_index for l in self.loops[p.loop_start:p.loop_start + p.loop_total]] for p in self.polygons]
+
+    def update(self, calc_edges=False):
+        pass
+
+    def calc_normals_split(self):
+        pass
+
+class ShapeKeyPoint:
+    def __init__(self, co):
+        self.co = tuple(co)
+
+class ShapeKey:
+    def __init__(self, name, coords, relative_key=None):
+        self.name = name
+        self.data = Collection(ShapeKeyPoint(co) for co in coords)
+        self.value = 0.0
+        self.mute = False
+        self.vertex_group = ''
+        self.relative_key = relative_key or self
+        self.slider_min = 0.0
+        self.slider_max = 1.0
+        self.interpolation = 'KEY_LINEAR'
+
+class Key(ID):
+    def __init__(self, user):
+        super().__init__('Key')
+        self.user = user
+        self.use_relative = True
+        self.key_blocks = Collection()
+
+def point_coords(collection):
+    return np.array([item.co for item in collection], dtype=np.float64).reshape(-1, 3)
+
+### Armature
+
+class Bone:
+    def __init__(self, name, matrix_local=None, parent=None):
+        self.name = name
+        self.parent = parent
+        self.matrix_local = matrix_local or Matrix()
+        self.select = False
+        self.hide = False
+        self.hide_select = False
+        self.use_deform = True
+        self.bbone_segments = 1
+        self.use_inherit_rotation = True
+        self.use_inherit_scale = True
+        self.use_local_location = True
+        self.layers = layers(0, size=NUM_BONE_LAYERS)
+
+class Armature(ID):
+    layers = layers_property('layer_flags')
+
+    def __init__(self, name, bones=()):
+        super().__init__(name)
+        self.bones = Collection(bones)
+        self.layers = layers(0, size=NUM_BONE_LAYERS)
+        self.pose_position = 'POSE'
+
+class PoseBone(ID):
+    def __init__(self, bone):
+        super().__init__(bone.name)
+        self.bone = bone
+        self.rotation_mode = 'QUATERNION'
+        self.location = (0.0, 0.0, 0.0)
+        self.rotation_quaternion = (1.0, 0.0, 0.0, 0.0)
+        self.rotation_euler = (0.0, 0.0, 0.0)
+        self.rotation_axis_angle = (0.0, 0.0, 1.0, 0.0)
+        self.scale = (1.0, 1.0, 1.0)
+        self.matrix = bone.matrix_local.copy()
+
+class Pose:
+    def __init__(self, bones):
+        self.bones = Collection(PoseBone(b) for b in bones)
+
+### Object
+
+class VertexGroup:
+    def __init__(self, obj, name, index):
+        self.id_data = obj
+        self.name = name
+        self.index = index
+
+    def add(self, index, weight, type):
+        for i in index:
+            groups = self.id_data.data.vertices[i].groups
+            element = next((g for g in groups if g.group == self.index), None)
+            if element is None:
+                groups.append(VertexGroupElement(self.index, weight))
+            elif type == 'ADD':
+                element.weight += weight
+            else: element.weight = weight
+
+    def weight(self, index):
+        for g in self.id_data.data.vertices[index].groups:
+            if g.group == self.index:
+                return g.weight
+        raise RuntimeError('Vertex not in group')
+
+class VertexGroupCollection(Collection):
+    def __init__(self, obj):
+        super().__init__()
+        self.obj = obj
+
+    def new(self, name='Group'):
+        vg = VertexGroup(self.obj, name, len(self))
+        self.append(vg)
+        return vg
+
+class Modifier:
+    def __init__(self, name, type):
+        self.name = name
+        self.type = type
+        self.show_viewport = True
+        self.object = None
+
+        # Armature
+        self.use_vertex_groups = True
+        self.use_bone_envelopes = False
+        self.use_deform_preserve_volume = False
+        self.use_multi_modifier = False
+        self.vertex_group = ''
+
+        # Mirror
+        self.use_x = True
+        self.use_y = False
+        self.use_z = False
+        self.use_mirror_vertex_groups = True
+        self.use_mirror_u = False
+        self.use_mirror_v = False
+        self.mirror_object = None
+
+    def copy(self):
+        mod = Modifier(self.name, self.type)
+        mod.__dict__.update(self.__dict__)
+        return mod
+
+class ModifierCollection(Collection):
+    def new(self, name, type):
+        mod = Modifier(name, type)
+        self.append(mod)
+        return mod
+
+    def remove(self, mod):
+        list.remove(self, mod)
+
+class Object(ID):
+    layers = layers_property('layer_flags')
+
+    def __init__(self, name, data=None):
+        super().__init__(name)
+        self.data = data
+        self.type = 'MESH' if isinstance(data, Mesh) else 'ARMATURE' if isinstance(data, Armature) else 'EMPTY'
+        self.pose = Pose(data.bones) if self.type == 'ARMATURE' else None
+        self.select = False
+        self.hide = False
+        self.mode = 'OBJECT'
+        self.layers = layers(0)
+        self.modifiers = ModifierCollection()
+        self.vertex_groups = VertexGroupCollection(self)
+        self.parent = None
+        self.parent_bone = ''
+        self.matrix_world = Matrix()
+        self.active_shape_key_index = 0
+        self.show_only_shape_key = False
+
+    @property
+    def active_shape_key(self):
+        if self.type != 'MESH' or not self.data.shape_keys:
+            return None
+        return self.data.shape_keys.key_blocks[self.active_shape_key_index]
+
+    @property
+    def location(self):
+        return tuple(self.matrix_world.values[:3, 3].tolist())
+
+    # Copy sharing the object data, like Object.copy it's added to bpy.data but not linked to scene
+    def copy(self):
+        obj = Object(self.name + '.001', self.data)
+        obj.layers = self.layers
+        obj.matrix_world = self.matrix_world.copy()
+        obj.parent = self.parent
+        obj.parent_bone = self.parent_bone
+        obj.active_shape_key_index = self.active_shape_key_index
+        obj.show_only_shape_key = self.show_only_shape_key
+        for mod in self.modifiers:
+            obj.modifiers.append(mod.copy())
+        for vg in self.vertex_groups:
+            obj.vertex_groups.new(vg.name)
+        get_bpy().data.objects.append(obj)
+        return obj
+
+    def shape_key_add(self, name='Key', from_mix=True):
+        mesh = self.data
+        if not mesh.shape_keys:
+            mesh.shape_keys = Key(mesh)
+            coords = point_coords(mesh.vertices)
+        elif from_mix:
+            coords = self.shape_key_coords()
+        else: coords = point_coords(mesh.shape_keys.key_blocks[0].data)
+
+        key_blocks = mesh.shape_keys.key_blocks
+        kb = ShapeKey(name, coords, key_blocks[0] if len(key_blocks) else None)
+        key_blocks.append(kb)
+        return kb
+
+    # Weight of every vertex on vertex group, full weight if there's no such group
+    def group_weights(self, name):
+        vg = self.vertex_groups.get(name) if name else None
+        if not vg:
+            return np.ones(len(self.data.vertices))
+        weights = np.zeros(len(self.data.vertices))
+        for v in self.data.vertices:
+            for g in v.groups:
+                if g.group == vg.index:
+                    weights[v.index] = g.weight
+        return weights
+
+    # Coordinates with shape keys mixed like Blender. With show_only_shape_key active key is
+    # used at full value, still masked by its vertex group, and muted key shows the basis
+    def shape_key_coords(self):
+        mesh = self.data
+        if not mesh.shape_keys:
+            return point_coords(mesh.vertices)
+
+        key_blocks = mesh.shape_keys.key_blocks
+        basis = point_coords(key_blocks[0].data)
+        if self.show_only_shape_key:
+            kb = key_blocks[self.active_shape_key_index]
+            if kb.mute:
+                return basis
+            return basis + (point_coords(kb.data) - basis) * self.group_weights(kb.vertex_group)[:, None]
+
+        coords = basis.copy()
+        for kb in key_blocks[1:]:
+            if kb.mute or not kb.value: continue
+            offsets = point_coords(kb.data) - point_coords(kb.relative_key.data)
+            coords += offsets * kb.value * self.group_weights(kb.vertex_group)[:, None]
+        return coords
+
+    def to_mesh(self, scene, apply_modifiers, settings):
+        coords = self.shape_key_coords()
+        if apply_modifiers:
+            for mod in self.modifiers:
+                if not mod.show_viewport: continue
+                if mod.type != 'ARMATURE':
+                    raise NotImplementedError(mod.type + ' modifier is not part of the Blender stand-in')
+                coords = armature_deform(self, mod, coords)
+
+        mesh = Mesh(self.data.name + '.evaluated', coords, self.data.face_vertices(),
+                [e.vertices for e in self.data.edges])
+        get_bpy().data.meshes.append(mesh)
+        return mesh
+
+# Deform coordinates by armature modifier with linear blend skinning on normalized weights of
+# deforming bones, like Blender armature modifier without envelopes and preserve volume
+def armature_deform(obj, mod, coords):
+    arm_obj = mod.object
+    if not arm_obj or arm_obj.data.pose_position == 'REST':
+        return coords
+
+    premat = (arm_obj.matrix_world.inverted() * obj.matrix_world).values
+    premat_inv = np.linalg.inv(premat)
+    matrices = {}
+    for vg in obj.vertex_groups:
+        pb = arm_obj.pose.bones.get(vg.name)
+        if pb and pb.bone.use_deform:
+            bone_matrix = pb.matrix.values.dot(np.linalg.inv(pb.bone.matrix_local.values))
+            matrices[vg.index] = premat_inv.dot(bone_matrix).dot(premat)
+
+    deformed = np.array(coords, dtype=np.float64)
+    for v in obj.data.vertices:
+        co = np.zeros(3)
+        total = 0.0
+        for g in v.groups:
+            matrix = matrices.get(g.group)
+            if matrix is None or g.weight <= 0.0: continue
+            co += g.weight * (matrix[:3, :3].dot(coords[v.index]) + matrix[:3, 3])
+            total += g.weight
+        if total > 0.0:
+            deformed[v.index] = co / total
+    return deformed
+
+### Scene and context
+
+class SceneObjects(Collection):
+    def link(self, obj):
+        self.append(obj)
+
+    def unlink(self, obj):
+        list.remove(self, obj)
+        if self.active is obj: self.active = None
+
+class Scene(ID):
+    layers = layers_property('layer_flags')
+
+    def __init__(self, name='Scene'):
+        super().__init__(name)
+        self.objects = SceneObjects()
+        self.layers = layers(0)
+
+    def update(self):
+        pass
+
+class SpaceView3D:
+    def __init__(self):
+        self.type = 'VIEW_3D'
+        self.pivot_point = 'MEDIAN_POINT'
+        self.cursor_location = [0.0, 0.0, 0.0]
+
+class Context:
+    def __init__(self, scene):
+        self.scene = scene
+        self.space_data = SpaceView3D()
+        self.area = self.space_data
+        self.tool_settings = types.SimpleNamespace(mesh_select_mode=[True, False, False])
+        self.user_preferences = types.SimpleNamespace(addons={'rigify' : types.SimpleNamespace(
+            preferences=types.SimpleNamespace(legacy_mode=False))})
+        self.window_manager = types.SimpleNamespace(keyconfigs=types.SimpleNamespace(addon=None))
+
+    @property
+    def object(self):
+        return self.scene.objects.active
+
+    @property
+    def active_object(self):
+        return self.scene.objects.active
+
+    @property
+    def selected_objects(self):
+        return [o for o in self.scene.objects if o.select]
+
+def in_visible_layers(scene, obj):
+    return any(l and scene.layers[i] for i, l in enumerate(obj.layers))
+
+### bpy.props and bpy.types
+
+class Property:
+    def __init__(self, default=None, **options):
+        self.default = default
+        self.options = options
+
+def BoolProperty(default=False, **options):
+    return Property(default, **options)
+
+def IntProperty(default=0, **options):
+    return Property(default, **options)
+
+def FloatProperty(default=0.0, **options):
+    return Property(default, **options)
+
+def StringProperty(default='', **options):
+    return Property(default, **options)
+
+def EnumProperty(items=(), default=None, **options):
+    return Property(default if default is not None else items[0][0], items=items, **options)
+
+def PointerProperty(type=None, **options):
+    return Property(None, type=type, **options)
+
+def CollectionProperty(type=None, **options):
+    return Property(None, type=type, **options)
+
+# Registered properties are plain attributes with their default value
+class PropertyHolder:
+    def __init__(self, **properties):
+        for cls in reversed(type(self).__mro__):
+            for name, value in vars(cls).items():
+                if isinstance(value, Property):
+                    setattr(self, name, value.default)
+        for name, value in properties.items():
+            setattr(self, name, value)
+
+class Operator(PropertyHolder):
+    def __init__(self, **properties):
+        super().__init__(**properties)
+        self.reports = []
+
+    def report(self, type, message):
+        self.reports.append((set(type), message))
+
+class Panel:
+    pass
+
+class PropertyGroup(PropertyHolder):
+    pass
+
+class ExportHelper:
+    filepath = ''
+
+def persistent(func):
+    return func
+
+### bmesh
+
+class BMLayerItem:
+    def __init__(self, name):
+        self.name = name
+
+class BMLayerCollection(list):
+    def __init__(self, elems, default):
+        super().__init__()
+        self.elems = elems
+        self.default = default
+        self.active = None
+
+    def new(self, name=''):
+        layer = BMLayerItem(name)
+        self.append(layer)
+        if self.active is None: self.active = layer
+        for elem in self.elems:
+            elem.data[layer] = self.default()
+        return layer
+
+    def remove(self, layer):
+        list.remove(self, layer)
+        if self.active is layer: self.active = self[0] if len(self) else None
+        for elem in self.elems:
+            elem.data.pop(layer, None)
+
+    def get(self, name, default=None):
+        return next((layer for layer in self if layer.name == name), default)
+
+class BMLayerAccess:
+    def __init__(self, elems):
+        self.int = BMLayerCollection(elems, lambda: 0)
+        self.deform = BMLayerCollection(elems, BMDeformVert)
+        self.shape = BMLayerCollection(elems, lambda: np.zeros(3))
+        self.uv = BMLayerCollection(elems, lambda: (0.0, 0.0))
+        self.color = BMLayerCollection(elems, lambda: (1.0, 1.0, 1.0))
+
+class BMElemSeq(list):
+    def __init__(self):
+        super().__init__()
+        self.layers = BMLayerAccess(self)
+        self.active = None
+
+    def ensure_lookup_table(self):
+        pass
+
+    def index_update(self):
+        for i, elem in enumerate(self):
+            elem.index = i
+
+# Loop data is stored on faces, loop layers only need the layer list
+class BMLoopSeq:
+    def __init__(self):
+        self.layers = BMLayerAccess(())
+
+class BMDeformVert(dict):
+    pass
+
+class BMEditSelSeq(list):
+    def add(self, elem):
+        if elem in self: self.remove(elem)
+        self.append(elem)
+
+def copy_layer_value(value):
+    if isinstance(value, dict):
+        return type(value)(value)
+    if isinstance(value, np.ndarray):
+        return value.copy()
+    return value
+
+class BMElem:
+    def __init__(self):
+        self.index = -1
+        self.select = False
+        self.hide = False
+        self.data = {}
+
+    def __getitem__(self, layer):
+        return self.data[layer]
+
+    def __setitem__(self, layer, value):
+        self.data[layer] = value
+
+    def copy_attributes(self, other):
+        self.select = other.select
+        self.hide = other.hide
+        self.data = {layer : copy_layer_value(value) for layer, value in other.data.items()}
+
+class BMVert(BMElem):
+    def __init__(self, co):
+        super().__init__()
+        self.co = np.array(co, dtype=np.float64)
+
+class BMEdge(BMElem):
+    def __init__(self, verts):
+        super().__init__()
+        self.verts = list(verts)
+
+    @property
+    def key(self):
+        return frozenset(self.verts)
+
+class BMFace(BMElem):
+    # Loop data of face is a dict of loop layer values for every face vertex
+    def __init__(self, verts, loops=None):
+        super().__init__()
+        self.verts = list(verts)
+        self.loops = loops if loops is not None else [{} for v in verts]
+
+    def edge_keys(self):
+        return [frozenset((v, self.verts[(i + 1) % len(self.verts)])) for i, v in enumerate(self.verts)]
+
+class BMesh:
+    def __init__(self):
+        self.verts = BMElemSeq()
+        self.edges = BMElemSeq()
+        self.faces = BMElemSeq()
+        self.loops = BMLoopSeq()
+        self.select_history = BMEditSelSeq()
+
+    def free(self):
+        pass
+
+    def add_edge(self, verts):
+        edge = BMEdge(verts)
+        self.edges.append(edge)
+        return edge
+
+    # Make sure every face edge exists, like bmesh always does
+    def ensure_face_edges(self):
+        keys = {e.key for e in self.edges}
+        for face in self.faces:
+            for key in face.edge_keys():
+                if key not in keys:
+                    keys.add(key)
+                    self.add_edge(key)
+
+    def from_mesh(self, mesh):
+        for mv in mesh.vertices:
+            v = BMVert(mv.co)
+            v.index = mv.index
+            v.select = mv.select
+            v.hide = mv.hide
+            self.verts.append(v)
+
+        for layer in mesh.vertex_layers_int:
+            bm_layer = self.verts.layers.int.new(layer.name)
+            for v, item in zip(self.verts, layer.data):
+                v[bm_layer] = item.value
+
+        if any(len(mv.groups) for mv in mesh.vertices):
+            deform = self.verts.layers.deform.new()
+            for v, mv in zip(self.verts, mesh.vertices):
+                v[deform] = BMDeformVert((g.group, g.weight) for g in mv.groups)
+
+        if mesh.shape_keys:
+            for kb in mesh.shape_keys.key_blocks:
+                shape = self.verts.layers.shape.new(kb.name)
+                for v, point in zip(self.verts, kb.data):
+                    v[shape] = np.array(point.co, dtype=np.float64)
+
+        for me in mesh.edges:
+            e = self.add_edge([self.verts[i] for i in me.vertices])
+            e.index = me.index
+            e.select = me.select
+            e.hide = me.hide
+
+        loop_layers = ([(self.loops.layers.uv.new(l.name), l, 'uv') for l in mesh.uv_layers] +
+                [(self.loops.layers.color.new(l.name), l, 'color') for l in mesh.vertex_colors])
+        for p in mesh.polygons:
+            loops = mesh.loops[p.loop_start:p.loop_start + p.loop_total]
+            f = BMFace([self.verts[l.vertex_index] for l in loops],
+                    [{layer : tuple(getattr(data_layer.data[l.index], attr)) for layer, data_layer, attr in loop_layers}
+                        for l in loops])
+            f.index = p.index
+            f.select = p.select
+            f.hide = p.hide
+            self.faces.append(f)
+        if 0 <= mesh.polygons.active < len(self.faces):
+            self.faces.active = self.faces[mesh.polygons.active]
+        self.ensure_face_edges()
+
+    def to_mesh(self, mesh):
+        self.ensure_face_edges()
+        for seq in (self.verts, self.edges, self.faces):
+            seq.index_update()
+
+        mesh.from_pydata([v.co for v in self.verts], [[v.index for v in e.verts] for e in self.edges],
+                [[v.index for v in f.verts] for f in self.faces])
+        for elems, seq in ((mesh.vertices, self.verts), (mesh.edges, self.edges), (mesh.polygons, self.faces)):
+            for item, elem in zip(elems, seq):
+                item.select = elem.select
+                item.hide = elem.hide
+        if self.faces.active in self.faces:
+            mesh.polygons.active = self.faces.active.index
+
+        deform = self.verts.layers.deform.active
+        if deform:
+            for mv, v in zip(mesh.vertices, self.verts):
+                mv.groups = Collection(VertexGroupElement(g, w) for g, w in v[deform].items())
+
+        mesh.vertex_layers_int.clear()
+        mesh.vertex_layers_int.active = None
+        for bm_layer in self.verts.layers.int:
+            layer = mesh.vertex_layers_int.new(bm_layer.name)
+            for item, v in zip(layer.data, self.verts):
+                item.value = v[bm_layer]
+
+        for mesh_layers, bm_layers, attr in ((mesh.uv_layers, self.loops.layers.uv, 'uv'),
+                (mesh.vertex_colors, self.loops.layers.color, 'color')):
+            mesh_layers.clear()
+            mesh_layers.active = None
+            for bm_layer in bm_layers:
+                layer = mesh_layers.new(bm_layer.name)
+                values = [f.loops[i].get(bm_layer, getattr(layer.data[0], attr)) for f in self.faces
+                        for i in range(len(f.verts))]
+                for item, value in zip(layer.data, values):
+                    setattr(item, attr, tuple(value))
+
+        if mesh.shape_keys:
+            for kb in mesh.shape_keys.key_blocks:
+                shape = self.verts.layers.shape.get(kb.name)
+                kb.data = Collection(ShapeKeyPoint(v[shape] if shape else v.co) for v in self.verts)
+
+def bmesh_new():
+    return BMesh()
+
+def from_edit_mesh(mesh):
+    if mesh.edit_bmesh is None:
+        raise ValueError('The mesh is not in editmode')
+    return mesh.edit_bmesh
+
+def faces_of(geom):
+    return [e for e in geom if isinstance(e, BMFace)]
+
+# Only DEL_FACES context: faces with their edges and verts that are not used by other faces
+def op_delete(bm, geom=(), context=1):
+    if context != 5:
+        raise NotImplementedError('Only DEL_FACES context of bmesh.ops.delete is part of the Blender stand-in')
+    faces = set(faces_of(geom))
+    removed_edges = {key for f in faces for key in f.edge_keys()}
+    removed_verts = {v for f in faces for v in f.verts}
+
+    bm.faces[:] = [f for f in bm.faces if f not in faces]
+    used_edges = {key for f in bm.faces for key in f.edge_keys()}
+    bm.edges[:] = [e for e in bm.edges if e.key not in removed_edges or e.key in used_edges]
+    used_verts = {v for e in bm.edges for v in e.verts}
+    bm.verts[:] = [v for v in bm.verts if v not in removed_verts or v in used_verts]
+    return {}
+
+def op_duplicate(bm, geom=()):
+    faces = faces_of(geom)
+    vert_map = {}
+    new_verts = []
+    for f in faces:
+        for v in f.verts:
+            if v in vert_map: continue
+            dup = BMVert(v.co)
+            dup.copy_attributes(v)
+            vert_map[v] = dup
+            new_verts.append(dup)
+
+    edges = {e.key : e for e in bm.edges}
+    edge_map = {}
+    for f in faces:
+        for key in f.edge_keys():
+            e = edges[key]
+            if e in edge_map: continue
+            dup = BMEdge([vert_map[v] for v in e.verts])
+            dup.copy_attributes(e)
+            edge_map[e] = dup
+
+    face_map = {}
+    for f in faces:
+        dup = BMFace([vert_map[v] for v in f.verts], [dict(l) for l in f.loops])
+        dup.copy_attributes(f)
+        face_map[f] = dup
+
+    bm.verts.extend(new_verts)
+    bm.edges.extend(edge_map.values())
+    bm.faces.extend(face_map.values())
+    return {'geom' : new_verts + list(edge_map.values()) + list(face_map.values()),
+            'vert_map' : vert_map, 'edge_map' : edge_map, 'face_map' : face_map}
+
+def op_transform(bm, matrix=None, verts=(), space=None):
+    matrix = np.array(matrix, dtype=np.float64)
+    for v in verts:
+        v.co = matrix[:3, :3].dot(v.co) + matrix[:3, 3]
+    return {}
+
+# Loop data stays with its vertex, only the winding is reversed
+def op_reverse_faces(bm, faces=(), flip_multires=False):
+    for f in faces:
+        f.verts.reverse()
+        f.loops.reverse()
+    return {}
+
+# Merge verts to their target, faces and edges that collapse or become doubles are removed
+def op_weld_verts(bm, targetmap=None):
+    targetmap = targetmap or {}
+    def target(v):
+        while v in targetmap:
+            v = targetmap[v]
+        return v
+
+    faces = []
+    face_keys = set()
+    for f in bm.faces:
+        corners = []
+        for v, loop in zip(f.verts, f.loops):
+            v = target(v)
+            if not corners or corners[-1][0] is not v:
+                corners.append((v, loop))
+        while len(corners) > 1 and corners[0][0] is corners[-1][0]:
+            corners.pop()
+        key = frozenset(v for v, loop in corners)
+        if len(corners) < 3 or key in face_keys: continue
+        face_keys.add(key)
+        f.verts = [v for v, loop in corners]
+        f.loops = [loop for v, loop in corners]
+        faces.append(f)
+    bm.faces[:] = faces
+
+    edges = []
+    edge_keys = set()
+    for e in bm.edges:
+        e.verts = [target(v) for v in e.verts]
+        if e.verts[0] is e.verts[1] or e.key in edge_keys: continue
+        edge_keys.add(e.key)
+        edges.append(e)
+    bm.edges[:] = edges
+
+    bm.verts[:] = [v for v in bm.verts if v not in targetmap]
+    bm.ensure_face_edges()
+    return {}
+
+# Like Blender, verts are sorted by sum of their coordinates and later verts are merged
+# to the first vert within distance
+def op_remove_doubles(bm, verts=(), dist=0.0001):
+    verts = sorted(verts, key=lambda v: float(v.co.sum()))
+    targetmap = {}
+    for i, a in enumerate(verts):
+        if a in targetmap: continue
+        for b in verts[i + 1:]:
+            if b.co.sum() - a.co.sum() > dist * 3: break
+            if b not in targetmap and np.linalg.norm(b.co - a.co) <= dist:
+                targetmap[b] = a
+    return op_weld_verts(bm, targetmap)
+
+### bpy.ops
+
+def get_bpy():
+    return sys.modules['bpy']
+
+def check_poll(condition, idname):
+    if not condition:
+        raise RuntimeError('Operator bpy.ops.' + idname + '.poll() failed, context is incorrect')
+
+# Leaving edit mode writes edit bmesh back to the mesh
+def object_mode_set(context, mode='OBJECT', toggle=False):
+    obj = context.object
+    check_poll(obj and not obj.hide, 'object.mode_set')
+    check_poll(mode in {'OBJECT', 'EDIT'} or (mode == 'POSE' and obj.type == 'ARMATURE'), 'object.mode_set')
+    if obj.mode == mode:
+        return {'FINISHED'}
+
+    if obj.type == 'MESH':
+        if obj.mode == 'EDIT':
+            obj.data.edit_bmesh.to_mesh(obj.data)
+            obj.data.edit_bmesh = None
+        if mode == 'EDIT':
+            obj.data.edit_bmesh = BMesh()
+            obj.data.edit_bmesh.from_mesh(obj.data)
+    obj.mode = mode
+    return {'FINISHED'}
+
+def object_select_all(context, action='TOGGLE'):
+    objs = [o for o in context.scene.objects if not o.hide and in_visible_layers(context.scene, o)]
+    if action == 'TOGGLE':
+        action = 'DESELECT' if any(o.select for o in objs) else 'SELECT'
+    for o in objs:
+        o.select = not o.select if action == 'INVERT' else action == 'SELECT'
+    return {'FINISHED'}
+
+# Parent selected objects to active object, or to its active bone
+def object_parent_set(context, type='OBJECT', keep_transform=False):
+    parent = context.object
+    check_poll(parent, 'object.parent_set')
+    bone_name = ''
+    if type == 'BONE':
+        bone = parent.data.bones.active if parent.type == 'ARMATURE' else None
+        if not bone:
+            raise RuntimeError('Error: No active bone')
+        bone_name = bone.name
+    for o in context.scene.objects:
+        if o.select and o is not parent:
+            o.parent = parent
+            o.parent_bone = bone_name
+    return {'FINISHED'}
+
+def object_shape_key_remove(context, all=False):
+    obj = context.object
+    check_poll(obj and obj.type == 'MESH' and obj.data.shape_keys, 'object.shape_key_remove')
+    key_blocks = obj.data.shape_keys.key_blocks
+    if all or len(key_blocks) == 1:
+        obj.data.shape_keys = None
+        obj.active_shape_key_index = 0
+    else:
+        del key_blocks[obj.active_shape_key_index]
+        obj.active_shape_key_index = max(obj.active_shape_key_index - 1, 0)
+    return {'FINISHED'}
+
+def object_shape_key_clear(context):
+    obj = context.object
+    for kb in obj.data.shape_keys.key_blocks:
+        kb.value = 0.0
+    return {'FINISHED'}
+
+def mesh_select_all(context, action='TOGGLE'):
+    obj = context.object
+    check_poll(obj and obj.mode == 'EDIT', 'mesh.select_all')
+    bm = obj.data.edit_bmesh
+    if action == 'TOGGLE':
+        action = 'DESELECT' if any(v.select for v in bm.verts) else 'SELECT'
+    for seq in (bm.verts, bm.edges, bm.faces):
+        for elem in seq:
+            elem.select = not elem.select if action == 'INVERT' else action == 'SELECT'
+    return {'FINISHED'}
+
+# Seams are not used by anything on the stand-in
+def uv_seams_from_islands(context, mark_seams=True, mark_sharp=False):
+    check_poll(context.object and context.object.mode == 'EDIT', 'uv.seams_from_islands')
+    return {'FINISHED'}
+
+OPERATORS = {
+        'object.mode_set' : object_mode_set,
+        'object.select_all' : object_select_all,
+        'object.parent_set' : object_parent_set,
+        'object.shape_key_remove' : object_shape_key_remove,
+        'object.shape_key_clear' : object_shape_key_clear,
+        'mesh.select_all' : mesh_select_all,
+        'uv.seams_from_islands' : uv_seams_from_islands,
+        }
+
+class BPyOpsSubModOp:
+    def __init__(self, module, name):
+        self.module = module
+        self.name = name
+
+    def idname_py(self):
+        return self.module + '.' + self.name
+
+    def __call__(self, *args, **kwargs):
+        op = OPERATORS.get(self.idname_py())
+        if not op:
+            raise NotImplementedError('bpy.ops.' + self.idname_py() + ' is not part of the Blender stand-in')
+        return op(get_bpy().context, **kwargs)
+
+class BPyOpsSubMod:
+    def __init__(self, module):
+        self.module = module
+
+    def __getattr__(self, name):
+        return BPyOpsSubModOp(self.module, name)
+
+class BPyOps:
+    def __getattr__(self, module):
+        return BPyOpsSubMod(module)
+
+### Modules
+
+def make_module(name, **attrs):
+    module = types.ModuleType(name)
+    module.__dict__.update(attrs)
+    return module
+
+def install():
+    props = make_module('bpy.props', BoolProperty=BoolProperty, IntProperty=IntProperty,
+            FloatProperty=FloatProperty, StringProperty=StringProperty, EnumProperty=EnumProperty,
+            PointerProperty=PointerProperty, CollectionProperty=CollectionProperty)
+    bpy_types = make_module('bpy.types', Operator=Operator, Panel=Panel, PropertyGroup=PropertyGroup,
+            Scene=Scene, Object=Object, Mesh=Mesh)
+    handlers = make_module('bpy.app.handlers', persistent=persistent, scene_update_post=[], load_post=[])
+    app = make_module('bpy.app', handlers=handlers, version=(2, 77, 0), background=True)
+    utils = make_module('bpy.utils', register_module=lambda name: None, unregister_module=lambda name: None)
+    path = make_module('bpy.path', abspath=os.path.abspath)
+    bpy = make_module('bpy', props=props, types=bpy_types, app=app, utils=utils, path=path, ops=BPyOps(),
+            data=BlendData(), context=Context(Scene()))
+
+    io_utils = make_module('bpy_extras.io_utils', ExportHelper=ExportHelper)
+    bpy_extras = make_module('bpy_extras', io_utils=io_utils)
+
+    bmesh_types = make_module('bmesh.types', BMesh=BMesh, BMVert=BMVert, BMEdge=BMEdge, BMFace=BMFace)
+    bmesh_ops = make_module('bmesh.ops', delete=op_delete, duplicate=op_duplicate, transform=op_transform,
+            reverse_faces=op_reverse_faces, weld_verts=op_weld_verts, remove_doubles=op_remove_doubles)
+    bmesh = make_module('bmesh', new=bmesh_new, from_edit_mesh=from_edit_mesh, types=bmesh_types, ops=bmesh_ops)
+
+    mathutils = make_module('mathutils', Matrix=Matrix)
+
+    sys.modules.update({module.__name__ : module for module in (bpy, props, bpy_types, app, handlers, utils,
+        path, bpy_extras, io_utils, bmesh, bmesh_types, bmesh_ops, mathutils)})
+
+# Remove fake modules and the add-on package with its submodules
+def uninstall():
+    for name in list(sys.modules):
+        if name.split('.')[0] in {'bpy', 'bpy_extras', 'bmesh', 'mathutils', ADDON_NAME}:
+            del sys.modules[name]
+
+def import_addon(path):
+    if ADDON_NAME in sys.modules:
+        return sys.modules[ADDON_NAME]
+    spec = importlib.util.spec_from_file_location(ADDON_NAME, os.path.join(path, '__init__.py'),
+            submodule_search_locations=[path])
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[ADDON_NAME] = module
+    spec.loader.exec_module(module)
+    return module
+
+# Fresh blend data and context with empty scene
+def new_context():
+    bpy = get_bpy()
+    bpy.data = BlendData()
+    bpy.context = Context(Scene())
+    return bpy.context
+
+# Create object of data and link it to scene of context, mesh data is given as
+# vertex coordinates and faces as lists of vertex indices
+def add_object(context, name, data=None):
+    obj = Object(name, data)
+    bpy = get_bpy()
+    bpy.data.objects.append(obj)
+    if isinstance(data, Mesh): bpy.data.meshes.append(data)
+    if isinstance(data, Armature): bpy.data.armatures.append(data)
+    context.scene.objects.link(obj)
+    return obj
+
+def add_mesh_object(context, name, coords, faces):
+    return add_object(context, name, Mesh(name, coords, faces))
+
+def add_armature_object(context, name, bones):
+    return add_object(context, name, Armature(name, bones))
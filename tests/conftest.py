@@ -0,0 +1,51 @@
+import os, sys
+import pytest
+
+# Add-on folder, its NumPy-only modules are imported as top level modules
+ADDON_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ADDON_DIR)
+
+class AddonDirectory:
+    # Add-on folder is a package that can only be imported inside Blender, collect it
+    # as plain directory so pytest never imports its __init__.py.
+    # Registered globally since conftest hooks only apply to their own folder.
+    @pytest.hookimpl(tryfirst=True)
+    def pytest_collect_directory(self, path, parent):
+        if str(path) == ADDON_DIR:
+            return pytest.Dir.from_parent(parent, path=path)
+
+def pytest_configure(config):
+    config.pluginmanager.register(AddonDirectory(), 'basemesh_addon_directory')
+
+@pytest.fixture(scope='session')
+def rigify_tables():
+    import rigify_names
+    return {'def_names' : rigify_names.def_names, 'extra_exception' : rigify_names.extra_exception}
+
+@pytest.fixture(scope='session')
+def rigify_bone_names(rigify_tables):
+    def_names = rigify_tables['def_names']
+    names = set(def_names) | set(def_names.values()) | set(rigify_tables['extra_exception'])
+    for name in list(names):
+        base = name.split('-', 1)[-1]
+        names.update(prefix + base for prefix in ('ORG-', 'MCH-', 'DEF-'))
+    return sorted(names)
+
+# Add-on package imported on the Blender stand-in, fake modules are removed after the session
+@pytest.fixture(scope='session')
+def addon():
+    import blender_stub
+    blender_stub.install()
+    yield blender_stub.import_addon(ADDON_DIR)
+    blender_stub.uninstall()
+
+# Context with empty scene, add-on caches are dropped so every test starts clean
+@pytest.fixture
+def context(addon):
+    import blender_stub
+    context = blender_stub.new_context()
+    context.scene.basemesh_tools_props = addon.BasemeshToolsProps()
+    addon.common.clear_weight_matrix_cache()
+    addon.common.rig_bindings.dirty = True
+    addon.mirror_tools.mirror_map_cache.clear()
+    return context
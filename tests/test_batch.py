@@ -0,0 +1,76 @@
+import os, threading
+import batch
+
+def make_jobs(names, action='APPLY'):
+    return [batch.Job(name, action, name + '.out') for name in names]
+
+def test_run_batch_keeps_job_order():
+    # Later jobs finish first
+    def worker(job):
+        if job.filepath == 'a.blend':
+            release.wait(5.0)
+        else: release.set()
+        return {'status' : 'OK', 'operator_seconds' : 0.5}
+
+    release = threading.Event()
+    jobs = make_jobs(['a.blend', 'b.blend', 'c.blend'])
+    results = batch.run_batch(jobs, worker=worker, num_jobs=3)
+
+    assert [r['file'] for r in results] == ['a.blend', 'b.blend', 'c.blend']
+    assert [r['output'] for r in results] == ['a.blend.out', 'b.blend.out', 'c.blend.out']
+    assert all(r['status'] == 'OK' and r['action'] == 'APPLY' for r in results)
+    assert all(r['seconds'] >= 0.0 and r['operator_seconds'] == 0.5 for r in results)
+
+def test_run_batch_reports_failures():
+    def worker(job):
+        if job.filepath == 'broken.blend':
+            raise RuntimeError('Cannot open file')
+        if job.filepath == 'failed.blend':
+            return {'status' : 'FAILED', 'error' : 'Timeout'}
+        return {'status' : 'OK'}
+
+    jobs = make_jobs(['ok.blend', 'broken.blend', 'failed.blend'], 'TOGGLE')
+    results = batch.run_batch(jobs, worker=worker, num_jobs=2)
+
+    assert [r['status'] for r in results] == ['OK', 'FAILED', 'FAILED']
+    assert 'Cannot open file' in results[1]['error']
+    assert results[2]['error'] == 'Timeout'
+
+    report = batch.make_report(results, 1.5)
+    assert report['num_files'] == 3
+    assert report['num_failed'] == 2
+    assert report['total_seconds'] == 1.5
+    assert report['results'] is results
+
+def test_run_batch_callback_and_pool_size():
+    lock = threading.Lock()
+    running = [0, 0]
+    def worker(job):
+        with lock:
+            running[0] += 1
+            running[1] = max(running[1], running[0])
+        threading.Event().wait(0.01)
+        with lock:
+            running[0] -= 1
+        return {'status' : 'OK'}
+
+    finished = []
+    jobs = make_jobs([str(i) + '.blend' for i in range(8)])
+    batch.run_batch(jobs, worker=worker, num_jobs=2, callback=finished.append)
+
+    assert sorted(r['file'] for r in finished) == sorted(job.filepath for job in jobs)
+    assert running[1] <= 2
+
+def test_output_paths_next_to_inputs():
+    paths = batch.get_output_paths([os.path.join('a', 'body.blend'), 'head.blend'], '', '_applied')
+    assert paths == [os.path.join('a', 'body_applied.blend'), 'head_applied.blend']
+
+def test_output_paths_are_unique(tmp_path):
+    files = [str(tmp_path / 'a' / 'body.blend'), str(tmp_path / 'b' / 'body.blend'),
+            str(tmp_path / 'b' / 'c' / 'head.blend'), str(tmp_path / 'a' / 'body.blend')]
+    out = str(tmp_path / 'out')
+    paths = batch.get_output_paths(files, out, '_applied')
+
+    assert paths == [os.path.join(out, 'a', 'body.blend'), os.path.join(out, 'b', 'body.blend'),
+            os.path.join(out, 'b', 'c', 'head.blend'), os.path.join(out, 'a', 'body_1.blend')]
+    assert len(set(paths)) == len(paths)
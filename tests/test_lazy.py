@@ -0,0 +1,34 @@
+import sys
+import lazy
+
+def test_lazy_import_runs_module_on_first_use(tmp_path, monkeypatch):
+    (tmp_path / 'lazy_target.py').write_text('import sys\nsys.lazy_target_runs = getattr(sys, "lazy_target_runs", 0) + 1\nvalue = 42\n')
+    monkeypatch.syspath_prepend(str(tmp_path))
+    monkeypatch.delitem(sys.modules, 'lazy_target', raising=False)
+    monkeypatch.setattr(sys, 'lazy_target_runs', 0, raising=False)
+
+    module = lazy.lazy_import('lazy_target')
+    assert sys.lazy_target_runs == 0
+    assert module.value == 42
+    assert sys.lazy_target_runs == 1
+
+    # Imported module is reused
+    assert lazy.lazy_import('lazy_target') is sys.modules['lazy_target']
+    import lazy_target
+    assert lazy_target.value == 42
+    assert sys.lazy_target_runs == 1
+
+def test_lazy_import_submodule_is_set_on_package(tmp_path, monkeypatch):
+    package = tmp_path / 'lazy_package'
+    package.mkdir()
+    (package / '__init__.py').write_text('')
+    (package / 'child.py').write_text('value = 7\n')
+    monkeypatch.syspath_prepend(str(tmp_path))
+    for name in ('lazy_package', 'lazy_package.child'):
+        monkeypatch.delitem(sys.modules, name, raising=False)
+
+    import lazy_package
+    child = lazy.lazy_import('.child', 'lazy_package')
+    from lazy_package import child as imported
+    assert imported is child and lazy_package.child is child
+    assert child.value == 7
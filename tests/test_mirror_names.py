@@ -0,0 +1,68 @@
+import random
+import mirror_utils
+
+# Mirror name function before the compiled resolver, kept as reference
+def reference_mirror_name(name):
+    splitnames = name.split('.')
+    last_word = splitnames[-1]
+
+    extra = ''
+    crop_name = name
+    if last_word.isdigit() and len(splitnames) > 1:
+        extra = '.' + last_word
+        crop_name = name[:-len(last_word)-1]
+
+    for l, r in mirror_utils.mirror_dict.items():
+        if crop_name.endswith(l):
+            return crop_name[:-len(l)] + r + extra
+        if crop_name.endswith(r):
+            return crop_name[:-len(r)] + l + extra
+    return ''
+
+def side_names():
+    names = []
+    for l, r in mirror_utils.mirror_dict.items():
+        for side in (l, r):
+            for stem in ('', 'hand', 'thumb.01', 'left_eye', 'L_arm', 'upper_arm.02'):
+                for number in ('', '.001', '.02', '.1'):
+                    names.append(stem + side + number)
+    return names
+
+# Random names made of side tokens, separators and numbers
+def random_names(count, seed=0):
+    rng = random.Random(seed)
+    sides = list(mirror_utils.mirror_dict) + list(mirror_utils.mirror_dict.values()) + \
+            list(mirror_utils.mirror_prefix_dict) + list(mirror_utils.mirror_prefix_dict.values())
+    tokens = sides + ['hand', 'eye', 'x', '.', '_', '-', '01', '.001', 'l', 'R', '']
+    return [''.join(rng.choice(tokens) for i in range(rng.randint(1, 5))) for j in range(count)]
+
+def check_matches_reference(names):
+    resolver = mirror_utils.MirrorNameResolver(mirror_utils.mirror_dict, mirror_utils.mirror_prefix_dict)
+    for name in names:
+        expected = reference_mirror_name(name)
+        result = resolver.resolve(name)
+        if expected:
+            assert result == expected, name
+        else:
+            # Only names starting with a side have a mirror the old function didn't find
+            assert result == '' or resolver.prefix_pattern.match(name), name
+        if result:
+            assert resolver.resolve(result) == name, name
+
+def test_rigify_bone_names_match_reference(rigify_bone_names):
+    check_matches_reference(rigify_bone_names)
+
+def test_mirror_dict_sides_match_reference():
+    check_matches_reference(side_names())
+
+def test_random_names_match_reference():
+    check_matches_reference(random_names(20000))
+
+def test_suffix_wins_over_prefix():
+    assert mirror_utils.get_mirror_name('left_eye.L') == 'left_eye.R'
+    assert mirror_utils.get_mirror_name('L_hand.R.001') == 'L_hand.L.001'
+
+def test_prefix_sides():
+    assert mirror_utils.get_mirror_name('L_hand') == 'R_hand'
+    assert mirror_utils.get_mirror_name('Right-arm') == 'Left-arm'
+    assert mirror_utils.get_mirror_name('Lung') == ''
@@ -0,0 +1,208 @@
+import numpy as np
+import mirror_utils
+
+# Greedy pairing by checking every pair, same rule as pair_by_position
+def brute_force_pairs(coords1, coords2, tolerance, unique=True):
+    used = set()
+    ids1 = []
+    ids2 = []
+    for i, co in enumerate(coords1):
+        dist = np.linalg.norm(coords2 - co, axis=1)
+        for j in np.nonzero(dist < tolerance)[0].tolist():
+            if unique and j in used: continue
+            used.add(j)
+            ids1.append(i)
+            ids2.append(j)
+            break
+    return ids1, ids2
+
+def check_matches_brute_force(coords1, coords2, tolerance):
+    for unique in (True, False):
+        ids1, ids2 = mirror_utils.pair_by_position(coords1, coords2, tolerance, unique)
+        expected1, expected2 = brute_force_pairs(coords1, coords2, tolerance, unique)
+        np.testing.assert_array_equal(ids1, expected1)
+        np.testing.assert_array_equal(ids2, expected2)
+
+# Symmetric quad grid on xz plane, x from -1 to 1
+def symmetric_grid(size=6):
+    xs = np.linspace(-1.0, 1.0, size)
+    zs = np.linspace(0.0, 1.0, size)
+    coords = np.array([(x, 0.0, z) for z in zs for x in xs])
+    edges = []
+    for row in range(size):
+        for col in range(size):
+            i = row * size + col
+            if col + 1 < size: edges.append((i, i + 1))
+            if row + 1 < size: edges.append((i, i + size))
+    return coords, np.array(edges)
+
+def grid_mirror(size=6):
+    ids = np.arange(size * size)
+    return ids // size * size + (size - 1 - ids % size)
+
+def test_pair_by_position_random_points():
+    rng = np.random.RandomState(0)
+    coords2 = rng.uniform(-1.0, 1.0, (500, 3))
+    coords1 = np.concatenate([coords2[rng.permutation(500)[:300]] + rng.normal(0.0, 0.00002, (300, 3)),
+        rng.uniform(-1.0, 1.0, (100, 3))])
+    check_matches_brute_force(coords1, coords2, 0.0001)
+
+def test_pair_by_position_duplicate_points():
+    # Several coords2 points on the same position are used one by one
+    coords2 = np.array([[0.0, 0.0, 0.0]] * 3 + [[1.0, 0.0, 0.0]])
+    coords1 = np.array([[0.0, 0.0, 0.0]] * 4 + [[1.0, 0.0, 0.00005]])
+    check_matches_brute_force(coords1, coords2, 0.0001)
+
+def test_pair_by_position_empty():
+    ids1, ids2 = mirror_utils.pair_by_position(np.empty((0, 3)), np.zeros((3, 3)))
+    assert len(ids1) == len(ids2) == 0
+    ids1, ids2 = mirror_utils.pair_by_position(np.zeros((3, 3)), np.empty((0, 3)))
+    assert len(ids1) == len(ids2) == 0
+
+def test_pair_by_position_near_grid_bound():
+    # Span is much larger than tolerance, so grid has the maximum number of cells
+    # and queries can land on the last cell around the indexed points
+    rng = np.random.RandomState(1)
+    tolerance = 1e-7
+    coords2 = np.concatenate([[[0.0, 0.0, 0.0], [1.0, 1.0, 1.0]], rng.uniform(0.999999, 1.0, (50, 3))])
+    coords1 = coords2 + rng.uniform(-0.5, 0.5, coords2.shape) * tolerance
+    check_matches_brute_force(coords1, coords2, tolerance)
+    ids1, ids2 = mirror_utils.pair_by_position(coords1, coords2, tolerance)
+    assert len(ids1) == len(coords1)
+
+def test_mirror_map_symmetric_grid():
+    coords, edges = symmetric_grid()
+    np.testing.assert_array_equal(mirror_utils.mirror_map(coords, edges), grid_mirror())
+
+def test_mirror_map_topology_fallback():
+    coords, edges = symmetric_grid()
+    # Move vertex on second row, its mirror is found by neighbors
+    coords[7] += (0.05, 0.0, 0.02)
+    mirror = mirror_utils.mirror_map(coords, edges)
+    np.testing.assert_array_equal(mirror, grid_mirror())
+
+    spatial = mirror_utils.spatial_mirror_map(coords, 0)
+    assert spatial[7] == -1 and spatial[10] == -1
+
+def test_update_mirror_map():
+    coords, edges = symmetric_grid()
+    mirror = mirror_utils.mirror_map(coords, edges)
+
+    # Unchanged coordinates keep the map
+    np.testing.assert_array_equal(mirror_utils.update_mirror_map(mirror, coords, edges), mirror)
+
+    # Broken entries are rebuilt, same as building the map again
+    broken = mirror.copy()
+    broken[[3, 20]] = broken[[20, 3]]
+    broken[12] = -1
+    updated = mirror_utils.update_mirror_map(broken, coords, edges)
+    np.testing.assert_array_equal(updated, mirror_utils.mirror_map(coords, edges))
+
+    # Different number of vertices builds the whole map
+    updated = mirror_utils.update_mirror_map(mirror[:10], coords, edges)
+    np.testing.assert_array_equal(updated, mirror)
+
+def test_verify_mirror_map():
+    coords, edges = symmetric_grid()
+    mirror = grid_mirror()
+    assert mirror_utils.verify_mirror_map(mirror, coords).all()
+
+    coords[7] += (0.05, 0.0, 0.0)
+    valid = mirror_utils.verify_mirror_map(mirror, coords)
+    assert not valid[7] and not valid[10]
+    assert np.count_nonzero(~valid) == 2
+
+def test_symmetrize_shape_keys():
+    # Basis and one key of two vertices on positive side
+    key_coords = np.array([[[1.0, 0.0, 0.0], [2.0, 1.0, 0.0]],
+                           [[1.5, 0.0, 0.0], [2.0, 1.0, 1.0]]])
+    # Vertex 0 is kept, vertex 2 is mirrored copy of vertex 0
+    origins = [0, 2]
+    result = mirror_utils.symmetrize_shape_keys(key_coords, origins)
+    np.testing.assert_allclose(result, [[[1.0, 0.0, 0.0], [-1.0, 0.0, 0.0]],
+                                        [[1.5, 0.0, 0.0], [-1.5, 0.0, 0.0]]])
+
+    # Mirrored vertex takes offsets of vertex 1 instead
+    result = mirror_utils.symmetrize_shape_keys(key_coords, origins, targets=[1], sources=[1])
+    np.testing.assert_allclose(result[:, 1], [[-1.0, 0.0, 0.0], [-1.0, 0.0, 1.0]])
+
+def test_reversed_loop_order():
+    # Quad and triangle
+    loop_ids, edge_ids = mirror_utils.reversed_loop_order([0, 4], [4, 3])
+    np.testing.assert_array_equal(loop_ids, [0, 3, 2, 1, 4, 6, 5])
+    np.testing.assert_array_equal(edge_ids, [3, 2, 1, 0, 6, 5, 4])
+
+    # Edge of loop i goes from loop i to loop i + 1, reversed face should use the same edges
+    loop_verts = np.array([10, 11, 12, 13, 20, 21, 22])
+    edge_verts = {0 : (10, 11), 1 : (11, 12), 2 : (12, 13), 3 : (13, 10), 4 : (20, 21), 5 : (21, 22), 6 : (22, 20)}
+    new_verts = loop_verts[loop_ids]
+    for start, total in ((0, 4), (4, 3)):
+        for k in range(total):
+            i = start + k
+            j = start + (k + 1) % total
+            assert set(edge_verts[edge_ids[i]]) == {new_verts[i], new_verts[j]}
+
+# Mirror plane space moved to x = 1 and rotated 90 degrees around z, so its x axis is world y
+PLANE_MATRIX = np.array([[0.0, -1.0, 0.0, 1.0],
+                         [1.0, 0.0, 0.0, 0.0],
+                         [0.0, 0.0, 1.0, 0.0],
+                         [0.0, 0.0, 0.0, 1.0]])
+
+def test_reflect_points():
+    points = np.array([[1.0, 2.0, 3.0], [-1.0, 0.5, 0.0]])
+    np.testing.assert_allclose(mirror_utils.reflect_points(points, 0), [[-1.0, 2.0, 3.0], [1.0, 0.5, 0.0]])
+    np.testing.assert_allclose(mirror_utils.reflect_points(points, 2), [[1.0, 2.0, -3.0], [-1.0, 0.5, 0.0]])
+
+    # Plane x axis is world y, so points are reflected across world y = 0
+    np.testing.assert_allclose(mirror_utils.reflect_points(points, 0, PLANE_MATRIX),
+            [[1.0, -2.0, 3.0], [-1.0, -0.5, 0.0]], atol=1e-12)
+
+    # Plane y axis is world -x through x = 1
+    np.testing.assert_allclose(mirror_utils.reflect_points(points, 1, PLANE_MATRIX),
+            [[1.0, 2.0, 3.0], [3.0, 0.5, 0.0]], atol=1e-12)
+
+def test_classify_half_with_plane():
+    points = np.array([[0.5, 2.0, 0.0], [3.0, -1.0, 0.0], [-2.0, 0.5, 0.0]])
+    # Without plane, negative x is on the other side
+    np.testing.assert_array_equal(mirror_utils.classify_half(points, 0, True), [False, False, True])
+    # Plane x axis is world y
+    np.testing.assert_array_equal(mirror_utils.classify_half(points, 0, True, PLANE_MATRIX), [False, True, False])
+    np.testing.assert_array_equal(mirror_utils.classify_half(points, 0, False, PLANE_MATRIX), [True, False, True])
+
+def test_symmetrize_shape_keys_with_plane():
+    key_coords = np.array([[[1.0, 2.0, 0.0]], [[1.0, 3.0, 1.0]]])
+    result = mirror_utils.symmetrize_shape_keys(key_coords, [0, 1], 0, matrix=PLANE_MATRIX)
+    np.testing.assert_allclose(result[:, 1], [[1.0, -2.0, 0.0], [1.0, -3.0, 1.0]], atol=1e-12)
+    np.testing.assert_allclose(result[:, 0], key_coords[:, 0])
+
+def test_mirror_map_with_plane():
+    # Grid mirrored across world y = 0 instead of x = 0
+    coords, edges = symmetric_grid()
+    coords = coords[:, [1, 0, 2]]
+    np.testing.assert_array_equal(mirror_utils.mirror_map(coords, edges, 0, matrix=PLANE_MATRIX), grid_mirror())
+    assert mirror_utils.verify_mirror_map(grid_mirror(), coords, 0, matrix=PLANE_MATRIX).all()
+    assert not mirror_utils.verify_mirror_map(grid_mirror(), coords, 0).all()
+
+def test_match_face_loops():
+    # Quad and triangle, second faces have the same vertices on other loop order
+    loop_verts1 = [0, 1, 2, 3, 4, 5, 6]
+    loop_verts2 = [5, 6, 4, 9, 8, 7, 2, 1, 0, 3]
+    loops1, loops2 = mirror_utils.match_face_loops([0, 4], [4, 3], loop_verts1, [0, 3, 6], [3, 3, 4], loop_verts2)
+    np.testing.assert_array_equal(loops1, [0, 1, 2, 3, 4, 5, 6])
+    np.testing.assert_array_equal(loops2, [8, 7, 6, 9, 2, 0, 1])
+
+    # Faces with unknown vertex are not matched
+    loops1, loops2 = mirror_utils.match_face_loops([0, 4], [4, 3], [0, 1, 2, -1, 4, 5, 6],
+            [0, 3, 6], [3, 3, 4], loop_verts2)
+    np.testing.assert_array_equal(loops1, [4, 5, 6])
+    np.testing.assert_array_equal(loops2, [2, 0, 1])
+
+def test_mesh_hash_changes_with_positions():
+    coords, edges = symmetric_grid()
+    checksum = mirror_utils.mesh_hash(len(coords), edges, 25, coords)
+    assert mirror_utils.mesh_hash(len(coords), edges, 25, coords.copy()) == checksum
+
+    moved = coords.copy()
+    moved[7, 0] += 0.01
+    assert mirror_utils.mesh_hash(len(coords), edges, 25, moved) != checksum
+    assert mirror_utils.mesh_hash(len(coords), edges[:-1], 25, coords) != checksum
@@ -0,0 +1,404 @@
+import numpy as np
+import pytest
+import blender_stub
+from blender_stub import Matrix, point_coords
+
+# Quad grid on xz plane, columns from x0 to x1
+def grid(cols=5, rows=3, x0=-1.0, x1=1.0):
+    coords = [(x, 0.0, z) for z in np.linspace(0.0, 1.0, rows) for x in np.linspace(x0, x1, cols)]
+    faces = [[r * cols + c, r * cols + c + 1, (r + 1) * cols + c + 1, (r + 1) * cols + c]
+            for r in range(rows - 1) for c in range(cols - 1)]
+    return coords, faces
+
+def add_grid(context, name='grid', **kwargs):
+    obj = blender_stub.add_mesh_object(context, name, *grid(**kwargs))
+    context.scene.objects.active = obj
+    obj.select = True
+    return obj
+
+def add_shape_key(obj, name, offsets=None):
+    kb = obj.shape_key_add(name=name, from_mix=False)
+    if offsets:
+        coords = point_coords(kb.data)
+        for i, offset in offsets.items():
+            coords[i] += offset
+        for point, co in zip(kb.data, coords):
+            point.co = tuple(co)
+    return kb
+
+def find_vertex(coords, co):
+    dist = np.linalg.norm(coords - co, axis=1)
+    assert dist.min() < 1e-5, 'No vertex on ' + str(co)
+    return int(dist.argmin())
+
+def assert_symmetric(coords, center=0.0):
+    reflected = coords.copy()
+    reflected[:, 0] = 2.0 * center - reflected[:, 0]
+    for co in reflected:
+        find_vertex(coords, co)
+
+# Every loop edge connects the loop vertex with the next one of its face
+def assert_valid_topology(mesh):
+    edges = [set(e.vertices) for e in mesh.edges]
+    for face in mesh.face_vertices():
+        assert len(set(face)) == len(face)
+    for p in mesh.polygons:
+        loops = mesh.loops[p.loop_start:p.loop_start + p.loop_total]
+        for i, l in enumerate(loops):
+            assert edges[l.edge_index] == {l.vertex_index, loops[(i + 1) % len(loops)].vertex_index}
+
+def group_weights(obj, name):
+    return obj.group_weights(name) if obj.vertex_groups.get(name) else np.zeros(len(obj.data.vertices))
+
+@pytest.mark.parametrize('mode, kept_x', [('X_PLUS_MIN', 1.0), ('X_MIN_PLUS', -1.0)])
+def test_force_mirror_replaces_other_half(addon, context, mode, kept_x):
+    obj = add_grid(context)
+    mesh = obj.data
+    kept = find_vertex(point_coords(mesh.vertices), (kept_x, 0.0, 0.0))
+    mesh.vertices[kept].co = (kept_x, 0.3, 0.0)
+    mesh.vertices[3].select = True
+
+    op = addon.mirror_tools.ForceMirror(mode=mode)
+    assert op.execute(context) == {'FINISHED'}
+
+    coords = point_coords(mesh.vertices)
+    assert len(mesh.vertices) == 15 and len(mesh.polygons) == 8
+    assert_symmetric(coords)
+    find_vertex(coords, (-kept_x, 0.3, 0.0))
+    assert_valid_topology(mesh)
+    assert not any(v.select for v in mesh.vertices)
+    assert obj.mode == 'OBJECT'
+
+@pytest.mark.parametrize('shape_keys_mode', ['TRANSFER', 'MIRROR'])
+def test_force_mirror_shape_keys(addon, context, shape_keys_mode):
+    obj = add_grid(context)
+    add_shape_key(obj, 'Basis')
+    add_shape_key(obj, 'smile', {0 : (0.0, 0.0, 0.2), 4 : (0.0, 0.1, 0.0)})
+
+    op = addon.mirror_tools.ForceMirror(mode='X_PLUS_MIN', shape_keys_mode=shape_keys_mode)
+    assert op.execute(context) == {'FINISHED'}
+
+    key_blocks = obj.data.shape_keys.key_blocks
+    basis = point_coords(key_blocks[0].data)
+    offsets = point_coords(key_blocks[1].data) - basis
+    left = find_vertex(basis, (-1.0, 0.0, 0.0))
+    right = find_vertex(basis, (1.0, 0.0, 0.0))
+    np.testing.assert_allclose(offsets[right], (0.0, 0.1, 0.0), atol=1e-6)
+    expected = (0.0, 0.0, 0.2) if shape_keys_mode == 'TRANSFER' else (0.0, 0.1, 0.0)
+    np.testing.assert_allclose(offsets[left], expected, atol=1e-6)
+
+def test_force_mirror_flips_vertex_groups(addon, context):
+    obj = add_grid(context)
+    right_ids = [i for i, v in enumerate(obj.data.vertices) if v.co[0] > 0.0]
+    obj.vertex_groups.new('hand.L').add(right_ids, 1.0, 'REPLACE')
+    obj.vertex_groups.new('hand.R')
+
+    assert addon.mirror_tools.ForceMirror(mode='X_PLUS_MIN').execute(context) == {'FINISHED'}
+
+    x = point_coords(obj.data.vertices)[:, 0]
+    np.testing.assert_array_equal(group_weights(obj, 'hand.L'), (x > 0.0).astype(float))
+    np.testing.assert_array_equal(group_weights(obj, 'hand.R'), (x < 0.0).astype(float))
+
+# Center verts without valid mirror pair are not welded by the map but still merged on the seam
+def test_force_mirror_closes_seam_without_mirror_pairs(addon, context):
+    obj = add_grid(context)
+    x = point_coords(obj.data.vertices)[:, 0]
+    mirror = np.arange(15) // 5 * 5 + 4 - np.arange(15) % 5
+    mirror[x == 0.0] = -1
+    delete_mask = np.array([min(obj.data.vertices[i].co[0] for i in face) < 0.0 for face in obj.data.face_vertices()])
+
+    addon.mirror_tools.mirror_mesh_half(obj, delete_mask, mirror)
+    assert len(obj.data.vertices) == 15 and len(obj.data.polygons) == 8
+    assert_symmetric(point_coords(obj.data.vertices))
+    assert_valid_topology(obj.data)
+
+def test_force_mirror_on_mirror_object_plane(addon, context):
+    plane = blender_stub.add_object(context, 'plane')
+    plane.matrix_world = Matrix.Translation((0.5, 0.0, 0.0))
+    obj = add_grid(context)
+
+    op = addon.mirror_tools.ForceMirror(mode='X_PLUS_MIN', mirror_object='plane')
+    assert op.execute(context) == {'FINISHED'}
+
+    assert len(obj.data.vertices) == 9 and len(obj.data.polygons) == 4
+    assert_symmetric(point_coords(obj.data.vertices), center=0.5)
+    assert_valid_topology(obj.data)
+
+def test_force_mirror_cancels_on_one_sided_mesh(addon, context):
+    obj = add_grid(context, cols=3, x0=0.0)
+    coords = point_coords(obj.data.vertices)
+
+    op = addon.mirror_tools.ForceMirror(mode='X_PLUS_MIN')
+    assert op.execute(context) == {'CANCELLED'}
+    assert op.reports and 'WARNING' in op.reports[0][0]
+    np.testing.assert_array_equal(point_coords(obj.data.vertices), coords)
+
+def test_force_mirror_advance_keeps_uvs(addon, context):
+    obj = add_grid(context)
+    mesh = obj.data
+    uv_layer = mesh.uv_layers.new('UVMap')
+    coords = point_coords(mesh.vertices)
+    for l in mesh.loops:
+        l_co = coords[l.vertex_index]
+        uv_layer.data[l.index].uv = (l_co[0] * 0.5 + 0.5, l_co[2])
+
+    assert addon.mirror_tools.ForceMirrorAdvance().execute(context) == {'FINISHED'}
+
+    # Mirrored faces take uvs of the deleted faces on the same position
+    coords = point_coords(mesh.vertices)
+    for l in mesh.loops:
+        l_co = coords[l.vertex_index]
+        np.testing.assert_allclose(mesh.uv_layers[0].data[l.index].uv, (l_co[0] * 0.5 + 0.5, l_co[2]), atol=1e-6)
+
+# Grid in edit mode with shape key, given vertices are selected with the last one active
+def edit_grid_with_key(context, offsets, selected):
+    obj = add_grid(context)
+    add_shape_key(obj, 'Basis')
+    add_shape_key(obj, 'smile', offsets)
+    obj.active_shape_key_index = 1
+    for i in selected:
+        obj.data.vertices[i].select = True
+    blender_stub.object_mode_set(context, mode='EDIT')
+    bm = blender_stub.from_edit_mesh(obj.data)
+    bm.select_history.add(bm.verts[selected[-1]])
+    return obj
+
+# Selected vertices are the source, their mirror vertices get the mirrored key
+def test_shape_key_mirror_copies_to_mirror_vertices(addon, context):
+    obj = edit_grid_with_key(context, {4 : (0.2, 0.1, 0.0)}, [4])
+
+    assert addon.mirror_tools.ShapeKeyMirror().execute(context) == {'FINISHED'}
+
+    key_co = point_coords(obj.data.shape_keys.key_blocks[1].data)
+    np.testing.assert_allclose(key_co[0], (-1.2, 0.1, 0.0), atol=1e-6)
+    np.testing.assert_allclose(key_co[4], (1.2, 0.1, 0.0), atol=1e-6)
+    assert obj.mode == 'EDIT'
+    assert blender_stub.from_edit_mesh(obj.data).select_history[-1].index == 4
+
+def test_shape_key_mirror_skips_pairs_broken_on_basis(addon, context):
+    obj = edit_grid_with_key(context, {4 : (0.2, 0.1, 0.0)}, [4])
+    assert addon.mirror_tools.ShapeKeyMirror().execute(context) == {'FINISHED'}
+
+    # Basis is edited after the mirror map is stored
+    blender_stub.object_mode_set(context, mode='OBJECT')
+    key_blocks = obj.data.shape_keys.key_blocks
+    key_blocks[0].data[0].co = obj.data.vertices[0].co = (-1.0, 0.5, 0.0)
+    key_blocks[1].data[0].co = (-1.0, 0.5, 0.0)
+    blender_stub.object_mode_set(context, mode='EDIT')
+
+    assert addon.mirror_tools.ShapeKeyMirror().execute(context) == {'FINISHED'}
+    np.testing.assert_allclose(point_coords(key_blocks[1].data)[0], (-1.0, 0.5, 0.0), atol=1e-6)
+
+# Right half grid with mirror modifier, weighted to hand.L and with uvs by position
+def add_half_grid_with_mirror(context):
+    obj = add_grid(context, cols=3, x0=0.0)
+    mesh = obj.data
+    mod = obj.modifiers.new('Mirror', 'MIRROR')
+    obj.vertex_groups.new('hand.L').add(range(len(mesh.vertices)), 1.0, 'REPLACE')
+    obj.vertex_groups.new('hand.R')
+    uv_layer = mesh.uv_layers.new('UVMap')
+    for l in mesh.loops:
+        co = mesh.vertices[l.vertex_index].co
+        uv_layer.data[l.index].uv = (co[0] * 0.5, co[2])
+    return obj, mod
+
+def test_flip_mirror_modifier_reflects_mesh(addon, context):
+    obj, mod = add_half_grid_with_mirror(context)
+    mod.use_mirror_u = True
+    mesh = obj.data
+    coords = point_coords(mesh.vertices)
+    faces = mesh.face_vertices()
+    mesh.vertices[2].select = True
+
+    assert addon.mirror_tools.FlipMirrorModifier().execute(context) == {'FINISHED'}
+
+    np.testing.assert_allclose(point_coords(mesh.vertices), coords * (-1.0, 1.0, 1.0))
+    assert [sorted(f) for f in mesh.face_vertices()] == [sorted(f) for f in faces]
+    for old, new in zip(faces, mesh.face_vertices()):
+        i = new.index(old[0])
+        assert new[i:] + new[:i] == [old[0]] + old[:0:-1]
+    assert_valid_topology(mesh)
+
+    # Uvs stay with their vertex and are flipped on u
+    for l in mesh.loops:
+        co = coords[l.vertex_index]
+        np.testing.assert_allclose(mesh.uv_layers[0].data[l.index].uv, (1.0 - co[0] * 0.5, co[2]), atol=1e-6)
+
+    np.testing.assert_array_equal(group_weights(obj, 'hand.L'), 0.0)
+    np.testing.assert_array_equal(group_weights(obj, 'hand.R'), 1.0)
+    assert [v.select for v in mesh.vertices] == [i == 2 for i in range(len(mesh.vertices))]
+
+def test_flip_mirror_modifier_keeps_edit_mode_active_vertex(addon, context):
+    obj, mod = add_half_grid_with_mirror(context)
+    obj.data.vertices[4].select = True
+    blender_stub.object_mode_set(context, mode='EDIT')
+    bm = blender_stub.from_edit_mesh(obj.data)
+    bm.select_history.add(bm.verts[4])
+
+    assert addon.mirror_tools.FlipMirrorModifier().execute(context) == {'FINISHED'}
+    assert obj.mode == 'EDIT'
+    assert blender_stub.from_edit_mesh(obj.data).select_history[-1].index == 4
+
+def test_flip_mirror_modifier_needs_first_mirror(addon, context):
+    obj, mod = add_half_grid_with_mirror(context)
+    obj.modifiers.insert(0, obj.modifiers.pop())
+    obj.modifiers.insert(0, blender_stub.Modifier('Armature', 'ARMATURE'))
+    coords = point_coords(obj.data.vertices)
+
+    op = addon.mirror_tools.FlipMirrorModifier()
+    assert op.execute(context) == {'CANCELLED'}
+    assert 'ERROR' in op.reports[0][0]
+    np.testing.assert_array_equal(point_coords(obj.data.vertices), coords)
+
+# Metarig on layer 0 with body bound by modifier and eyes parented to bone,
+# rigify rig on hidden layer 1
+def add_rigs(context):
+    scene = context.scene
+    props = scene.basemesh_tools_props
+    props.metarig_object = 'metarig'
+    props.rigify_object = 'rig'
+    props.rigify_shape_key_name = 'Rigify'
+
+    metarig = blender_stub.add_armature_object(context, 'metarig',
+            [blender_stub.Bone(name) for name in ('spine', 'hand.L')])
+    rig = blender_stub.add_armature_object(context, 'rig',
+            [blender_stub.Bone(name) for name in ('DEF-spine', 'DEF-hand.L', 'ORG-spine')])
+    rig.layers = blender_stub.layers(1)
+
+    body = add_grid(context, 'body')
+    body.modifiers.new('Armature', 'ARMATURE').object = metarig
+    body.vertex_groups.new('spine')
+    body.vertex_groups.new('hand.L')
+    add_shape_key(body, 'Basis')
+    add_shape_key(body, 'Rigify')
+
+    eyes = add_grid(context, 'eyes')
+    eyes.parent = metarig
+    eyes.parent_bone = 'spine'
+    eyes.select = False
+
+    scene.objects.active = body
+    return metarig, rig, body, eyes
+
+@pytest.mark.parametrize('incremental', [True, False])
+def test_metarig_rigify_toggle_round_trip(addon, context, incremental):
+    metarig, rig, body, eyes = add_rigs(context)
+    scene = context.scene
+    assert addon.MetarigRigifyToggle.poll(context)
+
+    assert addon.MetarigRigifyToggle(incremental=incremental).execute(context) == {'FINISHED'}
+
+    assert body.modifiers[0].object is rig
+    assert [vg.name for vg in body.vertex_groups] == ['DEF-spine', 'DEF-hand.L']
+    assert [kb.value for kb in body.data.shape_keys.key_blocks] == [0.0, 1.0]
+    assert body.active_shape_key_index == 1
+    assert eyes.parent is rig and eyes.parent_bone == 'DEF-spine'
+    assert scene.layers[:2] == [False, True]
+    assert scene.objects.active is body and body.select and not eyes.select
+    assert all(o.mode == 'OBJECT' for o in scene.objects)
+
+    assert addon.MetarigRigifyToggle(incremental=incremental).execute(context) == {'FINISHED'}
+
+    assert body.modifiers[0].object is metarig
+    assert [vg.name for vg in body.vertex_groups] == ['spine', 'hand.L']
+    assert [kb.value for kb in body.data.shape_keys.key_blocks] == [1.0, 0.0]
+    assert eyes.parent is metarig and eyes.parent_bone == 'spine'
+    assert scene.layers[:2] == [True, False]
+
+def rotation_z(angle, location=(0.0, 0.0, 0.0)):
+    c, s = np.cos(angle), np.sin(angle)
+    return Matrix([(c, -s, 0.0, location[0]), (s, c, 0.0, location[1]), (0.0, 0.0, 1.0, location[2]),
+        (0.0, 0.0, 0.0, 1.0)])
+
+# Grid bound to posed metarig: left half on spine, right half blended with hand.L,
+# with a shape key on every vertex
+def add_posed_grid(context, name):
+    metarig = context.scene.objects.get('metarig')
+    if not metarig:
+        metarig = blender_stub.add_armature_object(context, 'metarig',
+                [blender_stub.Bone('spine'), blender_stub.Bone('hand.L', Matrix.Translation((1.0, 0.0, 0.0)))])
+        metarig.matrix_world = Matrix.Translation((0.0, 0.0, 0.5))
+        metarig.pose.bones[0].matrix = rotation_z(0.5, (0.0, 0.2, 0.0))
+        metarig.pose.bones[1].matrix = rotation_z(-0.3, (1.0, 0.0, 0.3))
+
+    obj = add_grid(context, name)
+    obj.matrix_world = Matrix.Translation((0.0, 1.0, 0.0))
+    obj.modifiers.new('Armature', 'ARMATURE').object = metarig
+    x = point_coords(obj.data.vertices)[:, 0]
+    obj.vertex_groups.new('spine').add(np.nonzero(x <= 0.0)[0].tolist(), 1.0, 'REPLACE')
+    obj.vertex_groups.new('spine').add(np.nonzero(x > 0.0)[0].tolist(), 0.25, 'REPLACE')
+    obj.vertex_groups.new('hand.L').add(np.nonzero(x > 0.0)[0].tolist(), 0.75, 'REPLACE')
+    add_shape_key(obj, 'Basis')
+    add_shape_key(obj, 'smile', {i : (0.0, 0.1 * i, 0.05) for i in range(len(x))})
+    return obj
+
+def object_coords(obj):
+    key_blocks = obj.data.shape_keys.key_blocks
+    return [point_coords(obj.data.vertices)] + [point_coords(kb.data) for kb in key_blocks]
+
+def test_evaluate_object_matches_direct_skinning(addon, context):
+    evaluated = add_posed_grid(context, 'evaluated')
+    skinned = add_posed_grid(context, 'skinned')
+    assert addon.is_skinnable_modifier(skinned, skinned.modifiers[0])
+
+    addon.evaluate_object(evaluated, list(evaluated.modifiers))
+    addon.skin_object(skinned, list(skinned.modifiers))
+
+    for co1, co2 in zip(object_coords(evaluated), object_coords(skinned)):
+        np.testing.assert_allclose(co1, co2, atol=1e-5)
+
+    # Left half is only moved by spine, on armature space which is offset from object space
+    premat = np.array((0.0, 1.0, -0.5))
+    expected = np.array(rotation_z(0.5))[:3, :3].dot(np.array((-1.0, 0.0, 0.0)) + premat) + (0.0, 0.2, 0.0) - premat
+    np.testing.assert_allclose(point_coords(evaluated.data.vertices)[0], expected, atol=1e-5)
+
+# Muted and vertex group masked keys are baked at full shape, their settings are restored after
+@pytest.mark.parametrize('mute, vertex_group', [(False, ''), (True, ''), (False, 'mask')])
+def test_stream_bake_restores_shape_keys(addon, context, mute, vertex_group):
+    obj = add_posed_grid(context, 'streamed')
+    skinned = add_posed_grid(context, 'skinned')
+    obj.vertex_groups.new('mask').add([0, 1], 0.5, 'REPLACE')
+    mods = list(obj.modifiers)
+    key_blocks = obj.data.shape_keys.key_blocks
+    key_blocks[1].slider_max = 2.0
+    key_blocks[1].value = 0.5
+    key_blocks[1].mute = mute
+    key_blocks[1].vertex_group = vertex_group
+
+    settings = addon.get_shape_key_settings(obj)
+    key_coords = addon.bake_deformed_coords(obj, mods, range(1, len(key_blocks)))
+    context.scene.objects.active = obj
+    blender_stub.get_bpy().ops.object.shape_key_remove(all=True)
+    # Applying the modifier writes deformed mesh
+    blender_stub.Mesh.from_pydata(obj.data, addon.bake_deformed_coords(obj, mods)[0],
+            [e.vertices for e in obj.data.edges], obj.data.face_vertices())
+    addon.shape_keys_restore(obj, settings, key_coords)
+
+    addon.skin_object(skinned, list(skinned.modifiers))
+    for co1, co2 in zip(object_coords(obj)[1:], object_coords(skinned)[1:]):
+        np.testing.assert_allclose(co1, co2, atol=1e-5)
+
+    key_blocks = obj.data.shape_keys.key_blocks
+    assert [kb.name for kb in key_blocks] == ['Basis', 'smile']
+    assert key_blocks[1].slider_max == 2.0 and key_blocks[1].relative_key is key_blocks[0]
+    assert key_blocks[1].mute == mute and key_blocks[1].vertex_group == vertex_group
+    assert [o.name for o in context.scene.objects] == ['metarig', 'streamed', 'skinned']
+
+# Shape key settings stay on the evaluated object, so muted and vertex group masked keys
+# are baked at their full shape
+def test_evaluate_object_bakes_muted_and_masked_keys(addon, context):
+    evaluated = add_posed_grid(context, 'evaluated')
+    skinned = add_posed_grid(context, 'skinned')
+    for obj in (evaluated, skinned):
+        obj.vertex_groups.new('mask').add([0, 1], 0.5, 'REPLACE')
+        obj.data.shape_keys.key_blocks[1].vertex_group = 'mask'
+        add_shape_key(obj, 'muted', {i : (0.0, 0.0, 0.3) for i in range(15)}).mute = True
+
+    addon.evaluate_object(evaluated, [evaluated.modifiers[0]])
+    addon.skin_object(skinned, [skinned.modifiers[0]])
+
+    for co1, co2 in zip(object_coords(evaluated), object_coords(skinned)):
+        np.testing.assert_allclose(co1, co2, atol=1e-5)
+    key_blocks = evaluated.data.shape_keys.key_blocks
+    assert key_blocks[1].vertex_group == 'mask' and key_blocks[2].mute
+    assert [o.name for o in context.scene.objects] == ['metarig', 'evaluated', 'skinned']
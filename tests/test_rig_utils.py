@@ -0,0 +1,116 @@
+import numpy as np
+import rig_utils
+
+COORDS = np.array([[0.0, 0.0, 0.0], [1.0, 2.0, 3.0], [-1.0, 0.5, 2.0]])
+
+def translation(x, y, z):
+    matrix = np.identity(4)
+    matrix[:3, 3] = (x, y, z)
+    return matrix
+
+def rotation_z(angle):
+    matrix = np.identity(4)
+    c, s = np.cos(angle), np.sin(angle)
+    matrix[:2, :2] = ((c, -s), (s, c))
+    return matrix
+
+# Every vertex fully weighted to group 0
+def single_group_entries(num_verts):
+    return np.arange(num_verts), np.zeros(num_verts, dtype=np.int64), np.ones(num_verts)
+
+def test_identity_pose_keeps_coords():
+    rest = np.array([translation(0.0, 1.0, 0.0), rotation_z(0.3)])
+    matrices = rig_utils.skinning_matrices(rest, rest.copy())
+    np.testing.assert_allclose(matrices, np.tile(np.identity(4), (2, 1, 1)), atol=1e-12)
+
+    vert_ids, group_ids, weights = single_group_entries(len(COORDS))
+    result = rig_utils.linear_blend_skinning(COORDS, vert_ids, group_ids, weights, matrices)
+    np.testing.assert_allclose(result, COORDS, atol=1e-12)
+
+def test_pure_translation():
+    rest = np.array([translation(0.0, 1.0, 0.0)])
+    pose = np.array([translation(0.5, 1.0, -2.0)])
+    matrices = rig_utils.skinning_matrices(rest, pose)
+
+    vert_ids, group_ids, weights = single_group_entries(len(COORDS))
+    result = rig_utils.linear_blend_skinning(COORDS, vert_ids, group_ids, weights, matrices)
+    np.testing.assert_allclose(result, COORDS + [0.5, 0.0, -2.0], atol=1e-12)
+
+def test_translation_on_armature_space():
+    # Armature is rotated 90 degrees, so bone moving on armature x moves object on y
+    premat = rotation_z(np.pi / 2)
+    matrices = rig_utils.skinning_matrices(np.array([np.identity(4)]), np.array([translation(1.0, 0.0, 0.0)]), premat)
+
+    vert_ids, group_ids, weights = single_group_entries(len(COORDS))
+    result = rig_utils.linear_blend_skinning(COORDS, vert_ids, group_ids, weights, matrices)
+    np.testing.assert_allclose(result, COORDS + [0.0, -1.0, 0.0], atol=1e-12)
+
+def test_rotation_around_bone_head():
+    head = translation(1.0, 0.0, 0.0)
+    matrices = rig_utils.skinning_matrices(np.array([head]), np.array([head.dot(rotation_z(np.pi / 2))]))
+
+    result = rig_utils.linear_blend_skinning([[2.0, 0.0, 0.0]], [0], [0], [1.0], matrices)
+    np.testing.assert_allclose(result, [[1.0, 1.0, 0.0]], atol=1e-12)
+
+def test_two_bones_half_blend():
+    rest = np.tile(np.identity(4), (2, 1, 1))
+    pose = np.array([translation(2.0, 0.0, 0.0), translation(0.0, 4.0, 0.0)])
+    matrices = rig_utils.skinning_matrices(rest, pose)
+
+    # Vertex 0 is half on both bones, vertex 1 only on bone 1, vertex 2 has no weight
+    vert_ids = [0, 0, 1]
+    group_ids = [0, 1, 1]
+    weights = [0.5, 0.5, 1.0]
+    result = rig_utils.linear_blend_skinning(COORDS, vert_ids, group_ids, weights, matrices)
+    np.testing.assert_allclose(result, COORDS + [[1.0, 2.0, 0.0], [0.0, 4.0, 0.0], [0.0, 0.0, 0.0]], atol=1e-12)
+
+def test_unnormalized_weights_same_as_normalized():
+    rest = np.tile(np.identity(4), (2, 1, 1))
+    pose = np.array([translation(2.0, 0.0, 0.0), rotation_z(0.7)])
+    matrices = rig_utils.skinning_matrices(rest, pose)
+
+    vert_ids = [0, 0, 1, 1, 2]
+    group_ids = [0, 1, 0, 1, 1]
+    normalized = rig_utils.linear_blend_skinning(COORDS, vert_ids, group_ids, [0.25, 0.75, 0.5, 0.5, 1.0], matrices)
+    unnormalized = rig_utils.linear_blend_skinning(COORDS, vert_ids, group_ids, [0.1, 0.3, 2.0, 2.0, 0.2], matrices)
+    np.testing.assert_allclose(unnormalized, normalized, atol=1e-12)
+
+def test_tiny_total_weight_is_undeformed():
+    matrices = np.array([translation(1.0, 0.0, 0.0)])
+    result = rig_utils.linear_blend_skinning(COORDS, [0, 1], [0, 0], [rig_utils.MIN_TOTAL_WEIGHT / 2, 1.0], matrices)
+    np.testing.assert_allclose(result, COORDS + [[0.0, 0.0, 0.0], [1.0, 0.0, 0.0], [0.0, 0.0, 0.0]], atol=1e-12)
+
+def test_non_deform_groups_are_ignored():
+    matrices = np.array([translation(1.0, 0.0, 0.0), translation(0.0, 1.0, 0.0)])
+    result = rig_utils.linear_blend_skinning(COORDS[:1], [0, 0], [0, 1], [0.5, 0.5], matrices,
+            deform_groups=[True, False])
+    np.testing.assert_allclose(result, [[1.0, 0.0, 0.0]], atol=1e-12)
+
+def test_shape_keys_skinned_with_base():
+    matrices = rig_utils.skinning_matrices(np.array([np.identity(4)]), np.array([rotation_z(0.4)]))
+    vert_ids, group_ids, weights = single_group_entries(len(COORDS))
+    keys = np.stack([COORDS, COORDS + 0.1])
+    stacked = rig_utils.linear_blend_skinning(keys, vert_ids, group_ids, weights, matrices)
+    for i, key in enumerate(keys):
+        np.testing.assert_allclose(stacked[i], rig_utils.linear_blend_skinning(key, vert_ids, group_ids, weights, matrices))
+
+def test_weight_matrix_totals():
+    weight_matrix = rig_utils.WeightMatrix.from_entries(3, [2, 0, 0, 1], [1, 0, 1, 1], [0.2, 0.5, 0.25, 2.0], 3)
+    np.testing.assert_array_equal(weight_matrix.indptr, [0, 2, 3, 4])
+    np.testing.assert_allclose(weight_matrix.vertex_totals(), [0.75, 2.0, 0.2])
+    np.testing.assert_allclose(weight_matrix.group_totals(), [0.5, 2.45, 0.0])
+    np.testing.assert_array_equal(weight_matrix.group_vertex_counts(), [1, 3, 0])
+    np.testing.assert_allclose(weight_matrix.group_weights(1), [0.25, 2.0, 0.2])
+
+def test_weight_matrix_skinning_normalizes():
+    # Unnormalized weights from weight matrix entries blend by their ratio
+    weight_matrix = rig_utils.WeightMatrix.from_entries(1, [0, 0], [0, 1], [3.0, 1.0], 2)
+    matrices = np.array([translation(4.0, 0.0, 0.0), np.identity(4)])
+    vert_ids, group_ids, weights = weight_matrix.entries()
+    result = rig_utils.linear_blend_skinning(COORDS[:1], vert_ids, group_ids, weights, matrices)
+    np.testing.assert_allclose(result, [[3.0, 0.0, 0.0]], atol=1e-12)
+
+def test_remap_groups():
+    weight_matrix = rig_utils.WeightMatrix.from_entries(2, [0, 1], [0, 0], [1.0, 1.0], 2)
+    remapped = weight_matrix.remap_groups([1, 0], vert_mask=[False, True])
+    np.testing.assert_array_equal(remapped.group_ids, [0, 1])
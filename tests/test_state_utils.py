@@ -0,0 +1,118 @@
+from types import SimpleNamespace
+import numpy as np
+import state_utils
+from blender_stub import Collection
+
+def layers(*ids, size=20):
+    return tuple(i in ids for i in range(size))
+
+def make_pose_bone(name):
+    return SimpleNamespace(name=name, rotation_mode='QUATERNION', location=(0.0, 0.0, 0.0),
+            rotation_quaternion=(1.0, 0.0, 0.0, 0.0), rotation_euler=(0.0, 0.0, 0.0),
+            rotation_axis_angle=(0.0, 0.0, 1.0, 0.0), scale=(1.0, 1.0, 1.0))
+
+def make_object(name, obj_type='MESH', bone_names=()):
+    obj = SimpleNamespace(name=name, type=obj_type, select=False, hide=False, mode='OBJECT', layers=layers(0))
+    if obj_type == 'ARMATURE':
+        bones = Collection(SimpleNamespace(name=n, hide=False, hide_select=False) for n in bone_names)
+        obj.data = SimpleNamespace(bones=bones, layers=layers(0, size=32))
+        obj.pose = SimpleNamespace(bones=Collection(make_pose_bone(n) for n in bone_names))
+    return obj
+
+def make_scene():
+    objects = Collection([make_object('body'), make_object('rig', 'ARMATURE', ['root', 'hand.L', 'hand.R']),
+        make_object('eyes')])
+    objects[0].select = True
+    objects.active = objects[0]
+    return SimpleNamespace(objects=objects, layers=layers(0, 1))
+
+# Mode switch of active object, like bpy.ops.object.mode_set
+def fake_mode_set(scene):
+    def mode_set(mode):
+        scene.objects.active.mode = mode
+    return mode_set
+
+def test_revert_without_changes_writes_nothing():
+    scene = make_scene()
+    state = state_utils.SceneState(scene, mode_set=fake_mode_set(scene))
+    state.revert()
+    assert set(state.writes) <= {'pose'}
+
+def test_revert_restores_changes():
+    scene = make_scene()
+    body, rig, eyes = scene.objects
+    rig.mode = 'POSE'
+    eyes.hide = True
+    state = state_utils.SceneState(scene, mode_set=fake_mode_set(scene))
+
+    body.select = False
+    rig.select = True
+    rig.mode = 'OBJECT'
+    eyes.hide = False
+    eyes.layers = layers(3)
+    scene.layers = layers(3)
+    scene.objects.active = eyes
+    rig.data.bones[1].hide = True
+    rig.data.layers = layers(5, size=32)
+    rig.pose.bones[2].location = (1.0, 2.0, 3.0)
+
+    state.revert()
+
+    assert [o.select for o in scene.objects] == [True, False, False]
+    assert rig.mode == 'POSE'
+    assert eyes.hide and eyes.layers == layers(0)
+    assert scene.layers == layers(0, 1)
+    assert scene.objects.active is body
+    assert not rig.data.bones[1].hide
+    assert rig.data.layers == layers(0, size=32)
+    np.testing.assert_allclose(rig.pose.bones[2].location, (0.0, 0.0, 0.0))
+    assert state.writes['selection'] == 2
+    assert state.writes['layers'] == 3
+    assert state.writes['bones'] == 1
+
+def test_revert_skips_removed_and_deselects_added_objects():
+    scene = make_scene()
+    state = state_utils.SceneState(scene, mode_set=fake_mode_set(scene))
+
+    del scene.objects[2]
+    added = make_object('added')
+    added.select = True
+    scene.objects.append(added)
+    scene.objects[0].select = False
+
+    state.revert()
+    assert scene.objects[0].select
+    assert not added.select
+
+def test_partial_revert_only_touches_given_objects():
+    scene = make_scene()
+    body, rig, eyes = scene.objects
+    state = state_utils.SceneState(scene, skip_armatures={'rig'}, objects=[body], mode_set=fake_mode_set(scene))
+    assert state.object_names == ['body'] and not state.armatures
+
+    body.select = False
+    eyes.select = True
+    rig.pose.bones[0].scale = (2.0, 2.0, 2.0)
+    state.revert()
+
+    assert body.select and eyes.select
+    assert rig.pose.bones[0].scale == (2.0, 2.0, 2.0)
+
+def test_pose_buffer_transformed_and_reset():
+    rig = make_object('rig', 'ARMATURE', ['root', 'hand.L', 'hand.R'])
+    pose_bones = rig.pose.bones
+    pose_bones[1].location = (0.0, 1.0, 0.0)
+    pose_bones[2].rotation_mode = 'XYZ'
+    pose_bones[2].rotation_euler = (0.5, 0.0, 0.0)
+    # Unused rotation channel doesn't count as transformed
+    pose_bones[0].rotation_euler = (0.3, 0.0, 0.0)
+
+    buffer = state_utils.PoseBuffer(pose_bones)
+    assert buffer.transformed_names() == ['hand.L', 'hand.R']
+
+    buffer.reset(pose_bones, names=['hand.L'])
+    assert list(pose_bones[1].location) == [0.0, 0.0, 0.0]
+    assert state_utils.PoseBuffer(pose_bones).transformed_names() == ['hand.R']
+
+    buffer.restore(pose_bones)
+    assert state_utils.PoseBuffer(pose_bones).transformed_names() == ['hand.L', 'hand.R']